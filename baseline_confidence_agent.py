@@ -1,13 +1,22 @@
 from collections import defaultdict, deque
 import numpy as np
-import random
+from checkpoint import save_arrays, load_arrays, encode_keys, decode_keys, prefixed, section
+from dense_q_table import DenseQTable, default_row, make_q_table, table_to_arrays, load_table_arrays
+from prioritized_replay import UniformReplayBuffer
+from td_update import batch_td_update
 
 class BaselineConfidenceAgent:
     """基线智能体：基于实验一 ProposedAgent 的 Q-learning 模型"""
-    def __init__(self, action_space):
+    # 检查点格式版本和需要保存的自适应参数
+    CHECKPOINT_VERSION = 1
+    CHECKPOINT_PARAMS = ('epsilon', 'alpha', 'gamma')
+    
+    def __init__(self, action_space, observation_space=None, grid_size=None, max_buffer_size=1000):
         self.action_space = action_space
-        self.q_table = {}
-        self.default_q_values = np.zeros(action_space.n)
+        # 未写入过的状态共享这一行只读的默认 Q 值，第一次写入时才复制
+        self.default_q_values = default_row(action_space.n)
+        # 提供观察空间时使用稠密数组 Q 表，否则使用 dict
+        self.q_table = make_q_table(observation_space, self.default_q_values, grid_size)
         
         # 修改这些参数
         self.epsilon = 0.3  # 增加探索概率
@@ -31,11 +40,14 @@ class BaselineConfidenceAgent:
         self.unvisited_bonus = 0.08  # 增加未访问奖励
         self.distance_weight = 0.15  # 增加距离权重
 
-        self.experience_buffer = deque(maxlen=1000)  # 添加经验回放
+        # 经验回放：预分配的环形缓冲区，均匀采样
+        self.experience_buffer = UniformReplayBuffer(max_buffer_size, rng=self.np_random)
         self.min_epsilon = 0.1
 
     def _state_to_key(self, state):
-        """将状态转换为 Q 表的键"""
+        """将状态转换为 Q 表的键：扁平整数状态直接使用，坐标状态转为元组"""
+        if isinstance(state, (int, np.integer)):
+            return int(state)
         return tuple(state)
 
     def calculate_confidence(self, steps, shortest_path):
@@ -48,7 +60,7 @@ class BaselineConfidenceAgent:
         if self.np_random.random() < self.epsilon:
             return self.action_space.sample()
         
-        state_key = tuple(state)
+        state_key = self._state_to_key(state)
         q_values = self.q_table.get(state_key, self.default_q_values)
         
         # 添加一些随机性来打破平局
@@ -58,13 +70,11 @@ class BaselineConfidenceAgent:
 
     def learn(self, state, action, reward, next_state, done, steps, shortest_path):
         # 存储经验
-        self.experience_buffer.append((state, action, reward, next_state, done))
+        self.experience_buffer.add(state, action, reward, next_state, done)
         
         # 从经验中随机采样学习
         if len(self.experience_buffer) >= 32:
-            batch = random.sample(self.experience_buffer, 32)
-            for s, a, r, ns, d in batch:
-                self._update_q_value(s, a, r, ns, d)
+            self._learn_from_experience()
         
         # 缓慢衰减探索率
         if done:
@@ -72,7 +82,7 @@ class BaselineConfidenceAgent:
                              self.epsilon * self.epsilon_decay)
 
         # 更新访问状态集合
-        self.visited_states.add(tuple(next_state))
+        self.visited_states.add(self._state_to_key(next_state))
 
         # 更新历史记录
         self.reward_history.append(reward)
@@ -80,21 +90,68 @@ class BaselineConfidenceAgent:
             self.step_history.append(steps)
             self.success_history.append(1 if reward > 0 else 0)
 
-    def _update_q_value(self, state, action, reward, next_state, done):
-        state_key = tuple(state)
-        next_state_key = tuple(next_state)
+    def save(self, path):
+        """保存检查点：路径以 .npz 结尾时保存为压缩文件，否则保存为 .npy 文件目录"""
+        arrays = {
+            'meta': np.array([self.CHECKPOINT_VERSION, self.action_space.n], dtype=np.int64),
+            'params': np.array([getattr(self, name) for name in self.CHECKPOINT_PARAMS], dtype=np.float64),
+            'visited_states': encode_keys(list(self.visited_states)),
+            'reward_history': np.array(self.reward_history, dtype=np.float64),
+            'step_history': np.array(self.step_history, dtype=np.float64),
+            'success_history': np.array(self.success_history, dtype=np.int64),
+        }
+        arrays.update(prefixed('q', table_to_arrays(self.q_table)))
+        arrays.update(prefixed('replay', self.experience_buffer.to_arrays()))
+        save_arrays(path, arrays)
+    
+    def load(self, path, mmap=False):
+        """加载检查点（mmap=True 时目录格式以写时复制方式内存映射）"""
+        arrays = load_arrays(path, mmap=mmap)
+        version, n_actions = (int(v) for v in arrays['meta'])
+        if version != self.CHECKPOINT_VERSION:
+            raise ValueError(f"Unsupported checkpoint version {version}")
+        if n_actions != self.action_space.n:
+            raise ValueError("Checkpoint does not match the agent's action space")
         
-        # 获取Q值
-        if state_key not in self.q_table:
-            self.q_table[state_key] = self.default_q_values.copy()
-        if next_state_key not in self.q_table:
-            self.q_table[next_state_key] = self.default_q_values.copy()
+        for name, value in zip(self.CHECKPOINT_PARAMS, arrays['params']):
+            setattr(self, name, float(value))
+        load_table_arrays(self.q_table, section(arrays, 'q'))
+        self.visited_states = set(decode_keys(arrays['visited_states']))
+        self.reward_history.clear()
+        self.reward_history.extend(arrays['reward_history'].tolist())
+        self.step_history.clear()
+        self.step_history.extend(arrays['step_history'].tolist())
+        self.success_history.clear()
+        self.success_history.extend(arrays['success_history'].tolist())
+        self.experience_buffer.load_arrays(section(arrays, 'replay'))
+        return self
+    
+    def _learn_from_experience(self):
+        """均匀采样一批经验，做一次向量化的 Q 学习更新"""
+        batch = self.experience_buffer.records[self.experience_buffer.sample(32)]
+        table = self.q_table
+        if isinstance(table, DenseQTable):
+            # 稠密表：直接在 Q 数组上按行号读写
+            rows = table.rows_for(batch['state'])
+            next_rows = table.rows_for(batch['next_state'])
+            table.touch(rows)
+            batch_td_update(table.q, rows, next_rows, batch['action'], batch['reward'], self.alpha, self.gamma,
+                            max_q=table.max_q)
+            return
         
-        # Q-learning更新
-        old_value = self.q_table[state_key][action]
-        next_max = np.max(self.q_table[next_state_key])
-        new_value = (1 - self.alpha) * old_value + self.alpha * (reward + self.gamma * next_max)
-        self.q_table[state_key][action] = new_value
+        # dict 表：把本批涉及的状态收集到临时矩阵中，更新后只写回被更新的状态
+        to_key = self.experience_buffer.to_key
+        keys = {}
+        rows = np.array([keys.setdefault(to_key(s), len(keys)) for s in batch['state']], dtype=np.intp)
+        next_rows = np.array([keys.setdefault(to_key(s), len(keys)) for s in batch['next_state']], dtype=np.intp)
+        q = np.array([table.get(key, self.default_q_values) for key in keys], dtype=np.float64)
+        batch_td_update(q, rows, next_rows, batch['action'], batch['reward'], self.alpha, self.gamma)
+        keys = list(keys)
+        for row in np.unique(rows):
+            if keys[row] in table:
+                table[keys[row]][:] = q[row]
+            else:
+                table[keys[row]] = q[row].copy()
 
 
 if __name__ == "__main__":
@@ -106,11 +163,11 @@ if __name__ == "__main__":
 
     # 模拟一回合
     state, _ = env.reset()
-    done = False
+    done = truncated = False
     steps = 0
-    while not done:
+    while not (done or truncated):
         action = agent.select_action(state)
-        next_state, reward, done, _, _ = env.step(action)
+        next_state, reward, done, truncated, _ = env.step(action)
         shortest_path = env.get_optimal_path_length()
         agent.learn(state, action, reward, next_state, done, steps, shortest_path)
         state = next_state
@@ -0,0 +1,126 @@
+import sys
+import time
+import tracemalloc
+import numpy as np
+from reflection_agent import ReflectionAgent
+from baseline_confidence_agent import BaselineConfidenceAgent
+
+
+class _CountingTable(dict):
+    """记录新状态插入次数的 dict Q 表：每次插入一个新键就是为某个状态物化了一行
+
+    不区分这一行来自复制默认行还是回放写回时复制的临时矩阵行，两种分配都会被计入。
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.materialized = 0
+
+    def __setitem__(self, key, row):
+        if key not in self:
+            self.materialized += 1
+        super().__setitem__(key, row)
+
+
+def _count_materialized_rows(agent):
+    """把智能体（dict 后端）的空 Q 表换成计数的 dict，需在任何学习之前调用"""
+    names = ('q_table',) if hasattr(agent, 'q_table') else ('q_table_short_term', 'q_table_long_term')
+    tables = []
+    for name in names:
+        if not isinstance(getattr(agent, name), dict) or getattr(agent, name):
+            raise ValueError("only empty dict-backed Q tables can be counted")
+        tables.append(_CountingTable())
+        setattr(agent, name, tables[-1])
+    return tables
+
+
+class _EagerReflectionAgent(ReflectionAgent):
+    """对照组：读取未见过的状态时就为它分配一行（写时复制之前的行为）"""
+
+    def _q_values(self, table, state_key):
+        if state_key not in table:
+            table[state_key] = self.default_q_values.copy()
+        return table[state_key]
+
+
+class _EagerBaselineAgent(BaselineConfidenceAgent):
+    """对照组：学习时为当前状态和下一状态都分配一行"""
+
+    def learn(self, state, action, reward, next_state, done, steps, shortest_path):
+        for key in (self._state_to_key(state), self._state_to_key(next_state)):
+            if key not in self.q_table:
+                self.q_table[key] = self.default_q_values.copy()
+        super().learn(state, action, reward, next_state, done, steps, shortest_path)
+
+
+class _ActionSpace:
+    """只提供 n 和 sample 的离散动作空间"""
+
+    def __init__(self, n, rng):
+        self.n = n
+        self.rng = rng
+
+    def sample(self):
+        return int(self.rng.integers(self.n))
+
+
+MOVES = np.array([(-1, 0), (1, 0), (0, -1), (0, 1)])
+
+
+def run_workload(agent, steps, size, seed):
+    """在一个开阔的大网格上做分段随机游走（每段 200 步，随机起点）
+
+    返回用时，以及 tracemalloc 测得的净分配字节数和峰值字节数。
+    """
+    rng = np.random.default_rng(seed)
+    goal = np.array([size - 1, size - 1])
+    if hasattr(agent, 'set_goal_position'):
+        agent.set_goal_position(goal)
+    tracemalloc.start()
+    baseline_bytes = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    pos = rng.integers(size, size=2)
+    for step in range(steps):
+        if step % 200 == 0:
+            pos = rng.integers(size, size=2)
+        action = int(agent.select_action(pos))
+        next_pos = pos + MOVES[action]
+        hit_wall = np.any((next_pos < 0) | (next_pos >= size))
+        next_pos = pos if hit_wall else next_pos
+        reward = -1.0 if hit_wall else -0.1
+        steps_taken = step % 200 + 1
+        agent.learn(pos, action, reward, next_pos, False, steps_taken, 2 * steps_taken)
+        pos = next_pos
+    seconds = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds, current - baseline_bytes, peak - baseline_bytes
+
+
+def run_benchmark(steps=20_000, size=300, seed=0):
+    """对比写时复制与急切分配在相同工作负载下通过 learn 分配的 Q 行
+
+    两个智能体都使用 dict 后端（稠密表的行是预分配的，写时复制不改变它的内存）。每个智能体报告：
+    运行中物化的状态行数（Q 表插入新键的次数，包括复制默认行和回放写回时复制的行）、结束时
+    Q 表中还保留的行数，以及 tracemalloc 测得的净分配字节数和峰值字节数（包括回放缓冲区等
+    其他结构，两组之间的差值才是 Q 行的开销）。
+    """
+    print(f"{steps} steps on a {size}x{size} grid through learn() (dict Q tables)")
+    print(f"{'agent':<28}{'rows made':>11}{'rows held':>11}{'net bytes':>14}{'peak bytes':>14}{'seconds':>10}")
+    groups = (
+        ('reflection', _EagerReflectionAgent, ReflectionAgent),
+        ('baseline', _EagerBaselineAgent, BaselineConfidenceAgent),
+    )
+    for name, eager_class, agent_class in groups:
+        for label, cls in (('eager', eager_class), ('copy-on-write', agent_class)):
+            agent = cls(_ActionSpace(4, np.random.default_rng(seed)))
+            agent.np_random = np.random.default_rng(seed)
+            tables = _count_materialized_rows(agent)
+            seconds, allocated, peak = run_workload(agent, steps, size, seed)
+            made = sum(table.materialized for table in tables)
+            held = sum(len(table) for table in tables)
+            print(f"{name + ' (' + label + ')':<28}{made:>11}{held:>11}{allocated:>14}{peak:>14}{seconds:>10.1f}")
+
+
+if __name__ == "__main__":
+    run_benchmark(steps=int(sys.argv[1]) if len(sys.argv) > 1 else 20_000)
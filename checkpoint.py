@@ -0,0 +1,51 @@
+import os
+import numpy as np
+
+
+def save_arrays(path, arrays):
+    """保存一组命名数组：路径以 .npz 结尾时保存为压缩文件，否则保存为 .npy 文件目录"""
+    if str(path).endswith('.npz'):
+        np.savez_compressed(path, **arrays)
+        return
+    os.makedirs(path, exist_ok=True)
+    for name, array in arrays.items():
+        np.save(os.path.join(path, f'{name}.npy'), array)
+
+
+def load_arrays(path, mmap=False):
+    """加载一组命名数组
+
+    目录格式在 mmap=True 时以写时复制方式内存映射：多个进程共享同一份只读页面，
+    只有被某个进程修改的页面才会在该进程中复制。
+    """
+    if str(path).endswith('.npz'):
+        with np.load(path) as data:
+            return {name: data[name] for name in data.files}
+    mode = 'c' if mmap else None
+    return {name[:-len('.npy')]: np.load(os.path.join(path, name), mmap_mode=mode)
+            for name in os.listdir(path) if name.endswith('.npy')}
+
+
+def prefixed(prefix, arrays):
+    """给一组数组的名字加上组件前缀"""
+    return {f'{prefix}__{name}': array for name, array in arrays.items()}
+
+
+def section(arrays, prefix):
+    """取出某个组件前缀下的数组（去掉前缀）"""
+    start = f'{prefix}__'
+    return {name[len(start):]: array for name, array in arrays.items() if name.startswith(start)}
+
+
+def encode_keys(keys):
+    """将状态键列表编码为整数数组：坐标键为 (N, 2)，扁平整数键为 (N,)"""
+    if not keys:
+        return np.zeros(0, dtype=np.int64)
+    return np.array([key if isinstance(key, (int, np.integer)) else tuple(key) for key in keys], dtype=np.int64)
+
+
+def decode_keys(array):
+    """encode_keys 的逆变换"""
+    if array.ndim == 1:
+        return [int(key) for key in array]
+    return [tuple(row) for row in array.tolist()]
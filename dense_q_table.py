@@ -0,0 +1,222 @@
+import numpy as np
+from collections.abc import MutableMapping
+from gymnasium import spaces
+from checkpoint import encode_keys, decode_keys
+
+
+def default_row(n_actions):
+    """所有未写入状态共享的只读默认 Q 行"""
+    row = np.zeros(n_actions)
+    row.flags.writeable = False
+    return row
+
+
+class DenseQTable(MutableMapping):
+    """稠密数组实现的 Q 表，接口与 dict 相同
+
+    所有状态的 Q 值保存在一个 (状态数, 动作数) 的数组中，另用布尔掩码记录哪些状态
+    已经被写入，因此新状态不再需要单独的 dict 条目和小数组。键可以是坐标 (行, 列)
+    或扁平整数 row * cols + col；读取返回数组中的一行视图，可以直接原地修改。
+
+    max_q 保存每个状态的最大 Q 值，在写入时更新，按最大 Q 值选择状态时不必扫描整个 Q 数组。
+    通过 set_value、__setitem__、assign、discard 写入时自动维护；直接修改 q 数组后需调用
+    refresh_max。
+    """
+
+    def __init__(self, shape, default_q_values, index_keys=False):
+        self.shape = tuple(int(n) for n in shape)
+        self.default_q_values = np.asarray(default_q_values, dtype=np.float64)
+        self.n_actions = len(self.default_q_values)
+        # index_keys 为 True 时迭代返回整数键，否则返回 (行, 列) 元组
+        self.index_keys = index_keys
+        self.num_states = int(np.prod(self.shape))
+        self.q = np.tile(self.default_q_values, (self.num_states, 1))
+        self.max_q = np.full(self.num_states, self.default_q_values.max())
+        self.mask = np.zeros(self.num_states, dtype=bool)
+        self._count = 0
+
+    @classmethod
+    def row_nbytes(cls, n_actions):
+        """每个状态占用的字节数（Q 值、最大 Q 值和写入标记），由数据类型和形状算出"""
+        return np.dtype(np.float64).itemsize * (n_actions + 1) + np.dtype(bool).itemsize
+
+    @property
+    def grid(self):
+        """按网格形状查看的 Q 值视图，例如 (size, size, n_actions)"""
+        return self.q.reshape(self.shape + (self.n_actions,))
+
+    def index_of(self, key):
+        """将键转换为数组行号，越界或格式不符时抛出 KeyError"""
+        if isinstance(key, (int, np.integer)):
+            index = int(key)
+            if 0 <= index < self.num_states:
+                return index
+            raise KeyError(key)
+        if len(self.shape) != 2 or len(key) != 2:
+            raise KeyError(key)
+        row, col = int(key[0]), int(key[1])
+        if 0 <= row < self.shape[0] and 0 <= col < self.shape[1]:
+            return row * self.shape[1] + col
+        raise KeyError(key)
+
+    def find(self, key):
+        """查找已有键的行号，不分配新行（稠密表的行号由键直接算出，与 index_of 相同）"""
+        return self.index_of(key)
+
+    def indices_of(self, keys):
+        """批量将键转换为行号数组"""
+        return np.fromiter((self.index_of(key) for key in keys), dtype=np.intp, count=len(keys))
+
+    def rows_for(self, states):
+        """将状态数组（(N,) 扁平整数或 (N, 2) 坐标）批量转换为行号"""
+        states = np.asarray(states, dtype=np.intp)
+        if states.ndim == 1:
+            rows = states
+        elif len(self.shape) == 2:
+            rows = states[:, 0] * self.shape[1] + states[:, 1]
+            if np.any((states < 0) | (states >= self.shape)):
+                raise KeyError("state out of table bounds")
+        else:
+            raise KeyError("coordinate states need a 2-D table")
+        if np.any((rows < 0) | (rows >= self.num_states)):
+            raise KeyError("state out of table bounds")
+        return rows
+
+    def key_of(self, index):
+        """将数组行号转换回键"""
+        index = int(index)
+        if self.index_keys or len(self.shape) != 2:
+            return index
+        return divmod(index, self.shape[1])
+
+    def indices(self):
+        """所有已写入状态的行号"""
+        return np.flatnonzero(self.mask)
+
+    def refresh_max(self, indices):
+        """直接修改 q 数组中若干行之后，重新计算这些行的最大 Q 值"""
+        self.max_q[indices] = self.q[indices].max(axis=-1)
+
+    def set_value(self, key, action, value):
+        """写入一个 Q 值（状态第一次写入时从默认行开始）"""
+        index = self.index_of(key)
+        row = self.q[index]
+        row[action] = value
+        self.max_q[index] = row.max()
+        if not self.mask[index]:
+            self.mask[index] = True
+            self._count += 1
+
+    def assign(self, indices, rows):
+        """批量写入若干行并标记为已存在"""
+        self.q[indices] = rows
+        self.refresh_max(indices)
+        self.mask[indices] = True
+        self._count = int(np.count_nonzero(self.mask))
+
+    def touch(self, indices):
+        """确保若干行存在（新行使用默认 Q 值）"""
+        self.mask[indices] = True
+        self._count = int(np.count_nonzero(self.mask))
+
+    def discard(self, indices):
+        """批量删除若干行，恢复为默认 Q 值"""
+        self.q[indices] = self.default_q_values
+        self.max_q[indices] = self.default_q_values.max()
+        self.mask[indices] = False
+        self._count = int(np.count_nonzero(self.mask))
+
+    def __contains__(self, key):
+        try:
+            return bool(self.mask[self.find(key)])
+        except (KeyError, TypeError):
+            return False
+
+    def __getitem__(self, key):
+        index = self.find(key)
+        if not self.mask[index]:
+            raise KeyError(key)
+        return self.q[index]
+
+    def __setitem__(self, key, value):
+        index = self.index_of(key)
+        self.q[index] = value
+        self.max_q[index] = self.q[index].max()
+        if not self.mask[index]:
+            self.mask[index] = True
+            self._count += 1
+
+    def __delitem__(self, key):
+        index = self.find(key)
+        if not self.mask[index]:
+            raise KeyError(key)
+        self.q[index] = self.default_q_values
+        self.max_q[index] = self.default_q_values.max()
+        self.mask[index] = False
+        self._count -= 1
+
+    def __iter__(self):
+        for index in np.flatnonzero(self.mask):
+            yield self.key_of(index)
+
+    def __len__(self):
+        return self._count
+
+
+def table_to_arrays(table):
+    """将 Q 表（稠密表或 dict）导出为数组（用于检查点）"""
+    if isinstance(table, DenseQTable):
+        return {'q': table.q, 'mask': table.mask}
+    keys = list(table.keys())
+    rows = np.array([table[key] for key in keys], dtype=np.float64) if keys else np.zeros((0, 0))
+    return {'keys': encode_keys(keys), 'rows': rows}
+
+
+def load_table_arrays(table, arrays):
+    """从检查点数组原地恢复 Q 表；稠密表直接使用（可能是内存映射的）Q 数组"""
+    if isinstance(table, DenseQTable):
+        if 'q' not in arrays or arrays['q'].shape != table.q.shape:
+            raise ValueError("Checkpoint Q-table does not match the dense table layout")
+        table.q = arrays['q']
+        table.max_q = table.q.max(axis=1)
+        table.mask = np.array(arrays['mask'], dtype=bool)
+        table._count = int(np.count_nonzero(table.mask))
+        return
+    if 'keys' not in arrays:
+        raise ValueError("Checkpoint was saved from a dense Q-table")
+    table.clear()
+    table.update(zip(decode_keys(arrays['keys']), np.array(arrays['rows'], dtype=np.float64)))
+
+
+# 状态数超过该值时不使用稠密数组（避免为巨大的观察空间预分配内存）
+MAX_DENSE_STATES = 1 << 22
+
+
+def dense_shape(observation_space, grid_size=None):
+    """根据观察空间推断稠密 Q 表的形状，无法推断时返回 None"""
+    if isinstance(observation_space, spaces.Discrete):
+        n = int(observation_space.n)
+        if n > MAX_DENSE_STATES:
+            return None
+        if grid_size and n == grid_size * grid_size:
+            return (grid_size, grid_size), True
+        return (n,), True
+    if (isinstance(observation_space, spaces.Box) and observation_space.shape == (2,)
+            and np.issubdtype(observation_space.dtype, np.integer)
+            and np.all(observation_space.low == 0)):
+        rows, cols = (observation_space.high.astype(np.int64) + 1)
+        if rows * cols > MAX_DENSE_STATES:
+            return None
+        return (int(rows), int(cols)), False
+    return None
+
+
+def make_q_table(observation_space, default_q_values, grid_size=None):
+    """创建 Q 表：观察空间形状已知时使用稠密数组，否则回退到 dict"""
+    if observation_space is None:
+        return {}
+    layout = dense_shape(observation_space, grid_size)
+    if layout is None:
+        return {}
+    shape, index_keys = layout
+    return DenseQTable(shape, default_q_values, index_keys=index_keys)
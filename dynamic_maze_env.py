@@ -2,19 +2,320 @@ import numpy as np
 import gymnasium as gym
 from gymnasium import spaces
 import logging
+import os
+import heapq
+import copy
+import functools
+from collections import deque
+from events import EventLog
+
+
+def bfs_distance_map(maze, source):
+    """从source出发在空格上做逐层广度优先搜索，返回到每个格子的步数（不可达为inf）"""
+    height, width = maze.shape
+    free = maze.ravel() == 0
+    dist = np.full(height * width, np.inf)
+    
+    start = int(source[0]) * width + int(source[1])
+    dist[start] = 0
+    frontier = np.array([start])
+    depth = 0
+    while frontier.size:
+        depth += 1
+        rows, cols = np.divmod(frontier, width)
+        neighbours = np.concatenate([
+            frontier[rows > 0] - width,
+            frontier[rows < height - 1] + width,
+            frontier[cols > 0] - 1,
+            frontier[cols < width - 1] + 1
+        ])
+        neighbours = neighbours[free[neighbours] & np.isinf(dist[neighbours])]
+        frontier = np.unique(neighbours)
+        dist[frontier] = depth
+    
+    return dist.reshape(height, width)
+
+
+def label_components(maze):
+    """用并查集（挂接+路径压缩）给空格的四连通分量编号，障碍物标记为-1"""
+    height, width = maze.shape
+    free = maze.ravel() == 0
+    cells = np.arange(height * width).reshape(height, width)
+    free_2d = free.reshape(height, width)
+    
+    # 相邻空格之间的边
+    horizontal = free_2d[:, :-1] & free_2d[:, 1:]
+    vertical = free_2d[:-1, :] & free_2d[1:, :]
+    src = np.concatenate([cells[:, :-1][horizontal], cells[:-1, :][vertical]])
+    dst = np.concatenate([cells[:, 1:][horizontal], cells[1:, :][vertical]])
+    
+    labels = np.arange(height * width)
+    while True:
+        low = np.minimum(labels[src], labels[dst])
+        high = np.maximum(labels[src], labels[dst])
+        pending = low != high
+        if not pending.any():
+            break
+        # 较大的根挂到较小的根上，然后压缩路径
+        np.minimum.at(labels, high[pending], low[pending])
+        while True:
+            compressed = labels[labels]
+            if np.array_equal(compressed, labels):
+                break
+            labels = compressed
+    
+    labels[~free] = -1
+    return labels.reshape(height, width)
+
+
+def _grid_neighbours(cells, height, width):
+    """返回 cells 中每个格子的四邻域，形式为 (源格子, 邻居格子) 两个数组"""
+    rows, cols = np.divmod(cells, width)
+    src = np.concatenate([cells[rows > 0], cells[rows < height - 1],
+                          cells[cols > 0], cells[cols < width - 1]])
+    dst = np.concatenate([cells[rows > 0] - width, cells[rows < height - 1] + width,
+                          cells[cols > 0] - 1, cells[cols < width - 1] + 1])
+    return src, dst
+
+
+def min_walls_to_connect(maze, start, goal, labels=None):
+    """找出连通start和goal所需清除的最少障碍物
+    
+    在"连通分量+障碍物"图上做逐层0-1 BFS：进入障碍物代价为1，
+    进入空格代价为0（整个连通分量一次性吸收），每一层都用NumPy向量化完成。
+    """
+    if labels is None:
+        labels = label_components(maze)
+    height, width = maze.shape
+    is_wall = maze.ravel() == 1
+    flat_labels = labels.ravel()
+    start = int(start[0]) * width + int(start[1])
+    goal = int(goal[0]) * width + int(goal[1])
+    if flat_labels[start] >= 0 and flat_labels[start] == flat_labels[goal]:
+        return []
+    
+    # parent 以分量根或障碍物格子为节点记录回溯路径
+    cost = np.full(height * width, -1)
+    parent = np.full(height * width, -1)
+    
+    def absorb_components(walls, level):
+        """吸收与新障碍物相邻且尚未访问的连通分量，返回这些分量的所有格子"""
+        src, dst = _grid_neighbours(walls, height, width)
+        keep = ~is_wall[dst] & (cost[dst] < 0)
+        roots, first = np.unique(flat_labels[dst[keep]], return_index=True)
+        if roots.size == 0:
+            return roots
+        parent[roots] = src[keep][first]
+        cells = np.flatnonzero(np.isin(flat_labels, roots))
+        cost[cells] = level
+        return cells
+    
+    if is_wall[start]:
+        cost[start] = 0
+        frontier = np.concatenate([[start], absorb_components(np.array([start]), 0)])
+    else:
+        frontier = np.flatnonzero(flat_labels == flat_labels[start])
+        cost[frontier] = 0
+    
+    level = 0
+    while cost[goal] < 0 and frontier.size:
+        level += 1
+        src, dst = _grid_neighbours(frontier, height, width)
+        keep = is_wall[dst] & (cost[dst] < 0)
+        walls, first = np.unique(dst[keep], return_index=True)
+        wall_parents = src[keep][first]
+        free_parents = ~is_wall[wall_parents]
+        wall_parents[free_parents] = flat_labels[wall_parents[free_parents]]
+        parent[walls] = wall_parents
+        cost[walls] = level
+        frontier = np.concatenate([walls, absorb_components(walls, level)])
+    
+    # 从目标分量沿父节点回溯，路径上的障碍物就是需要清除的格子
+    cleared = []
+    node = flat_labels[goal]
+    while parent[node] >= 0:
+        node = parent[node]
+        if is_wall[node] and node != start:
+            cleared.append(divmod(int(node), width))
+    return cleared[::-1]
+
+
+def _resolve_moves(env, positions, previous_positions, goal_pos, actions, is_wall):
+    """向量化地处理一批移动
+    
+    越界或撞墙的智能体原地不动并得到碰撞惩罚，其余按标量环境的规则计算奖励和结束标志。
+    is_wall(cells) 返回 (n, 2) 个格子是否为障碍物。返回新位置、奖励、终止标志（只有到达目标才终止，
+    超时由调用方通过 truncated 报告）和成功移动的掩码。
+    """
+    next_pos = positions + env.ACTION_DELTAS[actions]
+    in_bounds = ((next_pos >= 0) & (next_pos < env.size)).all(axis=1)
+    moved = in_bounds & ~is_wall(np.clip(next_pos, 0, env.size - 1))
+    new_positions = np.where(moved[:, None], next_pos, positions).astype(np.int32)
+    
+    # 检查是否到达目标（撞墙的步不会结束episode）
+    reached_goal = moved & (new_positions == goal_pos).all(axis=1)
+    
+    # 奖励结构与标量环境相同
+    old_distance = np.abs(previous_positions - goal_pos).sum(axis=1)
+    new_distance = np.abs(new_positions - goal_pos).sum(axis=1)
+    rewards = np.where(
+        reached_goal,
+        env.GOAL_REWARD,
+        env.STEP_PENALTY + (old_distance - new_distance)
+    )
+    rewards = np.where(moved, rewards, env.COLLISION_PENALTY)
+    return new_positions, rewards, reached_goal, moved
+
+
+class DynamicDistanceField:
+    """以单一源点为根的动态最短路距离场
+    
+    格子在墙和空地之间翻转时，只修复受影响的区域（Ramalingam–Reps 式增量BFS），
+    而不是重新做一次完整的广度优先搜索。
+    """
+    
+    def __init__(self, maze, source):
+        self.height, self.width = maze.shape
+        self.source = (int(source[0]), int(source[1]))
+        self.free = maze == 0
+        self.dist = bfs_distance_map(maze, source)
+        self.last_affected = 0  # 最近一次更新中距离发生变化的格子数
+    
+    def copy(self):
+        """复制距离场"""
+        field = copy.copy(self)
+        field.free = self.free.copy()
+        field.dist = self.dist.copy()
+        return field
+    
+    def _neighbours(self, r, c):
+        """四邻域内的格子"""
+        if r > 0:
+            yield r - 1, c
+        if r < self.height - 1:
+            yield r + 1, c
+        if c > 0:
+            yield r, c - 1
+        if c < self.width - 1:
+            yield r, c + 1
+    
+    def update_cells(self, maze, cells):
+        """根据maze中若干格子的新状态增量修复距离场，返回距离变化的格子数"""
+        affected = 0
+        for r, c in cells:
+            r, c = int(r), int(c)
+            is_free = maze[r, c] == 0
+            if is_free == self.free[r, c]:
+                continue
+            if (r, c) == self.source:
+                raise ValueError("The source cell of a distance field cannot become a wall")
+            self.free[r, c] = is_free
+            if is_free:
+                affected += self._open_cell(r, c)
+            else:
+                affected += self._close_cell(r, c)
+        self.last_affected = affected
+        return affected
+    
+    def _open_cell(self, r, c):
+        """墙变为空地：距离只会减小，从该格子向外传播"""
+        dist = self.dist
+        best = min((dist[n] for n in self._neighbours(r, c) if self.free[n]), default=np.inf)
+        if np.isinf(best):
+            return 0
+        
+        dist[r, c] = best + 1
+        affected = 1
+        queue = deque([(r, c)])
+        while queue:
+            cell = queue.popleft()
+            next_dist = dist[cell] + 1
+            for n in self._neighbours(*cell):
+                if self.free[n] and dist[n] > next_dist:
+                    dist[n] = next_dist
+                    affected += 1
+                    queue.append(n)
+        return affected
+    
+    def _close_cell(self, r, c):
+        """空地变为墙：找出失去所有最短路父节点的格子，再从边界重新计算它们的距离"""
+        dist = self.dist
+        old = dist[r, c]
+        dist[r, c] = np.inf
+        if np.isinf(old):
+            return 0
+        
+        # 第一阶段：按距离层次找出受影响的格子
+        affected = {(r, c)}
+        checked = set()
+        queue = deque(n for n in self._neighbours(r, c) if self.free[n] and dist[n] == old + 1)
+        while queue:
+            cell = queue.popleft()
+            if cell in checked:
+                continue
+            checked.add(cell)
+            level = dist[cell]
+            supported = any(
+                self.free[n] and n not in affected and dist[n] == level - 1
+                for n in self._neighbours(*cell)
+            )
+            if supported:
+                continue
+            affected.add(cell)
+            queue.extend(n for n in self._neighbours(*cell) if self.free[n] and dist[n] == level + 1)
+        affected.discard((r, c))
+        
+        # 第二阶段：受影响格子的距离从未受影响的邻居出发重新计算
+        for cell in affected:
+            dist[cell] = np.inf
+        heap = []
+        for cell in affected:
+            best = min((dist[n] + 1 for n in self._neighbours(*cell) if self.free[n]), default=np.inf)
+            if best < dist[cell]:
+                dist[cell] = best
+                heapq.heappush(heap, (best, cell))
+        while heap:
+            d, cell = heapq.heappop(heap)
+            if d > dist[cell]:
+                continue
+            for n in self._neighbours(*cell):
+                if n in affected and d + 1 < dist[n]:
+                    dist[n] = d + 1
+                    heapq.heappush(heap, (d + 1, n))
+        
+        return len(affected) + 1
+
 
 class DynamicMazeEnv(gym.Env):
     """动态迷宫环境"""
     
+    metadata = {'render_modes': []}
+    
     # 定义动作空间
     ACTIONS = {
-        0: np.array([-1, 0]),  # 上
-        1: np.array([1, 0]),   # 下
-        2: np.array([0, -1]),  # 左
-        3: np.array([0, 1])    # 右
+        0: np.array([-1, 0], dtype=np.int32),  # 上
+        1: np.array([1, 0], dtype=np.int32),   # 下
+        2: np.array([0, -1], dtype=np.int32),  # 左
+        3: np.array([0, 1], dtype=np.int32)    # 右
     }
     
-    def __init__(self, size=10, obstacle_ratio=0.3, change_frequency=20, seed=None):
+    # 按动作编号堆叠的位移数组，供向量化的环境使用
+    ACTION_DELTAS = np.stack(list(ACTIONS.values())).astype(np.int32)
+    
+    # 可选的迷宫生成器（也可以直接传入 generator(env) -> maze 的可调用对象）
+    GENERATORS = {
+        'random': '_generate_random',            # 均匀散布障碍物（原始方式，不保证连通）
+        'backtracker': '_generate_backtracker',  # 递归回溯迷宫
+        'prim': '_generate_prim',                # 随机Prim迷宫
+        'kruskal': '_generate_kruskal',          # 随机Kruskal迷宫
+        'percolation': '_generate_percolation',  # 按目标密度修剪随机生成树，保证连通
+    }
+    
+    # 观察模式：'coords' 返回 (行, 列) 数组，'index' 返回扁平整数 row * size + col
+    OBSERVATION_MODES = ('coords', 'index')
+    
+    def __init__(self, size=10, obstacle_ratio=0.3, change_frequency=20, seed=None, generator='random',
+                 observation_mode='coords'):
         super().__init__()
         
         # 环境参数
@@ -22,10 +323,19 @@ class DynamicMazeEnv(gym.Env):
         self.obstacle_ratio = obstacle_ratio
         self.change_frequency = change_frequency
         self.max_steps = 200  # 添加最大步数限制
+        if not callable(generator) and generator not in self.GENERATORS:
+            raise ValueError(f"Unknown maze generator: {generator!r}")
+        self.generator = generator
+        if observation_mode not in self.OBSERVATION_MODES:
+            raise ValueError(f"Unknown observation mode: {observation_mode!r}")
+        self.observation_mode = observation_mode
         
         # 动作和观察空间
         self.action_space = gym.spaces.Discrete(4)  # 上下左右四个动作
-        self.observation_space = gym.spaces.Box(low=0, high=size-1, shape=(2,), dtype=np.int32)
+        if observation_mode == 'index':
+            self.observation_space = gym.spaces.Discrete(size * size)
+        else:
+            self.observation_space = gym.spaces.Box(low=0, high=size-1, shape=(2,), dtype=np.int32)
         
         # 奖励设置 - 移到这里
         self.STEP_PENALTY = -0.1
@@ -53,12 +363,29 @@ class DynamicMazeEnv(gym.Env):
             'path_length': 0           # 最优路径长度
         }
         
-        # 初始化环境
-        self.reset(seed=seed)
+        # 结构化事件流（障碍物更新和目标变化）
+        self.events = EventLog()
         
         # 迷宫相关属性
         self.maze = None
         
+        # 以目标为根的距离场（障碍物翻转时增量修复，重置或目标变化时重建）
+        self._distance_field = None
+        self.distance_map_version = 0
+        
+        # 写时复制：迷宫缓冲区和距离场与快照或分叉共享时，写之前先复制
+        self._maze_shared = False
+        self._field_shared = False
+        
+        # 场景库回放（为None时实时生成）
+        self.scenario_bank = None
+        self._scenario_cursor = 0
+        self._scenario_episode = None
+        self._scenario_update = 0
+        
+        # 初始化环境
+        self.reset(seed=seed)
+        
     def seed(self, seed=None):
         """设置随机种子"""
         if seed is not None:
@@ -69,29 +396,39 @@ class DynamicMazeEnv(gym.Env):
         """重置环境"""
         super().reset(seed=seed)
         
+        if self.scenario_bank is not None:
+            return self._reset_from_scenario(options)
+        self._scenario_episode = None
+        
         # 生成新迷宫
         self.maze = self.generate_maze()
+        self._maze_shared = False
+        self.invalidate_distance_map()
         
-        # 设置起点（左上角区域）
-        self.current_pos = self.find_empty_position()
-        while self.current_pos[0] > self.size//3 or self.current_pos[1] > self.size//3:
-            self.current_pos = self.find_empty_position()
+        # 设置起点（左上角区域），直接从该区域的空格列表中抽取
+        rows, cols = np.divmod(np.arange(self.size * self.size), self.size)
+        start_region = (rows <= self.size//3) & (cols <= self.size//3)
+        self.current_pos = self._sample_region(start_region)
         
         # 确保智能体不会被封死
         self._ensure_agent_not_trapped()
         
-        # 设置终点（右下角区域）
-        self.goal_pos = self.find_empty_position()
-        while (self.goal_pos[0] < 2*self.size//3 or 
-               self.goal_pos[1] < 2*self.size//3 or
-               np.sum(np.abs(self.goal_pos - self.current_pos)) < self.size):
-            self.goal_pos = self.find_empty_position()
+        # 设置终点（右下角区域，且与起点的曼哈顿距离不小于迷宫边长）
+        goal_region = ((rows >= 2*self.size//3) & (cols >= 2*self.size//3) &
+                       (np.abs(rows - self.current_pos[0]) + np.abs(cols - self.current_pos[1]) >= self.size))
+        if not goal_region.any():
+            goal_region = (rows >= 2*self.size//3) & (cols >= 2*self.size//3)
+        self.goal_pos = self._sample_region(goal_region)
+        self.invalidate_distance_map()
+        
+        # 随机散布的迷宫可能不连通，在这里修复
+        self._ensure_path_exists()
         
         # 重置步数和位置记录
         self._steps = 0
         self.previous_pos = self.current_pos.copy()
         
-        return self.current_pos, {}
+        return self._observe(), self._get_info()
         
     def step(self, action):
         """执行一步动作"""
@@ -101,20 +438,23 @@ class DynamicMazeEnv(gym.Env):
         direction = self.ACTIONS[action]
         next_pos = self.current_pos + direction
         
+        # 超过最大步数时截断（供向量环境自动重置）；超时不是真正的终止状态，只通过 truncated 报告
+        truncated = self._steps >= self.max_steps
+        
         # 检查是否超出边界
         if (next_pos < 0).any() or (next_pos >= self.size).any():
-            return self.current_pos, self.COLLISION_PENALTY, False, {}, {}
+            return self._observe(), self.COLLISION_PENALTY, False, truncated, self._get_info()
         
         # 检查是否撞墙
         if self.maze[tuple(next_pos)] == 1:
-            return self.current_pos, self.COLLISION_PENALTY, False, {}, {}
+            return self._observe(), self.COLLISION_PENALTY, False, truncated, self._get_info()
         
         # 更新位置
         self.current_pos = next_pos
         
-        # 检查是否到达目标
+        # 检查是否到达目标（只有到达目标才是终止）
         reached_goal = np.array_equal(self.current_pos, self.goal_pos)
-        done = reached_goal or self._steps >= self.max_steps
+        truncated = truncated and not reached_goal
         
         # 计算到目标的距离
         old_distance = np.sum(np.abs(self.previous_pos - self.goal_pos))
@@ -135,10 +475,16 @@ class DynamicMazeEnv(gym.Env):
         
         self.previous_pos = self.current_pos.copy()
         
-        return self.current_pos, reward, done, {}, {}
+        return self._observe(), reward, reached_goal, truncated, self._get_info()
         
     def generate_maze(self):
         """生成迷宫"""
+        if callable(self.generator):
+            return self.generator(self)
+        return getattr(self, self.GENERATORS[self.generator])()
+    
+    def _generate_random(self):
+        """均匀随机放置障碍物"""
         maze = np.zeros((self.size, self.size), dtype=np.int32)
         num_obstacles = int(self.size * self.size * self.obstacle_ratio)
         
@@ -148,23 +494,155 @@ class DynamicMazeEnv(gym.Env):
             size=num_obstacles,
             replace=False
         )
+        maze.ravel()[obstacle_positions] = 1
+        
+        return maze
+    
+    def _room_neighbours(self, room):
+        """迷宫式生成器中相邻房间（间隔一格）"""
+        r, c = room
+        for dr, dc in ((-2, 0), (2, 0), (0, -2), (0, 2)):
+            if 0 <= r + dr < self.size and 0 <= c + dc < self.size:
+                yield r + dr, c + dc
+    
+    def _empty_room_grid(self):
+        """全是墙、只在偶数坐标留出房间的初始迷宫"""
+        maze = np.ones((self.size, self.size), dtype=np.int32)
+        maze[::2, ::2] = 0
+        return maze
+    
+    def _random_room(self):
+        """随机选择一个房间"""
+        rooms = (self.size + 1) // 2
+        return (2 * int(self.np_random.integers(0, rooms)), 2 * int(self.np_random.integers(0, rooms)))
+    
+    def _braid_to_density(self, maze):
+        """随机拆除多余的墙直到障碍物比例达到目标
+        
+        每轮只拆除与空格相邻的墙，拆掉的墙都会并入已连通的区域，因此不会破坏连通性。
+        """
+        target = int(self.size * self.size * self.obstacle_ratio)
+        while True:
+            excess = int((maze == 1).sum()) - target
+            if excess <= 0:
+                break
+            free = np.pad(maze == 0, 1)
+            touches_free = free[:-2, 1:-1] | free[2:, 1:-1] | free[1:-1, :-2] | free[1:-1, 2:]
+            candidates = np.flatnonzero(((maze == 1) & touches_free).ravel())
+            if candidates.size == 0:
+                break
+            removed = self.np_random.choice(candidates, size=min(excess, candidates.size), replace=False)
+            maze.ravel()[removed] = 0
+        return maze
+    
+    def _generate_backtracker(self):
+        """递归回溯（深度优先）生成完美迷宫"""
+        maze = self._empty_room_grid()
+        visited = np.zeros_like(maze, dtype=bool)
+        start = self._random_room()
+        visited[start] = True
+        stack = [start]
+        while stack:
+            room = stack[-1]
+            options = [n for n in self._room_neighbours(room) if not visited[n]]
+            if not options:
+                stack.pop()
+                continue
+            nxt = options[self.np_random.integers(0, len(options))]
+            maze[(room[0] + nxt[0]) // 2, (room[1] + nxt[1]) // 2] = 0
+            visited[nxt] = True
+            stack.append(nxt)
+        return self._braid_to_density(maze)
+    
+    def _generate_prim(self):
+        """随机Prim算法生成完美迷宫"""
+        maze = self._empty_room_grid()
+        visited = np.zeros_like(maze, dtype=bool)
+        start = self._random_room()
+        visited[start] = True
+        frontier = [(start, n) for n in self._room_neighbours(start)]
+        while frontier:
+            # 随机取出一条边（与末尾交换后弹出，O(1)）
+            idx = self.np_random.integers(0, len(frontier))
+            frontier[idx], frontier[-1] = frontier[-1], frontier[idx]
+            room, nxt = frontier.pop()
+            if visited[nxt]:
+                continue
+            maze[(room[0] + nxt[0]) // 2, (room[1] + nxt[1]) // 2] = 0
+            visited[nxt] = True
+            frontier.extend((nxt, n) for n in self._room_neighbours(nxt) if not visited[n])
+        return self._braid_to_density(maze)
+    
+    def _random_spanning_edges(self, stride):
+        """随机Kruskal：返回间隔为stride的格点上一棵随机生成树的边"""
+        nodes = [(r, c) for r in range(0, self.size, stride) for c in range(0, self.size, stride)]
+        edges = [((r, c), (r + stride, c)) for r, c in nodes if r + stride < self.size]
+        edges += [((r, c), (r, c + stride)) for r, c in nodes if c + stride < self.size]
+        
+        parent = {node: node for node in nodes}
+        
+        def find(node):
+            while parent[node] != node:
+                parent[node] = parent[parent[node]]
+                node = parent[node]
+            return node
+        
+        tree = []
+        for idx in self.np_random.permutation(len(edges)):
+            a, b = edges[idx]
+            root_a, root_b = find(a), find(b)
+            if root_a != root_b:
+                parent[root_a] = root_b
+                tree.append((a, b))
+        return tree
+    
+    def _generate_kruskal(self):
+        """随机Kruskal算法生成完美迷宫"""
+        maze = self._empty_room_grid()
+        for a, b in self._random_spanning_edges(2):
+            maze[(a[0] + b[0]) // 2, (a[1] + b[1]) // 2] = 0
+        return self._braid_to_density(maze)
+    
+    def _generate_percolation(self):
+        """按目标密度随机修剪生成树的叶子：剩下的空格始终构成连通的一棵树"""
+        maze = np.zeros((self.size, self.size), dtype=np.int32)
+        target = min(int(self.size * self.size * self.obstacle_ratio), self.size * self.size - 1)
         
-        for pos in obstacle_positions:
-            row = pos // self.size
-            col = pos % self.size
-            maze[row, col] = 1
+        adjacency = {(r, c): [] for r in range(self.size) for c in range(self.size)}
+        for a, b in self._random_spanning_edges(1):
+            adjacency[a].append(b)
+            adjacency[b].append(a)
+        degree = {node: len(neighbours) for node, neighbours in adjacency.items()}
+        leaves = [node for node, d in degree.items() if d <= 1]
         
+        for _ in range(target):
+            idx = self.np_random.integers(0, len(leaves))
+            leaves[idx], leaves[-1] = leaves[-1], leaves[idx]
+            leaf = leaves.pop()
+            maze[leaf] = 1
+            for n in adjacency[leaf]:
+                if maze[n] == 0:
+                    degree[n] -= 1
+                    if degree[n] == 1:
+                        leaves.append(n)
         return maze
     
+    def _sample_region(self, region):
+        """从区域内的空格列表中直接抽取一个位置；区域内没有空格时清出一个"""
+        candidates = np.flatnonzero(region & (self.maze.ravel() == 0))
+        if candidates.size == 0:
+            candidates = np.flatnonzero(region)
+        idx = candidates[self.np_random.integers(0, len(candidates))]
+        pos = np.array(divmod(int(idx), self.size), dtype=np.int32)
+        if self.maze[tuple(pos)] == 1:
+            self._own_maze()
+            self.maze[tuple(pos)] = 0
+            self.notify_cells_changed([tuple(pos)])
+        return pos
+    
     def find_empty_position(self):
         """找到一个合适的空位置"""
-        while True:
-            pos = np.array([
-                self.np_random.integers(0, self.size),
-                self.np_random.integers(0, self.size)
-            ])
-            if self.maze[tuple(pos)] == 0:  # 确保位置是空的
-                return pos
+        return self._sample_region(np.ones(self.size * self.size, dtype=bool))
     
     def update_environment(self):
         """更新环境"""
@@ -172,17 +650,76 @@ class DynamicMazeEnv(gym.Env):
         old_goal = tuple(self.goal_pos)  # 转换为元组以便比较
         
         # 随机更新一些障碍物
+        toggles = self._sample_toggles()
+        if toggles:
+            self._own_maze()
+        for x, y in toggles:
+            self.maze[x, y] = 1 - self.maze[x, y]
+        if toggles:
+            self.notify_cells_changed(toggles)
+            self.events.emit('maze_update', self._steps, cells=len(toggles))
+        
+        self._finish_update(old_goal)
+        
+    def _draw_toggle_cells(self):
+        """抽取本次环境更新的候选格子（回放场景库时从记录的时间表中读取）"""
+        if self._scenario_episode is not None:
+            update = self._scenario_update
+            self._scenario_update += 1
+            if update < self.scenario_bank.num_updates(self._scenario_episode):
+                return [tuple(cell) for cell in self.scenario_bank.toggles(self._scenario_episode, update)]
+            # 记录的时间表用完后退回到实时抽取
+        
         num_changes = self.np_random.integers(1, 4)
-        for _ in range(num_changes):
-            x = self.np_random.integers(0, self.size)
-            y = self.np_random.integers(0, self.size)
+        return [
+            (self.np_random.integers(0, self.size), self.np_random.integers(0, self.size))
+            for _ in range(num_changes)
+        ]
+        
+    def _sample_toggles(self):
+        """抽取本次环境更新要翻转的格子（不含智能体和目标所在格）"""
+        toggles = []
+        for x, y in self._draw_toggle_cells():
             pos = np.array([x, y])
             
             # 使用 np.array_equal 进行数组比较
-            if not (np.array_equal(pos, self.current_pos) or 
+            if not (any(np.array_equal(pos, agent_pos) for agent_pos in self._agent_positions()) or 
                    np.array_equal(pos, self.goal_pos)):
-                self.maze[x, y] = 1 - self.maze[x, y]
+                toggles.append((x, y))
+        return toggles
+        
+    def load_scenarios(self, bank):
+        """加载场景库，之后的 reset 按顺序回放其中的episode（传入None恢复实时生成）"""
+        if bank is not None and bank.size != self.size:
+            raise ValueError(f"Scenario bank is for size {bank.size}, environment size is {self.size}")
+        self.scenario_bank = bank
+        self._scenario_cursor = 0
+        self._scenario_episode = None
         
+    def _reset_from_scenario(self, options):
+        """从场景库中取出一个episode，不做任何生成"""
+        episode = self._scenario_cursor
+        if options and 'episode' in options:
+            episode = options['episode']
+        if not 0 <= episode < len(self.scenario_bank):
+            raise IndexError(f"Scenario bank has no episode {episode}")
+        self._scenario_cursor = episode + 1
+        self._scenario_episode = episode
+        self._scenario_update = 0
+        
+        self.maze = self.scenario_bank.mazes[episode].astype(np.int32)
+        self._maze_shared = False
+        self.current_pos = self.scenario_bank.starts[episode].astype(np.int32)
+        self.goal_pos = self.scenario_bank.goals[episode].astype(np.int32)
+        self.invalidate_distance_map()
+        
+        self._steps = 0
+        self.previous_pos = self.current_pos.copy()
+        
+        return self._observe(), self._get_info()
+        
+    def _finish_update(self, old_goal):
+        """障碍物翻转后修复路径并记录更新"""
         # 确保路径存在
         self._ensure_path_exists()
         
@@ -192,22 +729,18 @@ class DynamicMazeEnv(gym.Env):
         # 检查目标是否改变
         if not np.array_equal(old_goal, self.goal_pos):
             self.episode_data['goal_changes'] += 1
+            self.invalidate_distance_map()
+            self.events.emit('goal_change', self._steps, goal=self.goal_pos.copy())
         
         self.episode_data['environment_updates'] += 1
         
     def _set_goal(self):
         """设置目标位置"""
-        while True:
-            x = self.np_random.integers(0, self.size)
-            y = self.np_random.integers(0, self.size)
-            candidate_pos = np.array([x, y])
-            
-            # 使用 np.array_equal 进行数组比较
-            if (not np.array_equal(candidate_pos, self.current_pos) and 
-                self.maze[x, y] == 0):  # 确保目标不在障碍物上
-                self.goal_pos = candidate_pos
-                break
-                
+        region = np.ones(self.size * self.size, dtype=bool)
+        region[int(self.current_pos[0]) * self.size + int(self.current_pos[1])] = False
+        self.goal_pos = self._sample_region(region)
+        self.invalidate_distance_map()
+        
     def _calculate_reward(self, new_pos, hit_obstacle):
         """计算奖励"""
         if hit_obstacle:
@@ -231,86 +764,185 @@ class DynamicMazeEnv(gym.Env):
         if np.array_equal(start, goal):
             return True, [start]
         
-        visited = set()
-        queue = [(start, [start])]
-        visited.add(tuple(start))
+        start_key = tuple(start)
+        goal_key = tuple(goal)
+        parents = {start_key: None}
+        queue = deque([start_key])
         
         while queue:
-            current, path = queue.pop(0)
+            current = queue.popleft()
             
             for action in self.ACTIONS.values():
-                next_pos = current + action
-                next_pos_tuple = tuple(next_pos)
+                next_pos = (current[0] + action[0], current[1] + action[1])
                 
                 # 检查是否有效
-                if (next_pos < 0).any() or (next_pos >= self.size).any():
+                if not (0 <= next_pos[0] < self.size and 0 <= next_pos[1] < self.size):
                     continue
-                if maze[tuple(next_pos)] == 1:  # 是障碍物
+                if maze[next_pos] == 1:  # 是障碍物
                     continue
-                if next_pos_tuple in visited:
+                if next_pos in parents:
                     continue
+                parents[next_pos] = current
                 
-                # 检查是否到达目标
-                if np.array_equal(next_pos, goal):
-                    return True, path + [next_pos]
+                # 检查是否到达目标，沿父节点回溯路径
+                if next_pos == goal_key:
+                    path = []
+                    node = next_pos
+                    while node is not None:
+                        path.append(np.array(node))
+                        node = parents[node]
+                    return True, path[::-1]
                 
-                # 添加到队列
-                visited.add(next_pos_tuple)
-                queue.append((next_pos, path + [next_pos]))
+                queue.append(next_pos)
         
         return False, []
 
-    def _ensure_path_exists(self):
-        """确保存在从当前位置到目标的路径"""
-        path_exists, _ = self.bfs(self.current_pos, self.goal_pos, self.maze)
-        if not path_exists:
-            # 如果没有路径，移除一些障碍物直到有路径
-            while not path_exists:
-                # 随机选择一个障碍物移除
-                obstacles = np.where(self.maze == 1)
-                if len(obstacles[0]) == 0:  # 没有障碍物了
-                    break
-                idx = self.np_random.integers(0, len(obstacles[0]))
-                x, y = obstacles[0][idx], obstacles[1][idx]
-                pos = np.array([x, y])
-                
-                # 不移除起点和终点位置的障碍物
-                if not (np.array_equal(pos, self.current_pos) or 
-                       np.array_equal(pos, self.goal_pos)):
-                    self.maze[x, y] = 0
-                    path_exists, _ = self.bfs(self.current_pos, self.goal_pos, self.maze)
+    def to_index(self, pos):
+        """坐标转换为扁平整数索引（支持 (..., 2) 数组）"""
+        pos = np.asarray(pos)
+        index = pos[..., 0] * self.size + pos[..., 1]
+        return int(index) if index.ndim == 0 else index
 
-    def get_optimal_path_length(self):
-        """获取最短路径长度"""
-        from queue import Queue
-        
-        if np.array_equal(self.current_pos, self.goal_pos):
-            return 0
+    def to_coords(self, index):
+        """扁平整数索引转换为坐标（支持数组）"""
+        row, col = np.divmod(index, self.size)
+        return np.stack([row, col], axis=-1).astype(np.int32)
+
+    def _observe(self):
+        """按观察模式返回当前位置"""
+        if self.observation_mode == 'index':
+            return int(self.current_pos[0]) * self.size + int(self.current_pos[1])
+        # 返回副本：调用方保存的观察不能随环境内部状态变化
+        return self.current_pos.copy()
+
+    def _get_info(self):
+        """step 和 reset 返回的 info：episode数据和当前最优路径长度"""
+        return {
+            'episode_data': dict(self.episode_data),
+            'optimal_path_length': self.get_optimal_path_length(),
+        }
+
+    def _agent_positions(self):
+        """环境中所有智能体的位置（多智能体环境会重写）"""
+        return [self.current_pos]
+
+    def _ensure_path_exists(self):
+        """确保存在从每个智能体位置到目标的路径"""
+        for pos in self._agent_positions():
+            # 距离场是增量维护的，连通时只需O(1)查询
+            if np.isfinite(self.get_path_length_from(pos)):
+                continue
             
-        visited = set()
-        q = Queue()
-        q.put((tuple(self.current_pos), 0))
-        visited.add(tuple(self.current_pos))
+            # 不连通时按连通分量清除最少的障碍物
+            walls = min_walls_to_connect(self.maze, pos, self.goal_pos)
+            if walls:
+                self._own_maze()
+            for x, y in walls:
+                self.maze[x, y] = 0
+            if walls:
+                self.notify_cells_changed(walls)
+
+    def _own_maze(self):
+        """写迷宫前调用：如果缓冲区与快照或分叉共享，先复制一份"""
+        if self._maze_shared:
+            self.maze = self.maze.copy()
+            self._maze_shared = False
+
+    def _share_buffers(self):
+        """把当前迷宫和距离场标记为共享，之后的写操作会先复制"""
+        if self.maze is not None:
+            self.maze.flags.writeable = False
+        self._maze_shared = True
+        self._field_shared = True
+
+    def snapshot(self):
+        """保存环境的完整状态；迷宫缓冲区写时复制，不做深拷贝"""
+        self._share_buffers()
+        return {
+            'maze': self.maze,
+            'distance_field': self._distance_field,
+            'distance_map_version': self.distance_map_version,
+            'current_pos': self.current_pos.copy(),
+            'previous_pos': self.previous_pos.copy(),
+            'goal_pos': self.goal_pos.copy(),
+            'steps': self._steps,
+            'last_change_step': self.last_change_step,
+            'rng_state': self.np_random.bit_generator.state,
+            'episode_data': dict(self.episode_data),
+            'scenario': (self._scenario_cursor, self._scenario_episode, self._scenario_update),
+        }
+
+    def restore(self, snapshot):
+        """恢复到 snapshot() 保存的状态（同一个快照可以恢复多次）"""
+        self.maze = snapshot['maze']
+        self._distance_field = snapshot['distance_field']
+        self._maze_shared = True
+        self._field_shared = True
+        self.distance_map_version = snapshot['distance_map_version']
+        self.current_pos = snapshot['current_pos'].copy()
+        self.previous_pos = snapshot['previous_pos'].copy()
+        self.goal_pos = snapshot['goal_pos'].copy()
+        self._steps = snapshot['steps']
+        self.last_change_step = snapshot['last_change_step']
+        self.np_random.bit_generator.state = snapshot['rng_state']
+        self.episode_data = dict(snapshot['episode_data'])
+        self._scenario_cursor, self._scenario_episode, self._scenario_update = snapshot['scenario']
+
+    def fork(self):
+        """复制出一个状态完全相同的独立环境，迷宫缓冲区写时复制
         
-        while not q.empty():
-            pos, dist = q.get()
-            
-            for action in self.ACTIONS.values():
-                next_pos = tuple(np.array(pos) + action)
-                
-                if (next_pos[0] < 0 or next_pos[0] >= self.size or
-                    next_pos[1] < 0 or next_pos[1] >= self.size or
-                    self.maze[next_pos] == 1 or
-                    next_pos in visited):
-                    continue
-                
-                if np.array_equal(next_pos, tuple(self.goal_pos)):
-                    return dist + 1
-                
-                visited.add(next_pos)
-                q.put((next_pos, dist + 1))
+        两个环境拥有相同的随机数状态，因此在相同的时刻会抽到相同的障碍物变化，
+        可以用来让多个智能体在同一条动态时间线上成对比较。
+        """
+        self._share_buffers()
+        forked = copy.copy(self)
+        forked.np_random = copy.deepcopy(self.np_random)
+        forked.current_pos = self.current_pos.copy()
+        forked.previous_pos = self.previous_pos.copy()
+        forked.goal_pos = self.goal_pos.copy()
+        forked.episode_data = dict(self.episode_data)
+        forked.events = self.events.fork()
+        return forked
+
+    def invalidate_distance_map(self):
+        """标记距离场失效，下次查询时完整重建（修改 goal_pos 或整个迷宫后调用）"""
+        self._distance_field = None
+        self._field_shared = False
+        self.distance_map_version += 1
+
+    def notify_cells_changed(self, cells):
+        """迷宫中若干格子被修改后增量修复距离场"""
+        if self._distance_field is not None:
+            if self._field_shared:
+                self._distance_field = self._distance_field.copy()
+                self._field_shared = False
+            self._distance_field.update_cells(self.maze, cells)
+        self.distance_map_version += 1
+
+    def get_distance_map(self):
+        """获取以目标为根的距离场，只在失效后重建"""
+        if self._distance_field is None:
+            self._distance_field = DynamicDistanceField(self.maze, self.goal_pos)
+        return self._distance_field.dist
+
+    def get_path_length_from(self, pos):
+        """获取任意格子到目标的最短路径长度"""
+        row, col = int(pos[0]), int(pos[1])
+        distance_map = self.get_distance_map()
+        if self.maze[row, col] == 0:
+            return float(distance_map[row, col])
         
-        return float('inf')  # 如果没有路径
+        # 起点在障碍物上时（例如被外部改动），按相邻空格计算
+        best = float('inf')
+        for action in self.ACTIONS.values():
+            r, c = row + action[0], col + action[1]
+            if 0 <= r < self.size and 0 <= c < self.size:
+                best = min(best, distance_map[r, c] + 1)
+        return float(best)
+
+    def get_optimal_path_length(self):
+        """获取最短路径长度"""
+        return self.get_path_length_from(self.current_pos)
 
     def get_current_metrics(self):
         """返回当前环境的指标"""
@@ -327,10 +959,15 @@ class DynamicMazeEnv(gym.Env):
 
     def _ensure_agent_not_trapped(self):
         """确保智能体不会被障碍物封死"""
+        for pos in self._agent_positions():
+            self._free_trapped_position(pos)
+
+    def _free_trapped_position(self, pos):
+        """如果pos四周都不可走，清除一个相邻的障碍物"""
         # 检查智能体周围是否至少有一个可移动的方向
         has_valid_move = False
         for action in self.ACTIONS.values():
-            next_pos = self.current_pos + action
+            next_pos = pos + action
             # 检查是否有效移动
             if ((next_pos >= 0).all() and (next_pos < self.size).all() and 
                 self.maze[tuple(next_pos)] == 0):
@@ -343,10 +980,394 @@ class DynamicMazeEnv(gym.Env):
             priority_actions = [1, 3, 0, 2]  # 下、右、上、左
             for action_idx in priority_actions:
                 action = self.ACTIONS[action_idx]
-                next_pos = self.current_pos + action
+                next_pos = pos + action
                 # 检查位置是否在边界内
                 if ((next_pos >= 0).all() and (next_pos < self.size).all()):
                     # 如果是障碍物，移除它
                     if self.maze[tuple(next_pos)] == 1:
+                        self._own_maze()
                         self.maze[tuple(next_pos)] = 0
-                        return  # 只需要清除一个障碍物
\ No newline at end of file
+                        self.notify_cells_changed([tuple(next_pos)])
+                        return  # 只需要清除一个障碍物
+
+class MultiAgentDynamicMazeEnv(DynamicMazeEnv):
+    """多智能体动态迷宫：K个智能体在同一个迷宫中同时行动
+    
+    一次 step(actions) 向量化地处理K个智能体的移动、碰撞和奖励，智能体之间不会互相阻挡。
+    环境每 change_frequency 个全局时刻更新一次，障碍物翻转、路径修复和防封死都会保护所有智能体。
+    action_space 和 observation_space 仍然是单个智能体的空间。
+    """
+    
+    def __init__(self, num_agents, size=10, obstacle_ratio=0.3, change_frequency=20, seed=None,
+                 generator='random', observation_mode='coords'):
+        self.num_agents = num_agents
+        self.positions = None
+        self.previous_positions = None
+        super().__init__(size, obstacle_ratio, change_frequency, seed=seed, generator=generator,
+                         observation_mode=observation_mode)
+    
+    def _agent_positions(self):
+        """所有智能体的位置（reset 放置起点时只有一个位置）"""
+        if self.positions is None:
+            return [self.current_pos]
+        return self.positions
+    
+    def reset(self, seed=None, options=None):
+        """重置环境，所有智能体从同一个起点出发"""
+        self.positions = None
+        _, info = super().reset(seed=seed, options=options)
+        self.positions = np.tile(self.current_pos, (self.num_agents, 1)).astype(np.int32)
+        self.previous_positions = self.positions.copy()
+        return self._observe_agents(), self._get_info()
+    
+    def step(self, actions):
+        """所有智能体同时执行一步动作"""
+        actions = np.asarray(actions, dtype=np.intp)
+        self._steps += 1
+        
+        self.positions, rewards, terminated, moved = _resolve_moves(
+            self, self.positions, self.previous_positions, self.goal_pos, actions,
+            lambda cells: self.maze[cells[:, 0], cells[:, 1]] == 1
+        )
+        truncated = ~terminated & (self._steps >= self.max_steps)
+        self.current_pos = self.positions[0].copy()
+        
+        # 每个全局时刻最多更新一次环境
+        if self._steps % self.change_frequency == 0:
+            self.update_environment()
+        
+        self.previous_positions[moved] = self.positions[moved]
+        self.previous_pos = self.previous_positions[0].copy()
+        
+        return self._observe_agents(), rewards, terminated, truncated, self._get_info()
+    
+    def _get_info(self):
+        """与标量环境相同的 info，最优路径长度为每个智能体一个"""
+        if self.positions is None:
+            return super()._get_info()
+        return {
+            'episode_data': dict(self.episode_data),
+            'optimal_path_length': self.get_optimal_path_lengths(),
+        }
+    
+    def _observe_agents(self):
+        """按观察模式返回所有智能体的位置"""
+        if self.observation_mode == 'index':
+            return self.to_index(self.positions)
+        return self.positions.copy()
+    
+    def get_optimal_path_lengths(self):
+        """获取每个智能体到目标的最短路径长度"""
+        return np.array([self.get_path_length_from(pos) for pos in self.positions])
+    
+    def snapshot(self):
+        """保存环境状态，包括所有智能体的位置"""
+        snapshot = super().snapshot()
+        snapshot['positions'] = self.positions.copy()
+        snapshot['previous_positions'] = self.previous_positions.copy()
+        return snapshot
+    
+    def restore(self, snapshot):
+        """恢复到 snapshot() 保存的状态"""
+        super().restore(snapshot)
+        self.positions = snapshot['positions'].copy()
+        self.previous_positions = snapshot['previous_positions'].copy()
+    
+    def fork(self):
+        """复制出一个状态完全相同的独立环境"""
+        forked = super().fork()
+        forked.positions = self.positions.copy()
+        forked.previous_positions = self.previous_positions.copy()
+        return forked
+
+
+class ScenarioBank:
+    """预生成的场景库
+    
+    保存每个episode的初始迷宫、起点、终点，以及第k次环境更新要翻转的候选格子。
+    翻转时间表按环境更新次数（而不是步数）记录，因此与智能体的动作无关；
+    路径修复是确定性的，所以回放结果与用相同种子实时运行完全一致。
+    
+    文件格式：以 .npz 结尾时保存为压缩的 npz；否则保存为一个目录，
+    每个数组一个 .npy 文件，可以用 mmap=True 只读内存映射加载。
+    """
+    
+    VERSION = 1
+    ARRAYS = ('meta', 'mazes', 'starts', 'goals', 'toggle_cells', 'update_ptr', 'episode_ptr')
+    
+    def __init__(self, mazes, starts, goals, toggle_cells, update_ptr, episode_ptr, change_frequency):
+        self.mazes = mazes                # (E, H, W) uint8
+        self.starts = starts              # (E, 2)
+        self.goals = goals                # (E, 2)
+        self.toggle_cells = toggle_cells  # (T, 2) 所有更新的候选格子
+        self.update_ptr = update_ptr      # (U+1,) 第u次更新在 toggle_cells 中的范围
+        self.episode_ptr = episode_ptr    # (E+1,) 第e个episode在 update_ptr 中的范围
+        self.change_frequency = change_frequency
+        self.size = mazes.shape[1]
+    
+    def __len__(self):
+        return len(self.mazes)
+    
+    def num_updates(self, episode):
+        """该episode记录的环境更新次数"""
+        return int(self.episode_ptr[episode + 1] - self.episode_ptr[episode])
+    
+    def toggles(self, episode, update):
+        """第episode个episode中第update次环境更新的候选格子"""
+        u = self.episode_ptr[episode] + update
+        return self.toggle_cells[self.update_ptr[u]:self.update_ptr[u + 1]]
+    
+    @classmethod
+    def generate(cls, num_episodes, size=10, obstacle_ratio=0.3, change_frequency=20, seed=0,
+                 generator='random', max_steps=200):
+        """用 reset(seed=seed + episode) 生成场景，并记录足够覆盖 max_steps 的翻转时间表"""
+        env = DynamicMazeEnv(size, obstacle_ratio, change_frequency, seed=seed, generator=generator)
+        num_updates = max_steps // change_frequency
+        
+        mazes = np.zeros((num_episodes, size, size), dtype=np.uint8)
+        starts = np.zeros((num_episodes, 2), dtype=np.int32)
+        goals = np.zeros((num_episodes, 2), dtype=np.int32)
+        toggle_cells = []
+        update_ptr = [0]
+        for episode in range(num_episodes):
+            env.reset(seed=seed + episode)
+            mazes[episode] = env.maze
+            starts[episode] = env.current_pos
+            goals[episode] = env.goal_pos
+            
+            # 与实时环境消耗随机数的顺序完全相同
+            for _ in range(num_updates):
+                cells = env._draw_toggle_cells()
+                toggle_cells.extend(cells)
+                update_ptr.append(len(toggle_cells))
+        
+        return cls(
+            mazes, starts, goals,
+            np.array(toggle_cells, dtype=np.int32).reshape(-1, 2),
+            np.array(update_ptr, dtype=np.int64),
+            np.arange(num_episodes + 1, dtype=np.int64) * num_updates,
+            change_frequency
+        )
+    
+    def save(self, path):
+        """保存场景库"""
+        arrays = {name: getattr(self, name) for name in self.ARRAYS[1:]}
+        arrays['meta'] = np.array([self.VERSION, self.change_frequency], dtype=np.int64)
+        if str(path).endswith('.npz'):
+            np.savez_compressed(path, **arrays)
+            return
+        os.makedirs(path, exist_ok=True)
+        for name, array in arrays.items():
+            np.save(os.path.join(path, f'{name}.npy'), array)
+    
+    @classmethod
+    def load(cls, path, mmap=False):
+        """加载场景库；目录格式可以只读内存映射，多个进程共享同一份数据"""
+        if str(path).endswith('.npz'):
+            with np.load(path) as data:
+                arrays = {name: data[name] for name in cls.ARRAYS}
+        else:
+            mode = 'r' if mmap else None
+            arrays = {name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode=mode)
+                      for name in cls.ARRAYS}
+        
+        version, change_frequency = (int(v) for v in arrays.pop('meta'))
+        if version != cls.VERSION:
+            raise ValueError(f"Unsupported scenario bank version {version}")
+        return cls(change_frequency=change_frequency, **arrays)
+
+
+class BatchedDynamicMazeEnv:
+    """批量动态迷宫环境：用NumPy一次推进N个迷宫
+    
+    迷宫保存为 (N, H, W) 的 uint8 数组，位置和目标保存为 (N, 2) 数组。
+    每个迷宫有一个对应的 DynamicMazeEnv 负责生成、随机数和路径修复，
+    因此在相同种子下动力学与标量环境完全一致。
+    
+    reset(indices=...) 只重置部分迷宫。autoreset=True 时 step 会立即重置终止或截断的迷宫
+    （与 gymnasium 向量环境的同步自动重置相同）：返回的观察是新 episode 的起点，
+    结束时的观察和 info 放在 info['final_obs'] 和 info['final_info'] 中，info['_final_obs']
+    标记本步结束的迷宫。
+    """
+    
+    ACTION_DELTAS = DynamicMazeEnv.ACTION_DELTAS
+    
+    def __init__(self, num_envs, size=10, obstacle_ratio=0.3, change_frequency=20, seed=None,
+                 generator='random', observation_mode='coords', autoreset=False):
+        if observation_mode not in DynamicMazeEnv.OBSERVATION_MODES:
+            raise ValueError(f"Unknown observation mode: {observation_mode!r}")
+        self.num_envs = num_envs
+        self.observation_mode = observation_mode
+        self.autoreset = autoreset
+        self.size = size
+        self.obstacle_ratio = obstacle_ratio
+        self.change_frequency = change_frequency
+        self.max_steps = 200
+        
+        # 动作和观察空间
+        self.single_action_space = gym.spaces.Discrete(4)
+        self.action_space = gym.spaces.MultiDiscrete([4] * num_envs)
+        if observation_mode == 'index':
+            self.single_observation_space = gym.spaces.Discrete(size * size)
+            self.observation_space = gym.spaces.MultiDiscrete([size * size] * num_envs)
+        else:
+            self.single_observation_space = gym.spaces.Box(low=0, high=size-1, shape=(2,), dtype=np.int32)
+            self.observation_space = gym.spaces.Box(low=0, high=size-1, shape=(num_envs, 2), dtype=np.int32)
+        
+        # 每个迷宫对应一个标量环境（只用于生成和修复，不走热路径）
+        self.envs = [
+            DynamicMazeEnv(size, obstacle_ratio, change_frequency, seed=s, generator=generator)
+            for s in self._expand_seeds(seed)
+        ]
+        self.STEP_PENALTY = self.envs[0].STEP_PENALTY
+        self.COLLISION_PENALTY = self.envs[0].COLLISION_PENALTY
+        self.GOAL_REWARD = self.envs[0].GOAL_REWARD
+        
+        # 批量状态
+        self.maze = np.zeros((num_envs, size, size), dtype=np.uint8)
+        self.current_pos = np.zeros((num_envs, 2), dtype=np.int32)
+        self.previous_pos = np.zeros((num_envs, 2), dtype=np.int32)
+        self.goal_pos = np.zeros((num_envs, 2), dtype=np.int32)
+        self._steps = np.zeros(num_envs, dtype=np.int64)
+        self._env_index = np.arange(num_envs)
+        
+        # 所有迷宫共用一个事件流，事件带有迷宫编号 env
+        self.events = EventLog()
+        for i, env in enumerate(self.envs):
+            env.events = self.events.tagged(env=i)
+        
+        # 构造时子环境已经完成重置，直接同步
+        for i in range(num_envs):
+            self._sync_from_env(i)
+    
+    def _expand_seeds(self, seed):
+        """把种子展开为每个迷宫一个"""
+        if seed is None:
+            return [None] * self.num_envs
+        if np.isscalar(seed):
+            return [int(seed) + i for i in range(self.num_envs)]
+        seeds = list(seed)
+        if len(seeds) != self.num_envs:
+            raise ValueError(f"Expected {self.num_envs} seeds, got {len(seeds)}")
+        return seeds
+    
+    def _sync_from_env(self, i):
+        """把第i个子环境的状态拷贝到批量数组，并让子环境共享批量迷宫缓冲区"""
+        env = self.envs[i]
+        self.maze[i] = env.maze
+        env.maze = self.maze[i]
+        self.current_pos[i] = env.current_pos
+        self.previous_pos[i] = env.previous_pos
+        self.goal_pos[i] = env.goal_pos
+        self._steps[i] = env._steps
+    
+    @property
+    def episode_data(self):
+        """每个迷宫的episode数据"""
+        return [env.episode_data for env in self.envs]
+    
+    def get_optimal_path_lengths(self):
+        """获取每个迷宫当前位置到目标的最短路径长度"""
+        return np.array([
+            env.get_path_length_from(pos) for env, pos in zip(self.envs, self.current_pos)
+        ])
+    
+    def load_scenarios(self, bank):
+        """每个迷宫都加载同一个场景库，之后每个迷宫的 reset 按顺序回放其中的episode"""
+        for env in self.envs:
+            env.load_scenarios(bank)
+    
+    def reset(self, seed=None, options=None, indices=None):
+        """重置迷宫：indices 为 None 时重置全部，否则只重置给定编号的迷宫
+        
+        种子按迷宫编号展开（标量种子 s 对应第 i 个迷宫的 s + i），只使用被重置迷宫的种子。
+        返回所有迷宫的观察和 info。
+        """
+        seeds = self._expand_seeds(seed)
+        for i in (range(self.num_envs) if indices is None else np.atleast_1d(indices)):
+            self.envs[i].reset(seed=seeds[i], options=options)
+            self._sync_from_env(i)
+        return self._observe(), self._get_info()
+    
+    def step(self, actions):
+        """对所有迷宫同时执行一步动作"""
+        actions = np.asarray(actions, dtype=np.intp)
+        self._steps += 1
+        
+        self.current_pos, rewards, terminated, moved = _resolve_moves(
+            self, self.current_pos, self.previous_pos, self.goal_pos, actions,
+            lambda cells: self.maze[self._env_index, cells[:, 0], cells[:, 1]] == 1
+        )
+        
+        # 动态更新环境（只有成功移动的步才会触发，与标量环境一致）
+        changing = np.flatnonzero(moved & (self._steps % self.change_frequency == 0))
+        if changing.size:
+            self._update_environments(changing)
+        
+        self.previous_pos[moved] = self.current_pos[moved]
+        
+        truncated = ~terminated & (self._steps >= self.max_steps)
+        observation, info = self._observe(), self._get_info()
+        finished = terminated | truncated
+        if self.autoreset and finished.any():
+            # 结束的迷宫立即开始新的episode，结束时的观察和 info 随 info 返回
+            final_obs, final_info = observation, info
+            observation, info = self.reset(indices=np.flatnonzero(finished))
+            info.update(final_obs=final_obs, final_info=final_info, _final_obs=finished)
+        return observation, rewards, terminated, truncated, info
+    
+    def _get_info(self):
+        """与标量环境相同的 info，每个迷宫一份episode数据和一个最优路径长度"""
+        return {
+            'episode_data': [dict(data) for data in self.episode_data],
+            'optimal_path_length': self.get_optimal_path_lengths(),
+        }
+    
+    def _observe(self):
+        """按观察模式返回所有迷宫中的位置"""
+        if self.observation_mode == 'index':
+            return self.current_pos[:, 0] * self.size + self.current_pos[:, 1]
+        return self.current_pos.copy()
+    
+    def _update_environments(self, indices):
+        """对指定迷宫执行一次环境更新"""
+        # 随机数必须按迷宫各自抽取，翻转则一次性完成
+        rows, xs, ys = [], [], []
+        for i in indices:
+            env = self.envs[i]
+            env.current_pos = self.current_pos[i].copy()
+            env._steps = int(self._steps[i])
+            for x, y in env._sample_toggles():
+                rows.append(i)
+                xs.append(x)
+                ys.append(y)
+        if rows:
+            # 同一格子被抽中两次时应翻转两次，所以用 xor.at 而不是赋值
+            np.bitwise_xor.at(self.maze, (np.array(rows), np.array(xs), np.array(ys)), 1)
+            for i in set(rows):
+                cells = [(x, y) for row, x, y in zip(rows, xs, ys) if row == i]
+                self.envs[i].notify_cells_changed(cells)
+                self.envs[i].events.emit('maze_update', int(self._steps[i]), cells=len(cells))
+        
+        # 路径修复在子环境中进行，直接写回共享的迷宫缓冲区
+        for i in indices:
+            env = self.envs[i]
+            env._finish_update(tuple(env.goal_pos))
+            self.goal_pos[i] = env.goal_pos
+
+
+# 注册到 gymnasium，可以用 gym.make('DynamicMaze-v0', size=...) 创建
+if 'DynamicMaze-v0' not in gym.registry:
+    gym.register(id='DynamicMaze-v0', entry_point='dynamic_maze_env:DynamicMazeEnv')
+
+
+def make_async_vector_env(num_envs, seed=None, shared_memory=True, **env_kwargs):
+    """创建在多个进程中运行的 AsyncVectorEnv，观察通过共享内存传递
+    
+    每个子环境用 functools.partial 构造（可以被pickle），种子依次为 seed, seed+1, ...
+    """
+    env_fns = [
+        functools.partial(DynamicMazeEnv, seed=None if seed is None else seed + i, **env_kwargs)
+        for i in range(num_envs)
+    ]
+    return gym.vector.AsyncVectorEnv(env_fns, shared_memory=shared_memory)
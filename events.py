@@ -0,0 +1,134 @@
+import json
+from collections import deque
+import numpy as np
+
+
+def _to_json(value):
+    """numpy 标量和数组转换为 JSON 可序列化的值"""
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class JsonlSink:
+    """批量追加写入 JSONL 文件的事件输出，攒够 batch_size 条才写一次文件
+
+    每次写入时才打开文件，因此对象本身可以被 pickle（例如随环境发送到子进程）。
+    缓存中的事件只有在 flush 或 close 时才会写出，进程退出前需要调用 close（或用 with 语句）。
+    """
+
+    def __init__(self, path, batch_size=256):
+        self.path = path
+        self.batch_size = batch_size
+        self._pending = []
+
+    def write(self, event):
+        self._pending.append(json.dumps(event, default=_to_json))
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """把缓存的事件写入文件"""
+        if self._pending:
+            with open(self.path, 'a') as f:
+                f.write('\n'.join(self._pending) + '\n')
+            self._pending = []
+
+    def close(self):
+        """写出缓存的事件"""
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class EventLog:
+    """有界的结构化事件流：环形缓冲区保存最近的事件，计数器统计全部事件
+
+    每个事件是一个 dict：{'kind': 类型, 'step': 步数, ...附加字段}。同一类型的事件距离上一次
+    被保留的事件不足 min_interval 步时只计数、不保存也不输出（限流），被限流的次数记在
+    suppressed 中。sink 不为 None 时保留的事件还会交给 sink.write（例如 JsonlSink）。
+    """
+
+    def __init__(self, capacity=256, sink=None, min_interval=0):
+        self.capacity = capacity
+        self.sink = sink
+        self.min_interval = min_interval
+        self.events = deque(maxlen=capacity)
+        self.counts = {}
+        self.suppressed = 0
+        self._last_kept = {}
+
+    def emit(self, kind, step, **data):
+        """记录一个事件"""
+        self.counts[kind] = self.counts.get(kind, 0) + 1
+        if self.min_interval:
+            last = self._last_kept.get(kind)
+            if last is not None and step - last < self.min_interval:
+                self.suppressed += 1
+                return
+            self._last_kept[kind] = step
+        event = {'kind': kind, 'step': step, **data}
+        self.events.append(event)
+        if self.sink is not None:
+            self.sink.write(event)
+
+    def recent(self, kind=None):
+        """缓冲区中的事件（从旧到新），可以按类型过滤"""
+        return [event for event in self.events if kind is None or event['kind'] == kind]
+
+    def fork(self):
+        """设置相同、缓冲区为空的新事件流（共享同一个 sink）"""
+        return EventLog(self.capacity, self.sink, self.min_interval)
+
+    def tagged(self, **fields):
+        """写入本事件流、并给每个事件附加固定字段的视图（例如批量环境中的迷宫编号）"""
+        return TaggedEvents(self, fields)
+
+    def flush(self):
+        """把 sink 中缓存的事件写出"""
+        if self.sink is not None:
+            self.sink.flush()
+
+    def close(self):
+        """结束事件流：写出并关闭 sink（缓冲区和计数保留）"""
+        if self.sink is not None:
+            self.sink.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def clear(self):
+        """清空缓冲区和计数"""
+        self.events.clear()
+        self.counts = {}
+        self.suppressed = 0
+        self._last_kept = {}
+
+
+class TaggedEvents:
+    """EventLog.tagged 返回的视图"""
+
+    def __init__(self, log, fields):
+        self.log = log
+        self.fields = fields
+
+    def emit(self, kind, step, **data):
+        self.log.emit(kind, step, **self.fields, **data)
+
+    def fork(self):
+        return TaggedEvents(self.log.fork(), self.fields)
+
+    def flush(self):
+        self.log.flush()
+
+    def close(self):
+        self.log.close()
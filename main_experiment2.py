@@ -9,9 +9,10 @@ import pygame
 # 确保当前目录在Python路径中
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from dynamic_maze_env import DynamicMazeEnv
+from dynamic_maze_env import MultiAgentDynamicMazeEnv, BatchedDynamicMazeEnv
 from baseline_confidence_agent import BaselineConfidenceAgent
 from reflection_agent import ReflectionAgent
+from events import EventLog, JsonlSink
 
 class ExperimentAnalyzer:
     """实验数据分析器"""
@@ -29,8 +30,13 @@ class ExperimentAnalyzer:
             'stability': data['stability']
         })
 
-def run_experiment(env, agent, num_episodes, analyzer, agent_type, threshold_params=None):
-    """运行实验并记录性能指标"""
+def run_experiment(env, agent, num_episodes, analyzer, agent_type, threshold_params=None,
+                   scenario_bank=None):
+    """运行实验并记录性能指标（传入场景库时所有智能体回放完全相同的迷宫和动态变化）
+    
+    env 为 BatchedDynamicMazeEnv 时每个迷宫是一个种子，agent 需要一次处理所有迷宫的状态
+    （例如 ReflectionAgentPopulation，每个迷宫一个智能体），返回每个迷宫一份结果的列表。
+    """
     episode_rewards = []
     episode_steps = []
     success_rates = []
@@ -40,6 +46,12 @@ def run_experiment(env, agent, num_episodes, analyzer, agent_type, threshold_par
     if threshold_params and hasattr(agent, 'set_thresholds'):
         agent.set_thresholds(*threshold_params)
 
+    if scenario_bank is not None:
+        env.load_scenarios(scenario_bank)
+
+    if isinstance(env, BatchedDynamicMazeEnv):
+        return _run_batched_experiment(env, agent, num_episodes, analyzer, agent_type)
+
     for episode in range(num_episodes):
         state, _ = env.reset()
         episode_reward = 0
@@ -62,7 +74,7 @@ def run_experiment(env, agent, num_episodes, analyzer, agent_type, threshold_par
             episode_reward += reward
 
         # 记录episode指标
-        success = done and np.array_equal(state, env.goal_pos)
+        success = done and np.array_equal(env.current_pos, env.goal_pos)
         episode_rewards.append(episode_reward)
         episode_steps.append(steps)
         success_rates.append(1 if success else 0)
@@ -95,6 +107,75 @@ def run_experiment(env, agent, num_episodes, analyzer, agent_type, threshold_par
         'metrics': episode_metrics
     }
 
+def _run_batched_experiment(env, agents, num_episodes, analyzer, agent_type):
+    """在 BatchedDynamicMazeEnv 上运行 run_experiment：所有迷宫每步一起推进，各自完成 num_episodes 个episode
+    
+    结束的迷宫立即自动重置，最后一步用 info 中结束时的观察和最优路径长度学习和记录。已经完成
+    num_episodes 个episode的迷宫随其他迷宫继续推进，但不再记录。
+    """
+    autoreset, env.autoreset = env.autoreset, True
+    try:
+        return _batched_episodes(env, agents, num_episodes, analyzer, agent_type)
+    finally:
+        env.autoreset = autoreset
+
+def _batched_episodes(env, agents, num_episodes, analyzer, agent_type):
+    """_run_batched_experiment 的主循环（环境已开启自动重置）"""
+    num_envs = env.num_envs
+    results = [{'rewards': [], 'steps': [], 'success_rates': [], 'metrics': defaultdict(list)}
+               for _ in range(num_envs)]
+    episode_reward = np.zeros(num_envs)
+    steps = np.zeros(num_envs, dtype=np.int64)
+    # 稳定性所需的相邻奖励变化之和（滚动累加，不保存轨迹）
+    last_reward = np.zeros(num_envs)
+    reward_changes = np.zeros(num_envs)
+    
+    states, _ = env.reset()
+    while min(len(result['rewards']) for result in results) < num_episodes:
+        if hasattr(agents, 'set_goal_positions'):
+            agents.set_goal_positions(env.goal_pos)
+        steps += 1
+        actions = agents.select_action(states)
+        next_states, rewards, dones, truncated, info = env.step(actions)
+        
+        # 自动重置的迷宫用结束时的观察和 info 学习
+        final_info = info.get('final_info', info)
+        shortest_paths = final_info['optimal_path_length']
+        agents.learn(states, actions, rewards, info.get('final_obs', next_states), dones, steps, shortest_paths)
+        
+        reward_changes += np.where(steps > 1, np.abs(rewards - last_reward), 0.0)
+        last_reward = rewards
+        episode_reward += rewards
+        
+        for i in np.flatnonzero(dones | truncated):
+            result = results[i]
+            episode = len(result['rewards'])
+            if episode < num_episodes:
+                path_efficiency = (shortest_paths[i] / max(steps[i], 1)
+                                   if shortest_paths[i] != float('inf') else 0)
+                stability = 1.0 / (1.0 + reward_changes[i] / (steps[i] - 1)) if steps[i] > 1 else 0
+                result['rewards'].append(float(episode_reward[i]))
+                result['steps'].append(int(steps[i]))
+                result['success_rates'].append(1 if dones[i] else 0)
+                result['metrics']['path_efficiency'].append(path_efficiency)
+                result['metrics']['reward_stability'].append(stability)
+                result['metrics']['environment_changes'].append(final_info['episode_data'][i]['environment_updates'])
+                result['metrics']['goal_changes'].append(final_info['episode_data'][i]['goal_changes'])
+                analyzer.record_episode_data(agent_type, episode, {
+                    'reward': float(episode_reward[i]),
+                    'steps': int(steps[i]),
+                    'success': bool(dones[i]),
+                    'path_efficiency': path_efficiency,
+                    'stability': stability
+                })
+            episode_reward[i] = 0
+            steps[i] = 0
+            reward_changes[i] = 0
+        
+        states = next_states
+    
+    return results
+
 def calculate_final_metrics(results):
     """计算最终指标统计"""
     metrics = {
@@ -214,8 +295,12 @@ def start_visualization(size):
     viz = MazeVisualization(width=size * 50, height=size * 50 + 200)  # 额外空间用于指标面板
     return viz
 
-def main():
-    """主程序"""
+def main(checkpoint_dir=None, events_path=None):
+    """主程序
+    
+    checkpoint_dir: 检查点目录。目录中已有检查点时从上次训练的智能体继续，结束时保存。
+    events_path: 反思智能体事件流的 JSONL 输出文件，结束时（包括中断）写出缓存的事件。
+    """
     # 环境参数
     env_params = {
         'size': 10,
@@ -231,16 +316,23 @@ def main():
     # 初始化可视化
     viz = start_visualization(env_params['size'])
     
-    # 创建环境实例
-    env = DynamicMazeEnv(**env_params, seed=base_seed)
+    # 创建环境实例：两个智能体在同一个迷宫中同时行动（0号为基线，1号为反思智能体）
+    env = MultiAgentDynamicMazeEnv(num_agents=2, **env_params, seed=base_seed)
     env.max_steps = max_steps
     
     # 创建智能体
-    baseline_agent = BaselineConfidenceAgent(env.action_space)
-    reflection_agent = ReflectionAgent(env.action_space)
+    baseline_agent = BaselineConfidenceAgent(env.action_space, observation_space=env.observation_space)
+    events = EventLog(sink=JsonlSink(events_path)) if events_path else None
+    reflection_agent = ReflectionAgent(env.action_space, observation_space=env.observation_space, events=events)
     reflection_agent.confidence_threshold = 0.25  # 设置默认阈值
     reflection_agent.adaptation_threshold = 0.45  # 设置默认阈值
     
+    # 从检查点继续训练
+    if checkpoint_dir and os.path.isdir(os.path.join(checkpoint_dir, 'reflection')):
+        baseline_agent.load(os.path.join(checkpoint_dir, 'baseline'))
+        reflection_agent.load(os.path.join(checkpoint_dir, 'reflection'))
+        print(f"Loaded agent checkpoints from {checkpoint_dir}")
+    
     # 设置目标位置
     reflection_agent.set_goal_position(env.goal_pos)
     
@@ -252,8 +344,8 @@ def main():
         episode = 0
         while episode < num_episodes and viz.running:
             # 重置环境
-            baseline_state, _ = env.reset(seed=base_seed + episode)
-            reflection_state = baseline_state.copy()
+            states, _ = env.reset(seed=base_seed + episode)
+            baseline_state, reflection_state = states
             
             baseline_reward = 0
             reflection_reward = 0
@@ -276,12 +368,12 @@ def main():
                 baseline_action = baseline_agent.select_action(baseline_state)
                 reflection_action = reflection_agent.select_action(reflection_state)
                 
-                # 执行动作
-                baseline_next_state, b_reward, b_done, _, _ = env.step(baseline_action)
-                current_pos = np.array(env.current_pos)
-                env.current_pos = reflection_state
-                reflection_next_state, r_reward, r_done, _, _ = env.step(reflection_action)
-                env.current_pos = current_pos
+                # 执行动作（一次环境步同时推进两个智能体）
+                next_states, rewards, dones, _, _ = env.step([baseline_action, reflection_action])
+                baseline_next_state, reflection_next_state = next_states
+                b_reward, r_reward = rewards
+                b_done, r_done = dones
+                path_lengths = env.get_optimal_path_lengths()
                 
                 # 更新累积奖励
                 baseline_reward += b_reward
@@ -290,10 +382,10 @@ def main():
                 # 学习
                 baseline_agent.learn(baseline_state, baseline_action, b_reward, 
                                   baseline_next_state, b_done, steps, 
-                                  env.get_optimal_path_length())
+                                  path_lengths[0])
                 reflection_agent.learn(reflection_state, reflection_action, r_reward, 
                                     reflection_next_state, r_done, steps,
-                                    env.get_optimal_path_length())
+                                    path_lengths[1])
                 
                 # Update states
                 baseline_state = baseline_next_state
@@ -376,6 +468,7 @@ def main():
             print(f"  Success Rate: {reflection_success_rate:.3f} ({reflection_success_rate*100:.1f}%)")
             print(f"  Average Steps: {reflection_avg_steps:.1f}")
             print(f"  Average Reward: {reflection_avg_reward:.2f}")
+            print(f"  Environment Changes Detected: {reflection_agent.events.counts.get('env_change', 0)}")
             print(f"\nPerformance Comparison:")
             success_improvement = (reflection_success_rate - baseline_success_rate) * 100
             step_improvement = ((baseline_avg_steps - reflection_avg_steps) / baseline_avg_steps) * 100
@@ -385,6 +478,14 @@ def main():
             print(f"  Reward Improvement: {reward_improvement:+.1f}%")
             print(f"{'='*50}")
         
+        if checkpoint_dir:
+            baseline_agent.save(os.path.join(checkpoint_dir, 'baseline'))
+            reflection_agent.save(os.path.join(checkpoint_dir, 'reflection'))
+            print(f"Saved agent checkpoints to {checkpoint_dir}")
+        
+        # 写出事件流中尚未写入文件的事件
+        reflection_agent.events.close()
+        
         viz.running = False
         pygame.quit()
 
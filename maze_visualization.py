@@ -1,7 +1,7 @@
 import pygame
 import sys
 import numpy as np
-from dynamic_maze_env import DynamicMazeEnv
+from dynamic_maze_env import MultiAgentDynamicMazeEnv
 from baseline_confidence_agent import BaselineConfidenceAgent
 from reflection_agent import ReflectionAgent
 
@@ -88,14 +88,13 @@ def main():
     
     # 创建可视化和环境
     viz = MazeVisualization()
-    env = DynamicMazeEnv(**env_params)
+    env = MultiAgentDynamicMazeEnv(num_agents=2, **env_params)  # 0号为基线，1号为反思智能体
     baseline_agent = BaselineConfidenceAgent(env.action_space)
     reflection_agent = ReflectionAgent(env.action_space)
     
     # 初始化状态
-    state, _ = env.reset()
-    baseline_state = state.copy()
-    reflection_state = state.copy()
+    states, _ = env.reset()
+    baseline_state, reflection_state = states
     reflection_agent.set_goal_position(env.goal_pos)
     episode_steps = 0
     
@@ -120,11 +119,10 @@ def main():
                 reflection_action = reflection_agent.select_action(reflection_state)
                 
                 # 执行动作
-                baseline_next_state, b_reward, b_done, _, _ = env.step(baseline_action)
-                current_pos = np.array(env.current_pos)
-                env.current_pos = reflection_state
-                reflection_next_state, r_reward, r_done, _, _ = env.step(reflection_action)
-                env.current_pos = current_pos
+                next_states, rewards, dones, _, _ = env.step([baseline_action, reflection_action])
+                baseline_next_state, reflection_next_state = next_states
+                b_reward, r_reward = rewards
+                b_done, r_done = dones
                 
                 # 更新状态
                 baseline_state = baseline_next_state
@@ -132,13 +130,13 @@ def main():
                 episode_steps += 1
                 
                 # 计算最短路径
-                shortest_path = env.get_optimal_path_length()
+                path_lengths = env.get_optimal_path_lengths()
                 
                 # 学习
                 baseline_agent.learn(baseline_state, baseline_action, b_reward, 
-                                  baseline_next_state, b_done, episode_steps, shortest_path)
+                                  baseline_next_state, b_done, episode_steps, path_lengths[0])
                 reflection_agent.learn(reflection_state, reflection_action, r_reward, 
-                                    reflection_next_state, r_done, episode_steps, shortest_path)
+                                    reflection_next_state, r_done, episode_steps, path_lengths[1])
                 
                 # 更新显示
                 viz.current_maze = env.maze
@@ -168,9 +166,8 @@ def main():
                         reflection_stats['successes'] += 1
                     
                     # 重置环境和状态
-                    state, _ = env.reset()
-                    baseline_state = state.copy()
-                    reflection_state = state.copy()
+                    states, _ = env.reset()
+                    baseline_state, reflection_state = states
                     reflection_agent.set_goal_position(env.goal_pos)
                     episode_steps = 0
                     episode += 1
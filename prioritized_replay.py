@@ -0,0 +1,286 @@
+import numpy as np
+
+
+def make_records(capacity, state):
+    """按状态形状（整数或坐标）创建 (s, a, r, s', done) 结构化存储"""
+    shape = np.shape(state)
+    dtype = np.dtype([
+        ('state', np.int64, shape),
+        ('action', np.int64),
+        ('reward', np.float64),
+        ('next_state', np.int64, shape),
+        ('done', np.bool_),
+    ])
+    return np.zeros(capacity, dtype=dtype)
+
+
+def to_key(value):
+    """将存储的状态转换回 Q 表的键"""
+    if value.ndim == 0:
+        return int(value)
+    return tuple(value.tolist())
+
+
+class PriorityTrees:
+    """按第 0 维堆叠的若干棵求和树 / 最小树
+
+    叶子数取不小于容量的 2 的幂，树节点从 1 开始编号。求和树用于按优先级比例采样，最小树用于
+    找到优先级最低的叶子。写入、前缀查找、找最低优先级和采样都沿树的各层向量化处理所有树，
+    开销是 O(log 容量)。PrioritizedReplayBuffer 使用一棵树，ReflectionAgentPopulation 每个智能体
+    一棵。内部在展平的数组上按 树号 * 树宽 + 节点号 读写，避免二维花式索引的开销。
+    """
+
+    def __init__(self, num_trees, capacity):
+        self.capacity = capacity
+        self.leaf_count = 1 << (capacity - 1).bit_length()
+        self.width = 2 * self.leaf_count
+        self.sum_tree = np.zeros((num_trees, self.width))
+        self.min_tree = np.full((num_trees, self.width), np.inf)
+        self._sum = self.sum_tree.reshape(-1)
+        self._min = self.min_tree.reshape(-1)
+
+    def clear(self):
+        """清空所有树"""
+        self.sum_tree[:] = 0.0
+        self.min_tree[:] = np.inf
+
+    def leaves(self):
+        """所有叶子的优先级（视图）"""
+        return self.sum_tree[:, self.leaf_count:self.leaf_count + self.capacity]
+
+    def update(self, trees, indices, priorities):
+        """写入若干 (树, 叶子) 的优先级并逐层更新父节点（trees 可以广播，例如只有一个树号）"""
+        if len(indices) == 0:
+            return
+        base = np.asarray(trees, dtype=np.intp) * self.width
+        nodes = np.asarray(indices, dtype=np.intp) + self.leaf_count
+        self._sum[base + nodes] = priorities
+        self._min[base + nodes] = priorities
+        # 重复的父节点会被写入相同的值，因此无需去重
+        while nodes[0] > 1:
+            nodes = nodes >> 1
+            left = base + 2 * nodes
+            self._sum[base + nodes] = self._sum[left] + self._sum[left + 1]
+            self._min[base + nodes] = np.minimum(self._min[left], self._min[left + 1])
+
+    def min_leaves(self, trees):
+        """每棵树中优先级最低的叶子（相同时取下标最小者）"""
+        base = np.asarray(trees, dtype=np.intp) * self.width
+        nodes = np.ones(len(trees), dtype=np.intp)
+        while nodes[0] < self.leaf_count:
+            left = 2 * nodes
+            nodes = left + (self._min[base + left] > self._min[base + left + 1])
+        return nodes - self.leaf_count
+
+    def find_prefix(self, trees, values):
+        """在各自的求和树中查找前缀和落在 values 处的叶子"""
+        base = trees * self.width
+        nodes = np.ones(len(trees), dtype=np.intp)
+        while nodes[0] < self.leaf_count:
+            left = 2 * nodes
+            left_sum = self._sum[base + left]
+            # 浮点误差可能让 value 超出总和，此时不进入优先级为 0 的右子树
+            go_right = (values >= left_sum) & (self._sum[base + left + 1] > 0)
+            values = np.where(go_right, values - left_sum, values)
+            nodes = left + go_right
+        return nodes - self.leaf_count
+
+    def sample(self, trees, batch_size, rng):
+        """每棵树按优先级比例无放回地采样至多 batch_size 个叶子，返回 (树, 叶子) 两个扁平数组
+
+        有放回地批量抽取并保留每个叶子第一次出现的位置（等价于逐个无放回抽样），已选中的
+        叶子暂时把优先级置零，再为剩余名额重新抽取；优先级之和变为 0 的树不再抽取。
+        trees 需按升序排列且不重复。
+        """
+        trees = np.asarray(trees, dtype=np.intp)
+        remaining = np.full(len(trees), batch_size)
+        chosen_trees, chosen, saved = [], [], []
+        while True:
+            remaining[self._sum[trees * self.width + 1] <= 0] = 0
+            if not remaining.any():
+                break
+            owners = np.repeat(trees, remaining)
+            draws = self.find_prefix(owners, rng.random(len(owners)) * self._sum[owners * self.width + 1])
+            _, first = np.unique(owners * self.leaf_count + draws, return_index=True)
+            first.sort()
+            owners, draws = owners[first], draws[first]
+            remaining -= np.bincount(np.searchsorted(trees, owners), minlength=len(trees))
+            chosen_trees.append(owners)
+            chosen.append(draws)
+            saved.append(self._sum[owners * self.width + self.leaf_count + draws])
+            self.update(owners, draws, 0.0)
+        if not chosen:
+            return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp)
+        owners, leaves = np.concatenate(chosen_trees), np.concatenate(chosen)
+        self.update(owners, leaves, np.concatenate(saved))
+        return owners, leaves
+
+
+class PrioritizedReplayBuffer:
+    """基于求和树 / 最小树的优先级经验回放缓冲区
+
+    经验保存在固定容量的 NumPy 结构化数组中；求和树用于按优先级比例采样，最小树用于
+    在缓冲区满时找到优先级最低的经验进行替换。采样、优先级更新和淘汰都是 O(log n)，
+    因此每一步的开销不随缓冲区大小增长。树由只有一棵树的 PriorityTrees 保存。
+    """
+
+    def __init__(self, capacity, rng=None):
+        if capacity < 1:
+            raise ValueError("capacity must be positive")
+        self.capacity = int(capacity)
+        self._trees = PriorityTrees(1, self.capacity)
+        self._tree = np.zeros(1, dtype=np.intp)  # 唯一一棵树的树号
+        self.records = None  # 第一次写入时按状态的形状创建
+        self.size = 0
+        self.rng = rng if rng is not None else np.random.default_rng()
+
+    def __len__(self):
+        return self.size
+
+    def clear(self):
+        """清空缓冲区"""
+        self._trees.clear()
+        self.size = 0
+
+    @property
+    def priorities(self):
+        """当前所有经验的优先级（只读视图）"""
+        view = self._trees.leaves()[0, :self.size]
+        view.flags.writeable = False
+        return view
+
+    @property
+    def total_priority(self):
+        """所有优先级之和"""
+        return float(self._trees.sum_tree[0, 1])
+
+    def min_index(self):
+        """优先级最低的经验的下标（相同时取下标最小者）"""
+        return int(self._trees.min_leaves(self._tree)[0])
+
+    def add(self, state, action, reward, next_state, done, priority):
+        """加入一条经验，缓冲区已满时替换优先级最低的经验，返回写入的下标"""
+        if self.records is None:
+            self.records = make_records(self.capacity, state)
+        if self.size < self.capacity:
+            index = self.size
+            self.size += 1
+        else:
+            index = self.min_index()
+        self.records[index] = (state, action, reward, next_state, done)
+        self._trees.update(self._tree, [index], priority)
+        return index
+
+    def sample(self, batch_size):
+        """按优先级比例无放回地采样，返回经验下标"""
+        return self._trees.sample(self._tree, min(batch_size, self.size), self.rng)[1]
+
+    def update_priorities(self, indices, priorities):
+        """批量更新经验的优先级"""
+        self._trees.update(self._tree, indices, priorities)
+
+    def to_arrays(self):
+        """导出为数组（用于检查点）"""
+        if self.records is None:
+            return {}
+        return {'records': self.records[:self.size], 'priorities': np.array(self.priorities)}
+
+    def load_arrays(self, arrays):
+        """从检查点数组恢复，并重建求和树和最小树"""
+        self.clear()
+        if 'records' not in arrays:
+            self.records = None
+            return
+        records = arrays['records']
+        if len(records) > self.capacity:
+            raise ValueError("Checkpoint replay buffer is larger than the buffer capacity")
+        self.records = np.zeros(self.capacity, dtype=records.dtype)
+        self.records[:len(records)] = records
+        self.size = len(records)
+        if self.size:
+            self._trees.update(self._tree, np.arange(self.size), arrays['priorities'])
+
+    to_key = staticmethod(to_key)
+
+    def get(self, indices):
+        """按下标取出经验，状态以 Q 表键的形式返回"""
+        return [
+            (self.to_key(record['state']), int(record['action']), float(record['reward']),
+             self.to_key(record['next_state']), bool(record['done']))
+            for record in self.records[indices]
+        ]
+
+
+class UniformReplayBuffer:
+    """均匀采样的经验回放环形缓冲区
+
+    经验保存在预分配的 NumPy 结构化数组中，满了以后覆盖最旧的经验（与 deque(maxlen) 相同）。
+    写入和按下标均匀采样都是 O(1) / O(batch)，不随缓冲区大小增长。
+    """
+
+    def __init__(self, capacity, rng=None):
+        if capacity < 1:
+            raise ValueError("capacity must be positive")
+        self.capacity = int(capacity)
+        self.records = None  # 第一次写入时按状态的形状创建
+        self.size = 0
+        self._head = 0  # 下一条经验写入的位置
+        self.rng = rng if rng is not None else np.random.default_rng()
+
+    def __len__(self):
+        return self.size
+
+    def clear(self):
+        """清空缓冲区"""
+        self.size = 0
+        self._head = 0
+
+    def add(self, state, action, reward, next_state, done):
+        """加入一条经验，缓冲区已满时覆盖最旧的经验，返回写入的下标"""
+        if self.records is None:
+            self.records = make_records(self.capacity, state)
+        index = self._head
+        self.records[index] = (state, action, reward, next_state, done)
+        self._head = (index + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+        return index
+
+    def sample(self, batch_size):
+        """均匀地无放回采样，返回经验下标"""
+        return self.rng.choice(self.size, min(batch_size, self.size), replace=False)
+
+    def ordered_indices(self):
+        """从旧到新的经验下标"""
+        if self.size < self.capacity:
+            return np.arange(self.size)
+        return (np.arange(self.capacity) + self._head) % self.capacity
+
+    def to_arrays(self):
+        """导出为数组（用于检查点，按从旧到新的顺序）"""
+        if self.records is None:
+            return {}
+        return {'records': self.records[self.ordered_indices()]}
+
+    def load_arrays(self, arrays):
+        """从检查点数组恢复"""
+        self.clear()
+        if 'records' not in arrays:
+            self.records = None
+            return
+        records = arrays['records']
+        if len(records) > self.capacity:
+            raise ValueError("Checkpoint replay buffer is larger than the buffer capacity")
+        self.records = np.zeros(self.capacity, dtype=records.dtype)
+        self.records[:len(records)] = records
+        self.size = len(records)
+        self._head = self.size % self.capacity
+
+    to_key = staticmethod(to_key)
+
+    def get(self, indices):
+        """按下标取出经验，状态以 Q 表键的形式返回"""
+        return [
+            (self.to_key(record['state']), int(record['action']), float(record['reward']),
+             self.to_key(record['next_state']), bool(record['done']))
+            for record in self.records[indices]
+        ]
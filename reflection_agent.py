@@ -1,19 +1,59 @@
+import math
 import numpy as np
-from collections import defaultdict, deque
-import random
+from collections import deque
+from gymnasium import spaces
+from dense_q_table import DenseQTable, default_row, make_q_table, table_to_arrays, load_table_arrays
+from td_update import batch_td_update
+from checkpoint import save_arrays, load_arrays, prefixed, section
+from prioritized_replay import PrioritizedReplayBuffer
+from visit_counter import VisitCounter
+from reflection_window import ReflectionWindow
+from wall_memory import WallMemory
+from transition_history import TransitionHistory
+from state_store import BoundedStateStore, BoundedQTable
+from perf_stats import PhaseTimers
+from events import EventLog
 
 class ReflectionAgent:
-    def __init__(self, action_space):
+    # 检查点格式版本和需要保存的自适应参数
+    CHECKPOINT_VERSION = 1
+    CHECKPOINT_PARAMS = ('epsilon', 'alpha', 'gamma', 'memory_balance', 'environment_stability',
+                         'reflection_frequency', 'steps_count', 'last_env_change_step',
+                         'last_knowledge_transfer_step')
+    
+    def __init__(self, action_space, grid_size=None, observation_space=None, max_buffer_size=1000,
+                 max_states=None, max_state_bytes=None, eviction_policy='lru', collect_perf_stats=False,
+                 events=None):
         self.action_space = action_space
-        self.q_table_short_term = {}  # 短期记忆（对最近环境敏感）
-        self.q_table_long_term = {}   # 长期记忆（保存通用策略）
+        # 扁平整数状态（row * grid_size + col）需要网格边长来还原坐标；
+        # 未给出时从正方形的 Discrete 观察空间推断
+        if grid_size is None and isinstance(observation_space, spaces.Discrete):
+            side = math.isqrt(int(observation_space.n))
+            if side * side != observation_space.n:
+                raise ValueError("grid_size is required for a non-square Discrete observation space")
+            grid_size = side
+        self.grid_size = grid_size
         self.memory_balance = 0.5     # 短期和长期记忆的平衡因子 (0-1)
-        self.default_q_values = np.zeros(action_space.n)
+        # 未写入过的状态共享这一行只读的默认 Q 值，第一次写入时才物化出自己的一行
+        self.default_q_values = default_row(action_space.n)
+        
+        # 给定状态数或字节预算时，所有按状态存储的表共享一个有上限的状态存储，满时按策略淘汰
+        self.state_store = None
+        if max_state_bytes is not None:
+            budget = max_state_bytes // self._state_row_bytes(action_space.n)
+            max_states = budget if max_states is None else min(max_states, budget)
+        if max_states is not None:
+            self.state_store = BoundedStateStore(max_states, policy=eviction_policy, value_fn=self._state_values)
+            self.q_table_short_term = BoundedQTable(self.state_store, self.default_q_values)  # 短期记忆（对最近环境敏感）
+            self.q_table_long_term = BoundedQTable(self.state_store, self.default_q_values)   # 长期记忆（保存通用策略）
+        else:
+            # 提供观察空间时使用稠密数组 Q 表，否则使用 dict
+            self.q_table_short_term = make_q_table(observation_space, self.default_q_values, grid_size)
+            self.q_table_long_term = make_q_table(observation_space, self.default_q_values, grid_size)
         
-        # 改为列表而非deque，以支持优先级经验回放
-        self.experience_buffer = []  
-        self.experience_priorities = []  # 存储经验的优先级
-        self.max_buffer_size = 1000
+        # 优先级经验回放（求和树），采样和淘汰的开销与缓冲区大小无关
+        self.max_buffer_size = max_buffer_size
+        self.experience_buffer = PrioritizedReplayBuffer(max_buffer_size)
         
         # 学习参数
         self.epsilon = 0.9
@@ -28,24 +68,28 @@ class ReflectionAgent:
         self.recent_confidences = deque(maxlen=10)
         self.recent_rewards = deque(maxlen=10)
         self.recent_steps = deque(maxlen=10)
-        self.reflection_memory = []
+        self.reflection_memory = ReflectionWindow()
         self.reflection_frequency = 5
         
         # 访问统计
-        self.visit_counts = defaultdict(int)
+        # 稠密 Q 表时访问计数与 Q 数组按行对齐
+        key_index = self.q_table_short_term if isinstance(self.q_table_short_term, DenseQTable) else None
+        self.visit_counts = VisitCounter(action_space.n, key_index=key_index)
         self.np_random = np.random.default_rng()
         
         # 目标位置
         self.goal_pos = None
         
         # 墙壁记忆
-        self.wall_memory = {}
-        self.wall_memory_age = {}  # 记录墙壁记忆的年龄
-        self.memory_refresh_freq = 20  # 每20步检查一次墙壁记忆
+        # 墙壁记忆：年龄由时间戳隐式计算，超过 50 个周期后每个周期有 20% 的概率在查询时被遗忘
+        self.memory_refresh_freq = 20  # 墙壁记忆的老化周期（步）
+        self.wall_memory = WallMemory(action_space.n, key_index=key_index,
+                                      max_age=50 * self.memory_refresh_freq,
+                                      check_interval=self.memory_refresh_freq, forget_prob=0.2)
         self.steps_count = 0  # 步数计数器
         
         # 环境变化检测
-        self.state_action_results = {}  # 记录状态-动作对的结果历史
+        self.state_action_results = TransitionHistory(action_space.n, key_index=key_index, depth=3)  # 记录状态-动作对最近3次的结果
         self.environment_stability = 1.0  # 环境稳定性估计 (1.0表示完全稳定)
         self.env_change_detected = False  # 是否检测到环境变化
         self.last_env_change_step = 0  # 上次检测到环境变化的步数
@@ -58,18 +102,120 @@ class ReflectionAgent:
         # 知识转移参数
         self.knowledge_transfer_interval = 100  # 每100步执行一次知识转移
         self.last_knowledge_transfer_step = 0  # 上次知识转移的步数
+        
+        # 状态被淘汰时清空它在各个表中的行
+        if self.state_store is not None:
+            for table in (self.q_table_short_term, self.q_table_long_term, self.visit_counts,
+                          self.wall_memory, self.state_action_results):
+                self.state_store.on_evict(table.discard)
+        
+        # learn 各阶段的计时和计数（默认关闭，关闭时热路径上只多几次 None 判断）
+        self._perf = PhaseTimers() if collect_perf_stats else None
+        
+        # 结构化事件流（环境变化、目标变化、墙壁记忆清除、知识转移和遗忘），代替打印到标准输出
+        self.events = events if events is not None else EventLog()
+    
+    @staticmethod
+    def _state_row_bytes(n_actions):
+        """每个状态在各个按行对齐的数组中占用的字节数（用于把字节预算换算成状态数）"""
+        return (BoundedStateStore.row_nbytes() + 2 * BoundedQTable.row_nbytes(n_actions)
+                + VisitCounter.row_nbytes(n_actions) + WallMemory.row_nbytes(n_actions)
+                + TransitionHistory.row_nbytes(n_actions, depth=3))
+    
+    def _state_values(self, rows):
+        """按价值淘汰时每个状态的价值：两张 Q 表中较大的状态价值 max_a Q（从未写入的状态最先淘汰）"""
+        values = [np.where(table.mask[rows], table.max_q[rows], -np.inf)
+                  for table in (self.q_table_short_term, self.q_table_long_term)]
+        return np.maximum(*values)
+    
+    @property
+    def experience_priorities(self):
+        """经验回放缓冲区中各经验的优先级（只读）"""
+        return self.experience_buffer.priorities
+    
+    def _state_to_key(self, state):
+        """将状态转换为 Q 表的键：整数状态直接使用，坐标状态转为元组"""
+        if isinstance(state, (int, np.integer)):
+            return int(state)
+        return tuple(state)
+    
+    def _state_to_coords(self, state):
+        """将状态（整数或坐标）转换为 (行, 列)"""
+        if isinstance(state, (int, np.integer)):
+            return divmod(int(state), self.grid_size)
+        return state[0], state[1]
+    
+    def _q_rows(self, table):
+        """返回 Q 表中所有状态的键、行号（仅稠密表）、最大 Q 值和访问次数
+        
+        稠密表直接读取写入时维护的 max_q，不扫描 Q 数组；与访问计数器按行对齐时直接用行号读取，
+        不再逐个处理状态键（此时键为 None）。
+        """
+        if isinstance(table, DenseQTable):
+            indices = table.indices()
+            key_index = self.visit_counts.key_index
+            if key_index is not None and key_index.shape == table.shape:
+                return None, indices, table.max_q[indices], self.visit_counts.counts_at(indices)
+            keys = [table.key_of(index) for index in indices]
+            return keys, indices, table.max_q[indices], self.visit_counts.counts_for(keys)
+        keys = list(table.keys())
+        max_q = np.fromiter((table[key].max() for key in keys), dtype=np.float64, count=len(keys))
+        return keys, None, max_q, self.visit_counts.counts_for(keys)
+    
+    @staticmethod
+    def _select_extremes(values, k, largest=True):
+        """返回 values 中最大（或最小）的 k 个元素的位置
+        
+        用 np.partition 代替完整排序；值相同时优先取位置靠前的，与稳定排序的选择结果一致。
+        """
+        if k >= len(values):
+            return np.arange(len(values))
+        keyed = -values if largest else values
+        kth = np.partition(keyed, k - 1)[k - 1]
+        strict = np.flatnonzero(keyed < kth)
+        ties = np.flatnonzero(keyed == kth)[:k - strict.size]
+        return np.concatenate([strict, ties])
+    
+    def _q_values(self, table, state_key):
+        """读取某状态的 Q 值；未写入过的状态返回共享的只读默认行（不分配新行）"""
+        return table.get(state_key, self.default_q_values)
+    
+    def _set_q_value(self, table, state_key, action, value):
+        """写入一个 Q 值；状态第一次被写入时才从默认行物化出自己的一行（写时复制）"""
+        if isinstance(table, DenseQTable):
+            # 稠密表同时更新该状态的最大 Q 值
+            table.set_value(state_key, action, value)
+            return
+        if state_key not in table:
+            table[state_key] = self.default_q_values.copy()
+        table[state_key][action] = value
+    
+    def _scale_q_rows(self, table, keys, indices, chosen, factor, offset=0.0):
+        """将 _q_rows 返回的第 chosen 个状态的 Q 值改为 factor * Q + offset（稠密表一次切片完成）"""
+        if indices is not None:
+            rows = indices[chosen]
+            table.q[rows] = offset + factor * table.q[rows]
+            table.refresh_max(rows)
+            return
+        for i in chosen:
+            table[keys[i]] = offset + factor * table[keys[i]]
     
     def select_action(self, state):
         """改进的动作选择策略 - 更平衡的版本"""
-        state_key = tuple(state)
-        self.visit_counts[state_key] += 1
-        
+        state_key = self._state_to_key(state)
+        self.visit_counts.visit(state_key)
+        action = self._choose_action(state, state_key)
+        self.visit_counts.record_action(state_key, action)
+        return action
+    
+    def _choose_action(self, state, state_key):
+        """按方向偏置的 epsilon-greedy 和 UCB 选择动作"""
         # 更新 epsilon
         self.epsilon = max(self.epsilon_min, self.epsilon * self.epsilon_decay)
         
         # 计算方向和距离
-        current_pos = np.array(state)
-        goal_direction = self.goal_pos - current_pos
+        row, col = self._state_to_coords(state)
+        goal_direction = (self.goal_pos[0] - row, self.goal_pos[1] - col)
         vertical_dist = abs(goal_direction[0])
         horizontal_dist = abs(goal_direction[1])
         
@@ -88,10 +234,11 @@ class ReflectionAgent:
                 possible_actions.append(2)  # 左
             
         # 移除已知的墙壁方向
-        if state_key in self.wall_memory:
+        blocked = self.wall_memory.blocked_mask(state_key, self.steps_count)
+        if blocked:
             possible_actions = [
                 action for action in possible_actions 
-                if action not in self.wall_memory[state_key]
+                if not blocked >> action & 1
             ]
         
         # 如果所有预期动作都不可行，完全随机
@@ -104,32 +251,54 @@ class ReflectionAgent:
                 return self.np_random.choice(possible_actions)
             return self.action_space.sample()
         
-        # 使用短期和长期记忆的组合来选择动作
-        if state_key not in self.q_table_short_term:
-            self.q_table_short_term[state_key] = self.default_q_values.copy()
-        if state_key not in self.q_table_long_term:
-            self.q_table_long_term[state_key] = self.default_q_values.copy()
-        
         # 平滑记忆平衡调整
         target_balance = max(0.3, min(0.7, 1.0 - self.environment_stability))
         self.memory_balance = 0.9 * self.memory_balance + 0.1 * target_balance  # 平滑调整
         
-        # 组合两种记忆的Q值
+        # 组合两种记忆的Q值（只读，未见过的状态使用默认行）
         combined_q_values = (
-            self.memory_balance * self.q_table_short_term[state_key] + 
-            (1 - self.memory_balance) * self.q_table_long_term[state_key]
+            self.memory_balance * self._q_values(self.q_table_short_term, state_key) + 
+            (1 - self.memory_balance) * self._q_values(self.q_table_long_term, state_key)
         )
         
-        # 计算UCB值
-        ucb_values = combined_q_values + np.sqrt(
-            2 * np.log(sum(self.visit_counts.values())) / 
-            (np.array([self.visit_counts[state_key]] * self.action_space.n) + 1e-6)
-        )
+        # 计算UCB值（按每个动作的选择次数）
+        ucb_values = combined_q_values + self.visit_counts.ucb_bonus(state_key)
         
         return np.argmax(ucb_values)
     
+    def enable_perf_stats(self, enabled=True):
+        """打开或关闭 learn 的分阶段计时；关闭会丢弃已收集的数据"""
+        if not enabled:
+            self._perf = None
+        elif self._perf is None:
+            self._perf = PhaseTimers()
+    
+    def reset_perf_stats(self):
+        """清空已收集的计时和计数"""
+        if self._perf is not None:
+            self._perf.reset()
+    
+    def perf_stats(self):
+        """learn 各阶段的累计耗时（纳秒）、调用次数、事件计数和当前的表大小；未开启时返回 None"""
+        if self._perf is None:
+            return None
+        stats = self._perf.snapshot()
+        stats['gauges'] = {
+            'short_term_states': len(self.q_table_short_term),
+            'long_term_states': len(self.q_table_long_term),
+            'visited_states': len(self.visit_counts),
+            'replay_size': len(self.experience_buffer),
+        }
+        if self.state_store is not None:
+            stats['gauges'].update(('store_' + name, value) for name, value in self.state_store.stats().items())
+        return stats
+    
     def learn(self, state, action, reward, next_state, done, steps, shortest_path):
         """学习方法 - 使用优先级经验回放"""
+        perf = self._perf
+        if perf is not None:
+            t = perf.clock()
+        
         # 计算当前置信度
         confidence = self.calculate_confidence(steps, shortest_path)
         self.recent_confidences.append(confidence)
@@ -138,36 +307,20 @@ class ReflectionAgent:
             self.recent_steps.append(steps)
         
         # 存储经验
-        state_key = tuple(state)
-        next_state_key = tuple(next_state)
+        state_key = self._state_to_key(state)
+        next_state_key = self._state_to_key(next_state)
         
         # 计算TD误差作为优先级
-        if state_key not in self.q_table_short_term:
-            self.q_table_short_term[state_key] = self.default_q_values.copy()
-        if next_state_key not in self.q_table_short_term:
-            self.q_table_short_term[next_state_key] = self.default_q_values.copy()
-        
-        next_max = np.max(self.q_table_short_term[next_state_key])
+        next_max = np.max(self._q_values(self.q_table_short_term, next_state_key))
         target = reward + self.gamma * next_max * (1 - done)
-        current = self.q_table_short_term[state_key][action]
+        current = self._q_values(self.q_table_short_term, state_key)[action]
         td_error = abs(target - current)
+        if perf is not None:
+            t = perf.lap('td_error', t)
         
-        # 检测环境变化
-        state_action_key = (state_key, action)
-        current_result = (next_state_key, reward)
-        
-        # 记录结果并检测变化
-        if state_action_key in self.state_action_results:
-            previous_results = self.state_action_results[state_action_key]
-            
-            # 检查结果是否一致
-            consistent = True
-            for prev_state, prev_reward in previous_results:
-                # 如果下一状态不同或奖励差异大，认为环境可能变化
-                if prev_state != next_state_key or abs(prev_reward - reward) > 0.5:
-                    consistent = False
-                    break
-            
+        # 记录结果并检测环境变化：下一状态不同或奖励差异大，认为环境可能变化
+        consistent = self.state_action_results.record(state_key, action, next_state_key, reward)
+        if consistent is not None:
             if not consistent:
                 # 环境可能发生了变化
                 self.environment_stability = max(0.5, self.environment_stability * 0.8)
@@ -180,20 +333,13 @@ class ReflectionAgent:
                     
                     # 环境变化时的适应措施
                     self._adapt_to_environment_change()
+                    if perf is not None:
+                        perf.count('env_changes')
             else:
                 # 环境稳定
                 self.environment_stability = min(1.0, self.environment_stability * 1.02)
-        
-        # 更新状态-动作结果历史 (只保留最近3个结果)
-        if state_action_key not in self.state_action_results:
-            self.state_action_results[state_action_key] = []
-        
-        self.state_action_results[state_action_key].append(current_result)
-        if len(self.state_action_results[state_action_key]) > 3:
-            self.state_action_results[state_action_key] = self.state_action_results[state_action_key][-3:]
-        
-        # 存储经验和优先级
-        experience = (state_key, action, reward, next_state_key, done)
+        if perf is not None:
+            t = perf.lap('change_detection', t)
         
         # 如果是成功到达目标的经验，给予更高优先级
         if done and reward > 1.0:  # 成功到达目标
@@ -201,99 +347,94 @@ class ReflectionAgent:
         else:
             priority = max(0.01, td_error)  # 最小优先级为0.01
         
-        if len(self.experience_buffer) < self.max_buffer_size:
-            self.experience_buffer.append(experience)
-            self.experience_priorities.append(priority)
-        else:
-            # 替换优先级最低的经验
-            if len(self.experience_priorities) > 0:
-                min_idx = np.argmin(self.experience_priorities)
-                self.experience_buffer[min_idx] = experience
-                self.experience_priorities[min_idx] = priority
-        
-        # 更新短期和长期记忆
-        state_key = tuple(state)
-        next_state_key = tuple(next_state)
-        
-        # 确保两种记忆都有相关状态
-        for memory in [self.q_table_short_term, self.q_table_long_term]:
-            if state_key not in memory:
-                memory[state_key] = self.default_q_values.copy()
-            if next_state_key not in memory:
-                memory[next_state_key] = self.default_q_values.copy()
+        # 存储经验和优先级（缓冲区满时替换优先级最低的经验）
+        self.experience_buffer.add(state_key, action, reward, next_state_key, done, priority)
+        if perf is not None:
+            t = perf.lap('replay_insert', t)
         
+        # 更新短期和长期记忆（只有被写入的状态才会物化，下一状态只读）
         # 短期记忆更新 - 使用较高的学习率
         short_term_alpha = min(0.8, self.alpha * 1.5)
-        old_value = self.q_table_short_term[state_key][action]
-        next_max = np.max(self.q_table_short_term[next_state_key])
+        old_value = self._q_values(self.q_table_short_term, state_key)[action]
+        next_max = np.max(self._q_values(self.q_table_short_term, next_state_key))
         new_value = (1 - short_term_alpha) * old_value + short_term_alpha * (reward + self.gamma * next_max)
-        self.q_table_short_term[state_key][action] = new_value
+        self._set_q_value(self.q_table_short_term, state_key, action, new_value)
         
         # 长期记忆更新 - 使用较低的学习率，更稳定
         long_term_alpha = max(0.1, self.alpha * 0.7)
-        old_value = self.q_table_long_term[state_key][action]
-        next_max = np.max(self.q_table_long_term[next_state_key])
+        old_value = self._q_values(self.q_table_long_term, state_key)[action]
+        next_max = np.max(self._q_values(self.q_table_long_term, next_state_key))
         new_value = (1 - long_term_alpha) * old_value + long_term_alpha * (reward + self.gamma * next_max)
-        self.q_table_long_term[state_key][action] = new_value
+        self._set_q_value(self.q_table_long_term, state_key, action, new_value)
+        if perf is not None:
+            t = perf.lap('dual_update', t)
         
         # 经验回放
         if len(self.experience_buffer) >= 32:
             self._learn_from_experience()
+            if perf is not None:
+                t = perf.lap('replay_learn', t)
         
         # 更新步数计数器
         self.steps_count += 1
         
         # 更新墙壁记忆
         if reward <= -1.0:  # 撞墙的惩罚
-            if state_key not in self.wall_memory:
-                self.wall_memory[state_key] = set()
-                self.wall_memory_age[state_key] = {}
-            self.wall_memory[state_key].add(action)
-            self.wall_memory_age[state_key][action] = 0  # 重置年龄
-        
-        # 定期检查和清理墙壁记忆
-        if self.steps_count % self.memory_refresh_freq == 0:
-            self._refresh_wall_memory()
+            self.wall_memory.add(state_key, action, self.steps_count)  # 重置年龄
+        if perf is not None:
+            t = perf.lap('wall_memory', t)
         
         # 调用反思机制
         self.reflect(state, action, reward, next_state, done, steps)
+        if perf is not None:
+            perf.lap('reflect', t)
     
     def _learn_from_experience(self):
-        """优先级经验回放"""
+        """优先级经验回放（批量 TD 更新）"""
         if not self.experience_buffer:
             return
             
-        # 计算采样概率
-        priorities = np.array(self.experience_priorities)
-        probs = priorities / sum(priorities)
-        
-        # 采样经验
-        batch_size = min(32, len(self.experience_buffer))
-        batch_indices = np.random.choice(
-            len(self.experience_buffer), 
-            batch_size, 
-            replace=False,
-            p=probs
-        )
-        
-        batch = [self.experience_buffer[i] for i in batch_indices]
+        # 按优先级比例采样经验
+        batch_indices = self.experience_buffer.sample(32)
+        batch = self.experience_buffer.records[batch_indices]
+        table = self.q_table_short_term
+        
+        if isinstance(table, BoundedQTable):
+            # 涉及已淘汰状态的经验不再回放，否则回放会把刚淘汰的状态重新载入存储
+            resident = table.resident(batch['state']) & table.resident(batch['next_state'])
+            batch_indices, batch = batch_indices[resident], batch[resident]
+            if not len(batch):
+                return
+        
+        if isinstance(table, DenseQTable):
+            # 稠密表：直接在 Q 数组上按行号读写
+            rows = table.rows_for(batch['state'])
+            next_rows = table.rows_for(batch['next_state'])
+            table.touch(rows)  # 只有被更新的状态需要物化
+            td_errors = self._batch_td_update(table.q, rows, next_rows, batch['action'], batch['reward'],
+                                              max_q=table.max_q)
+        else:
+            # dict 表：把本批涉及的状态收集到临时矩阵中，更新后写回
+            to_key = self.experience_buffer.to_key
+            keys = {}
+            rows = np.array([keys.setdefault(to_key(s), len(keys)) for s in batch['state']], dtype=np.intp)
+            next_rows = np.array([keys.setdefault(to_key(s), len(keys)) for s in batch['next_state']], dtype=np.intp)
+            q = np.array([self._q_values(table, key) for key in keys], dtype=np.float64)
+            td_errors = self._batch_td_update(q, rows, next_rows, batch['action'], batch['reward'])
+            # 只写回被更新的状态；已有的行原地覆盖，新状态才分配自己的一行
+            keys = list(keys)
+            for row in np.unique(rows):
+                if keys[row] in table:
+                    table[keys[row]][:] = q[row]
+                else:
+                    table[keys[row]] = q[row].copy()
         
-        # 学习
-        for state_key, action, reward, next_state_key, done in batch:
-            if state_key not in self.q_table_short_term:
-                self.q_table_short_term[state_key] = self.default_q_values.copy()
-            if next_state_key not in self.q_table_short_term:
-                self.q_table_short_term[next_state_key] = self.default_q_values.copy()
-            
-            old_value = self.q_table_short_term[state_key][action]
-            next_max = np.max(self.q_table_short_term[next_state_key])
-            new_value = (1 - self.alpha) * old_value + self.alpha * (reward + self.gamma * next_max)
-            self.q_table_short_term[state_key][action] = new_value
-            
-            # 更新优先级
-            td_error = abs(new_value - old_value)
-            idx = self.experience_buffer.index((state_key, action, reward, next_state_key, done))
-            self.experience_priorities[idx] = max(0.01, td_error)
+        # 更新优先级
+        self.experience_buffer.update_priorities(batch_indices, np.maximum(0.01, td_errors))
+    
+    def _batch_td_update(self, q, rows, next_rows, actions, rewards, max_q=None):
+        """对一批经验做 Q 学习更新（原地修改 q），返回每条经验的 TD 误差"""
+        return batch_td_update(q, rows, next_rows, actions, rewards, self.alpha, self.gamma, max_q=max_q)
     
     def calculate_confidence(self, steps, shortest_path):
         """计算当前置信度"""
@@ -306,53 +447,83 @@ class ReflectionAgent:
         if self.goal_pos is None:
             return
         
-        try:
-            # 记录反思数据
-            self.reflection_memory.append((state, action, reward, next_state, done, steps))
+        # 记录反思数据（滚动更新进展、完成次数和奖励之和）
+        row, col = self._state_to_coords(state)
+        distance = abs(row - self.goal_pos[0]) + abs(col - self.goal_pos[1])
+        self.reflection_memory.append(distance, reward, done)
+        
+        # 只有在收集了足够的数据后才进行反思
+        if len(self.reflection_memory) >= self.reflection_frequency:
+            # 计算性能得分 - 调整权重以更好地评估性能
+            performance_score = self.reflection_memory.performance_score(self.reflection_frequency)
+            perf = self._perf
+            if perf is not None:
+                perf.count('reflections')
             
-            # 只有在收集了足够的数据后才进行反思
-            if len(self.reflection_memory) >= self.reflection_frequency:
-                # 计算性能指标
-                distances = []
-                progress = 0
-                
-                for i, (s, a, r, ns, d, _) in enumerate(self.reflection_memory):
-                    if i > 0:
-                        prev_s = self.reflection_memory[i-1][0]
-                        prev_dist = np.sum(np.abs(np.array(prev_s) - self.goal_pos))
-                        curr_dist = np.sum(np.abs(np.array(s) - self.goal_pos))
-                        distances.append(curr_dist)
-                        progress += (prev_dist - curr_dist)
-                
-                # 如果没有足够的数据计算进展，则设为0
-                if not distances:
-                    progress = 0
-                
-                # 计算性能得分 - 调整权重以更好地评估性能
-                performance_score = max(
-                    0.0,
-                    0.5 * (progress / self.reflection_frequency) +  # 增加进展的权重
-                    0.3 * (sum(1 for exp in self.reflection_memory if exp[4]) / self.reflection_frequency) +  # 完成率权重
-                    0.2 * (sum(exp[2] for exp in self.reflection_memory) / self.reflection_frequency)  # 平均奖励权重
-                )
-                
-                # 提高适应阈值，减少不必要的策略调整
-                if performance_score < 0.4:  # 从0.35提高到0.4，使适应更加积极
-                    self.adapt_strategy(progress, distances[-1] if distances else 0)
-                
-                # 执行知识转移 - 只在环境相对稳定时
-                if self.environment_stability > 0.6:  # 从0.7降低到0.6
-                    self._transfer_knowledge()
-                
-                self.reflection_memory = []
+            # 提高适应阈值，减少不必要的策略调整
+            if performance_score < 0.4:  # 从0.35提高到0.4，使适应更加积极
+                self.adapt_strategy(self.reflection_memory.progress, self.reflection_memory.current_distance)
+                if perf is not None:
+                    perf.count('strategy_adaptations')
+            
+            # 执行知识转移 - 只在环境相对稳定时
+            if self.environment_stability > 0.6:  # 从0.7降低到0.6
+                self._transfer_knowledge()
+                if perf is not None:
+                    perf.count('knowledge_transfers')
             
-        except Exception as e:
-            print(f"Error in reflect: {e}")
+            self.reflection_memory.clear()
 
     def set_goal_position(self, goal_pos):
-        """设置目标位置"""
-        self.goal_pos = np.array(goal_pos)
+        """设置目标位置（可以是坐标或扁平整数）"""
+        goal_pos = np.array(self._state_to_coords(goal_pos))
+        if self.goal_pos is None or not np.array_equal(goal_pos, self.goal_pos):
+            self.events.emit('goal_change', self.steps_count, goal=goal_pos)
+        self.goal_pos = goal_pos
 
+    def _checkpoint_components(self):
+        """检查点中各个组件的前缀和对象"""
+        components = (('visits', self.visit_counts), ('walls', self.wall_memory),
+                      ('history', self.state_action_results), ('replay', self.experience_buffer))
+        if self.state_store is not None:
+            components = (('store', self.state_store),) + components
+        return components
+    
+    def save(self, path):
+        """保存检查点：路径以 .npz 结尾时保存为压缩文件，否则保存为 .npy 文件目录"""
+        dense = isinstance(self.q_table_short_term, DenseQTable)
+        arrays = {
+            'meta': np.array([self.CHECKPOINT_VERSION, self.action_space.n, dense], dtype=np.int64),
+            'params': np.array([getattr(self, name) for name in self.CHECKPOINT_PARAMS], dtype=np.float64),
+        }
+        arrays.update(prefixed('q_short', table_to_arrays(self.q_table_short_term)))
+        arrays.update(prefixed('q_long', table_to_arrays(self.q_table_long_term)))
+        for prefix, component in self._checkpoint_components():
+            arrays.update(prefixed(prefix, component.to_arrays()))
+        save_arrays(path, arrays)
+    
+    def load(self, path, mmap=False):
+        """加载检查点；目录格式在 mmap=True 时以写时复制方式内存映射大数组，多个进程共享同一份数据
+        
+        智能体需要用与保存时相同的动作空间和 Q 表后端（观察空间）创建。
+        """
+        arrays = load_arrays(path, mmap=mmap)
+        version, n_actions, dense = (int(v) for v in arrays['meta'])
+        if version != self.CHECKPOINT_VERSION:
+            raise ValueError(f"Unsupported checkpoint version {version}")
+        if n_actions != self.action_space.n or bool(dense) != isinstance(self.q_table_short_term, DenseQTable):
+            raise ValueError("Checkpoint does not match the agent's action space or Q-table backend")
+        if bool(section(arrays, 'store')) != (self.state_store is not None):
+            raise ValueError("Checkpoint and agent disagree on using a bounded state store")
+        
+        for name, value in zip(self.CHECKPOINT_PARAMS, arrays['params']):
+            setattr(self, name, type(getattr(self, name))(value))
+        load_table_arrays(self.q_table_short_term, section(arrays, 'q_short'))
+        load_table_arrays(self.q_table_long_term, section(arrays, 'q_long'))
+        for prefix, component in self._checkpoint_components():
+            component.load_arrays(section(arrays, prefix))
+        return self
+    
     def adapt_strategy(self, progress, current_distance):
         """根据性能调整策略 - 更平衡的版本"""
         # 如果没有向目标靠近，适度增加探索率
@@ -381,72 +552,38 @@ class ReflectionAgent:
             avg_confidence = np.mean(self.recent_confidences)
             if avg_confidence < 0.2:
                 # 只重置少量状态，并且只重置那些置信度低的状态
-                num_to_reset = max(3, min(5, int(len(self.q_table_short_term) * 0.05)))
+                keys, indices, _, visits = self._q_rows(self.q_table_short_term)
+                num_to_reset = max(3, min(5, int(len(visits) * 0.05)))
                 
-                # 尝试找出置信度低的状态
-                low_confidence_states = []
-                for state_key in self.q_table_short_term.keys():
-                    if tuple(state_key) in self.visit_counts and self.visit_counts[tuple(state_key)] > 2:
-                        # 这是一个被多次访问但可能没有好结果的状态
-                        low_confidence_states.append(state_key)
+                # 尝试找出置信度低的状态（被多次访问但可能没有好结果的状态）
+                low_confidence = np.flatnonzero(visits > 2)
                 
                 # 如果找到了足够的低置信度状态，就重置它们
-                if len(low_confidence_states) >= num_to_reset:
-                    keys_to_reset = random.sample(low_confidence_states, num_to_reset)
+                if low_confidence.size >= num_to_reset:
+                    chosen = self.np_random.choice(low_confidence, num_to_reset, replace=False)
                 else:
                     # 否则随机选择
-                    keys_to_reset = random.sample(list(self.q_table_short_term.keys()), 
-                                                 min(num_to_reset, len(self.q_table_short_term)))
+                    chosen = self.np_random.choice(len(visits), min(num_to_reset, len(visits)), replace=False)
                 
                 # 不完全重置，而是部分降低Q值
-                for key in keys_to_reset:
-                    self.q_table_short_term[key] = self.q_table_short_term[key] * 0.5  # 只降低50%
-
-    def _refresh_wall_memory(self):
-        """更新墙壁记忆的年龄，并移除过旧的记忆"""
-        keys_to_check = list(self.wall_memory.keys())
-        for state_key in keys_to_check:
-            actions_to_check = list(self.wall_memory[state_key])
-            for action in actions_to_check:
-                # 增加年龄
-                self.wall_memory_age[state_key][action] += 1
-                
-                # 如果年龄超过阈值，随机决定是否移除
-                if self.wall_memory_age[state_key][action] > 50:  # 50步后开始考虑移除
-                    if np.random.random() < 0.2:  # 20%的概率移除
-                        self.wall_memory[state_key].remove(action)
-                        del self.wall_memory_age[state_key][action]
-            
-            # 如果该状态没有墙壁记忆了，删除该状态
-            if not self.wall_memory[state_key]:
-                del self.wall_memory[state_key]
-                del self.wall_memory_age[state_key]
+                self._scale_q_rows(self.q_table_short_term, keys, indices, chosen, 0.5)  # 只降低50%
 
     def _adapt_to_environment_change(self):
         """当检测到环境变化时调整策略"""
         # 1. 临时增加探索率
         self.epsilon = min(0.9, self.epsilon + 0.2)
         
-        # 2. 主动清除部分墙壁记忆
-        if self.wall_memory:
-            # 随机清除墙壁记忆
-            keys_to_check = list(self.wall_memory.keys())
-            num_to_clear = max(1, int(len(keys_to_check) * self.wall_memory_clear_ratio))
-            keys_to_clear = random.sample(keys_to_check, num_to_clear)
-            
-            for key in keys_to_clear:
-                del self.wall_memory[key]
-                if key in self.wall_memory_age:
-                    del self.wall_memory_age[key]
+        # 2. 主动随机清除部分墙壁记忆
+        cleared = self.wall_memory.forget_fraction(self.wall_memory_clear_ratio)
+        if cleared:
+            self.events.emit('wall_memory_clear', self.steps_count, states=cleared)
         
         # 3. 降低部分经验的优先级
-        if self.experience_priorities:
+        if self.experience_buffer:
             # 降低50%的经验优先级
-            num_to_reduce = max(1, int(len(self.experience_priorities) * 0.5))
-            indices = random.sample(range(len(self.experience_priorities)), num_to_reduce)
-            
-            for idx in indices:
-                self.experience_priorities[idx] *= 0.5
+            num_to_reduce = max(1, int(len(self.experience_buffer) * 0.5))
+            indices = self.np_random.choice(len(self.experience_buffer), num_to_reduce, replace=False)
+            self.experience_buffer.update_priorities(indices, self.experience_priorities[indices] * 0.5)
         
         # 4. 重置反思频率
         self.reflection_frequency = 3  # 环境变化后更频繁地反思
@@ -457,21 +594,17 @@ class ReflectionAgent:
         # 更保守的短期记忆重置
         if self.q_table_short_term:
             # 降低重置比例从30%到20%
-            keys_to_reset = random.sample(
-                list(self.q_table_short_term.keys()), 
-                max(1, int(len(self.q_table_short_term) * 0.2))
-            )
-            # 更温和的重置方式
-            for key in keys_to_reset:
-                self.q_table_short_term[key] = (
-                    0.2 * self.default_q_values + 
-                    0.8 * self.q_table_short_term[key]  # 保留更多原始信息
-                )
+            keys, indices, _, visits = self._q_rows(self.q_table_short_term)
+            chosen = self.np_random.choice(len(visits), max(1, int(len(visits) * 0.2)), replace=False)
+            # 更温和的重置方式：保留 80% 的原始信息
+            self._scale_q_rows(self.q_table_short_term, keys, indices, chosen, 0.8,
+                               offset=0.2 * self.default_q_values)
         
         # 移除环境变化前的知识转移，避免保留过时知识
         # self._transfer_knowledge()  # 注释掉这一行
         
-        print(f"Environment change detected at step {self.steps_count}! Adapting strategy...")
+        self.events.emit('env_change', self.steps_count, stability=self.environment_stability,
+                         epsilon=self.epsilon)
 
     def _transfer_knowledge(self):
         """从短期记忆转移有价值的知识到长期记忆"""
@@ -484,28 +617,32 @@ class ReflectionAgent:
         transfer_ratio = min(0.4, 0.35 * (1 + self.environment_stability))
         
         # 选择访问频率高且Q值较大的状态
-        candidates = []
-        for state_key in self.q_table_short_term:
-            if state_key in self.visit_counts and self.visit_counts[state_key] > visit_threshold:
-                max_q = np.max(self.q_table_short_term[state_key])
-                if max_q > q_threshold:
-                    candidates.append((state_key, max_q))
-        
-        # 按Q值排序并选择前transfer_ratio转移
-        if candidates:
-            candidates.sort(key=lambda x: x[1], reverse=True)
-            num_to_transfer = max(1, int(len(candidates) * transfer_ratio))
+        keys, indices, max_q, visits = self._q_rows(self.q_table_short_term)
+        candidates = np.flatnonzero((visits > visit_threshold) & (max_q > q_threshold))
+        
+        # 选择Q值最高的前transfer_ratio转移
+        if candidates.size:
+            num_to_transfer = max(1, int(candidates.size * transfer_ratio))
+            chosen = candidates[self._select_extremes(max_q[candidates], num_to_transfer)]
             
-            for i in range(num_to_transfer):
-                state_key = candidates[i][0]
-                # 将短期记忆中的知识融合到长期记忆中
-                if state_key in self.q_table_long_term:
-                    self.q_table_long_term[state_key] = (
-                        0.6 * self.q_table_long_term[state_key] +
-                        0.4 * self.q_table_short_term[state_key]
-                    )
-                else:
-                    self.q_table_long_term[state_key] = self.q_table_short_term[state_key].copy()
+            # 只读取被选中状态的 Q 值，将短期记忆中的知识融合到长期记忆中
+            short_term, long_term = self.q_table_short_term, self.q_table_long_term
+            if indices is not None:
+                short_q = short_term.q[indices[chosen]]
+            else:
+                short_q = np.array([short_term[keys[i]] for i in chosen], dtype=np.float64)
+            if isinstance(long_term, DenseQTable) and indices is not None:
+                rows = indices[chosen]
+                blended = 0.6 * long_term.q[rows] + 0.4 * short_q
+                long_term.assign(rows, np.where(long_term.mask[rows, None], blended, short_q))
+            else:
+                for i, row in zip(chosen, short_q):
+                    state_key = keys[i] if keys is not None else short_term.key_of(indices[i])
+                    if state_key in long_term:
+                        long_term[state_key] = 0.6 * long_term[state_key] + 0.4 * row
+                    else:
+                        long_term[state_key] = row.copy()
+            self.events.emit('knowledge_transfer', self.steps_count, states=len(chosen))
         
         # 添加知识遗忘机制
         self._forget_outdated_knowledge()
@@ -514,26 +651,25 @@ class ReflectionAgent:
         """清除长期记忆中不再有用的知识"""
         if len(self.q_table_long_term) > 800:  # 从1000降低到800
             # 找出访问频率低且Q值低的状态
-            candidates_to_forget = []
-            for state_key in self.q_table_long_term:
-                if state_key not in self.visit_counts or self.visit_counts[state_key] < 3:  # 从2提高到3
-                    max_q = np.max(self.q_table_long_term[state_key])
-                    if max_q < 0.25:  # 从0.2提高到0.25
-                        candidates_to_forget.append((state_key, max_q))
+            keys, indices, max_q, visits = self._q_rows(self.q_table_long_term)
+            candidates = np.flatnonzero((visits < 3) & (max_q < 0.25))  # 访问阈值从2提高到3，Q阈值从0.2提高到0.25
             
-            # 按Q值排序并选择前15%遗忘
-            if candidates_to_forget:
-                candidates_to_forget.sort(key=lambda x: x[1])
-                num_to_forget = max(1, int(len(candidates_to_forget) * 0.15))  # 从10%增加到15%
+            # 选择Q值最低的前15%遗忘
+            if candidates.size:
+                num_to_forget = max(1, int(candidates.size * 0.15))  # 从10%增加到15%
+                forget = candidates[self._select_extremes(max_q[candidates], num_to_forget, largest=False)]
                 
-                for i in range(num_to_forget):
-                    state_key = candidates_to_forget[i][0]
-                    del self.q_table_long_term[state_key]
+                if indices is not None:
+                    self.q_table_long_term.discard(indices[forget])
+                else:
+                    for i in forget:
+                        del self.q_table_long_term[keys[i]]
+                self.events.emit('knowledge_forget', self.steps_count, states=len(forget))
 
     def step(self, state, action, reward, next_state, done, steps, shortest_path=None):
         """更新智能体的状态和学习"""
-        state_key = tuple(state)
-        next_state_key = tuple(next_state)
+        state_key = self._state_to_key(state)
+        next_state_key = self._state_to_key(next_state)
         
         # 更新环境稳定性估计
         self._update_environment_stability(state, action, next_state)
@@ -545,52 +681,28 @@ class ReflectionAgent:
             self.last_env_change_step = self.steps_count
             self._adapt_to_environment_change()
         
-        # 更新Q值
-        if state_key not in self.q_table_short_term:
-            self.q_table_short_term[state_key] = self.default_q_values.copy()
-        if next_state_key not in self.q_table_short_term:
-            self.q_table_short_term[next_state_key] = self.default_q_values.copy()
-        
         # 使用短期记忆进行Q学习更新
-        old_value = self.q_table_short_term[state_key][action]
-        next_max = np.max(self.q_table_short_term[next_state_key])
+        old_value = self._q_values(self.q_table_short_term, state_key)[action]
+        next_max = np.max(self._q_values(self.q_table_short_term, next_state_key))
         
         # 使用优先级经验回放的TD误差作为优先级
         td_error = abs(reward + self.gamma * next_max - old_value)
         
         # 更新Q值
         new_value = old_value + self.alpha * (reward + self.gamma * next_max - old_value)
-        self.q_table_short_term[state_key][action] = new_value
+        self._set_q_value(self.q_table_short_term, state_key, action, new_value)
         
         # 更新墙壁记忆
         if reward == -1 and np.array_equal(state, next_state):  # 撞墙
-            if state_key not in self.wall_memory:
-                self.wall_memory[state_key] = []
-                self.wall_memory_age[state_key] = {}
-            
-            if action not in self.wall_memory[state_key]:
-                self.wall_memory[state_key].append(action)
-                self.wall_memory_age[state_key][action] = 0
-        
-        # 存储经验到缓冲区（带优先级）
-        experience = (state, action, reward, next_state, done)
-        if len(self.experience_buffer) < self.max_buffer_size:
-            self.experience_buffer.append(experience)
-            self.experience_priorities.append(td_error)
-        else:
-            # 替换优先级最低的经验
-            if self.experience_priorities:
-                min_priority_idx = np.argmin(self.experience_priorities)
-                self.experience_buffer[min_priority_idx] = experience
-                self.experience_priorities[min_priority_idx] = td_error
+            self.wall_memory.add(state_key, action, self.steps_count)
+        
+        # 存储经验到缓冲区（带优先级，满时替换优先级最低的经验）
+        self.experience_buffer.add(state_key, action, reward, next_state_key, done, td_error)
         
         # 反思和总结经验
         self.reflect(state, action, reward, next_state, done, steps)
         
-        # 定期更新墙壁记忆
         self.steps_count += 1
-        if self.steps_count % self.memory_refresh_freq == 0:
-            self._refresh_wall_memory()
         
         # 定期知识转移
         if self.steps_count - self.last_knowledge_transfer_step >= 100:
@@ -598,4 +710,4 @@ class ReflectionAgent:
             self.last_knowledge_transfer_step = self.steps_count
         
         # 设置目标位置
-        self.goal_pos = shortest_path[-1] if shortest_path and len(shortest_path) > 0 else None
\ No newline at end of file
+        self.goal_pos = shortest_path[-1] if shortest_path and len(shortest_path) > 0 else None
@@ -0,0 +1,468 @@
+import numpy as np
+from prioritized_replay import PriorityTrees
+from reflection_window import window_score
+from td_update import batch_td_update
+from transition_history import record_outcomes
+from wall_memory import expire_walls
+
+
+class ReflectionAgentPopulation:
+    """N 个反思智能体的结构化数组（struct-of-arrays）实现
+
+    每个智能体的 Q 表、探索率、记忆平衡、环境稳定性估计、访问计数、墙壁记忆、结果历史、
+    经验回放和反思窗口都按第 0 维堆叠成数组，select_action 和 learn 一次处理 N 条状态/转移。
+    学习、反思和适应规则与 ReflectionAgent 逐个智能体相同，但随机数的抽取方式不同，
+    因此只在分布上（而不是逐个随机数）与标量智能体一致。
+
+    状态是 (N, 2) 的坐标或 (N,) 的扁平整数（row * grid_size + col），可以直接接
+    BatchedDynamicMazeEnv 的观察。学习参数可以按智能体分别给定，便于在一个进程中做参数扫描。
+    """
+
+    # 可按智能体设置的参数及默认值（与 ReflectionAgent 一致）
+    PARAMS = {
+        'epsilon': 0.9,
+        'epsilon_min': 0.3,
+        'epsilon_decay': 0.999,
+        'alpha': 0.5,
+        'gamma': 0.9,
+        'environment_stability_threshold': 0.6,
+        'env_change_cooldown': 30,
+        'wall_memory_clear_ratio': 0.4,
+    }
+    BATCH_SIZE = 32       # 经验回放批大小
+    HISTORY_DEPTH = 3     # 每个状态-动作对保留的结果数
+    REWARD_TOLERANCE = 0.5  # 奖励差异超过该值时认为结果不一致
+    RECENT_LENGTH = 10    # 最近置信度/奖励/步数的窗口长度
+
+    def __init__(self, num_agents, grid_size, n_actions=4, max_buffer_size=1000, seed=None, **params):
+        unknown = set(params) - set(self.PARAMS)
+        if unknown:
+            raise TypeError(f"Unknown population parameters: {sorted(unknown)}")
+        self.num_agents = num_agents
+        self.grid_size = grid_size
+        self.n_actions = n_actions
+        self.num_states = grid_size * grid_size
+        self.max_buffer_size = max_buffer_size
+        self.rng = np.random.default_rng(seed)
+        self._agents = np.arange(num_agents)
+        shape = (num_agents, self.num_states)
+
+        # 学习参数（每个智能体一个值）
+        for name, default in self.PARAMS.items():
+            value = np.broadcast_to(np.asarray(params.get(name, default), dtype=np.float64), (num_agents,))
+            setattr(self, name, value.copy())
+        self.memory_balance = np.full(num_agents, 0.5)
+        self.environment_stability = np.ones(num_agents)
+        self.reflection_frequency = np.full(num_agents, 5, dtype=np.int64)
+        self.steps_count = np.zeros(num_agents, dtype=np.int64)
+        self.last_env_change_step = np.zeros(num_agents, dtype=np.int64)
+        self.env_change_detected = np.zeros(num_agents, dtype=bool)
+
+        # 短期和长期 Q 表；present 标记状态是否被写入过（对应 dict 中是否有这个键），
+        # 未写入的行保持默认值 0，读取不会改变 present
+        self.q_short = np.zeros(shape + (n_actions,))
+        self.q_long = np.zeros(shape + (n_actions,))
+        self.short_present = np.zeros(shape, dtype=bool)
+        self.long_present = np.zeros(shape, dtype=bool)
+
+        # 访问统计
+        self.visit_counts = np.zeros(shape, dtype=np.int64)
+        self.action_counts = np.zeros(shape + (n_actions,), dtype=np.int64)
+        self.visit_totals = np.zeros(num_agents, dtype=np.int64)
+
+        # 墙壁记忆：动作位掩码和最后确认/评估的步数，超过 max_age 后按周期惰性遗忘
+        self.memory_refresh_freq = 20
+        self.wall_max_age = 50 * self.memory_refresh_freq
+        self.wall_forget_prob = 0.2
+        self.wall_bits = np.zeros(shape, dtype=np.uint8)
+        self.wall_confirmed = np.zeros(shape + (n_actions,), dtype=np.int64)
+        self.wall_checked = np.zeros(shape + (n_actions,), dtype=np.int64)
+
+        # 状态-动作对最近几次结果的环形数组
+        history_shape = shape + (n_actions, self.HISTORY_DEPTH)
+        self.history_next = np.zeros(history_shape, dtype=np.intp)
+        self.history_rewards = np.zeros(history_shape)
+        self.history_counts = np.zeros(shape + (n_actions,), dtype=np.int8)
+        self.history_heads = np.zeros(shape + (n_actions,), dtype=np.int8)
+
+        # 优先级经验回放：每个智能体一行经验，优先级保存在每个智能体一棵的求和树/最小树中
+        replay_shape = (num_agents, max_buffer_size)
+        self.replay_states = np.zeros(replay_shape, dtype=np.intp)
+        self.replay_actions = np.zeros(replay_shape, dtype=np.intp)
+        self.replay_rewards = np.zeros(replay_shape)
+        self.replay_next_states = np.zeros(replay_shape, dtype=np.intp)
+        self.replay_dones = np.zeros(replay_shape, dtype=bool)
+        self.replay_trees = PriorityTrees(num_agents, max_buffer_size)
+        self.replay_sizes = np.zeros(num_agents, dtype=np.int64)
+
+        # 最近的置信度、奖励和完成步数（环形数组）
+        self.recent_confidences = _RecentValues(num_agents, self.RECENT_LENGTH)
+        self.recent_rewards = _RecentValues(num_agents, self.RECENT_LENGTH)
+        self.recent_steps = _RecentValues(num_agents, self.RECENT_LENGTH)
+
+        # 反思窗口的滚动累加量
+        self.goal_pos = np.zeros((num_agents, 2), dtype=np.int64)
+        self.has_goal = np.zeros(num_agents, dtype=bool)
+        self.window_count = np.zeros(num_agents, dtype=np.int64)
+        self.window_first_distance = np.zeros(num_agents, dtype=np.int64)
+        self.window_last_distance = np.zeros(num_agents, dtype=np.int64)
+        self.window_done_count = np.zeros(num_agents, dtype=np.int64)
+        self.window_reward_sum = np.zeros(num_agents)
+
+    def _to_index(self, states):
+        """把 (N, 2) 坐标或 (N,) 扁平整数状态转换为扁平整数"""
+        states = np.asarray(states, dtype=np.intp)
+        if states.ndim == 2:
+            return states[:, 0] * self.grid_size + states[:, 1]
+        return states
+
+    def set_goal_positions(self, goal_pos, agents=None):
+        """设置目标位置：(N, 2) 坐标或 (N,) 扁平整数；agents 为 None 时设置全部智能体"""
+        agents = self._agents if agents is None else np.asarray(agents)
+        index = self._to_index(goal_pos)
+        self.goal_pos[agents] = np.stack(np.divmod(index, self.grid_size), axis=-1)
+        self.has_goal[agents] = True
+
+    def select_action(self, states):
+        """为每个智能体选择一个动作（方向偏置的 epsilon-greedy 加 UCB），返回 (N,) 动作数组"""
+        agents = self._agents
+        s = self._to_index(states)
+        self.visit_counts[agents, s] += 1
+        self.visit_totals += 1
+        self.epsilon = np.maximum(self.epsilon_min, self.epsilon * self.epsilon_decay)
+
+        # 朝向目标的候选动作（垂直/水平距离较大的方向，相等时两者都可以）
+        row, col = np.divmod(s, self.grid_size)
+        d_row = self.goal_pos[:, 0] - row
+        d_col = self.goal_pos[:, 1] - col
+        possible = np.zeros((self.num_agents, self.n_actions), dtype=bool)
+        vertical = np.abs(d_row) >= np.abs(d_col)
+        horizontal = np.abs(d_col) >= np.abs(d_row)
+        possible[agents[vertical], np.where(d_row[vertical] > 0, 1, 0)] = True
+        possible[agents[horizontal], np.where(d_col[horizontal] > 0, 3, 2)] = True
+
+        # 移除已知的墙壁方向
+        blocked = self._blocked_mask(s)
+        possible &= (blocked[:, None] >> np.arange(self.n_actions)) & 1 == 0
+
+        # 没有候选动作时完全随机；否则以 epsilon 的概率探索（70% 在候选动作中选择）
+        actions = self.rng.integers(self.n_actions, size=self.num_agents)
+        has_candidate = possible.any(axis=1)
+        explore = has_candidate & (self.rng.random(self.num_agents) < self.epsilon)
+        directed = explore & (self.rng.random(self.num_agents) < 0.7)
+        if directed.any():
+            keys = np.where(possible[directed], self.rng.random((int(directed.sum()), self.n_actions)), -1.0)
+            actions[directed] = keys.argmax(axis=1)
+
+        greedy = has_candidate & ~explore
+        if greedy.any():
+            actions[greedy] = self._greedy_actions(np.flatnonzero(greedy), s[greedy])
+
+        self.action_counts[agents, s, actions] += 1
+        return actions
+
+    def _greedy_actions(self, agents, s):
+        """按短期/长期记忆组合的 Q 值加 UCB 探索项选择动作"""
+        # 平滑记忆平衡调整
+        target_balance = np.clip(1.0 - self.environment_stability[agents], 0.3, 0.7)
+        self.memory_balance[agents] = 0.9 * self.memory_balance[agents] + 0.1 * target_balance
+        balance = self.memory_balance[agents, None]
+        combined = balance * self.q_short[agents, s] + (1 - balance) * self.q_long[agents, s]
+
+        bonus = np.sqrt(2 * np.log(self.visit_totals[agents, None]) / (self.action_counts[agents, s] + 1e-6))
+        return np.argmax(combined + bonus, axis=1)
+
+    def _blocked_mask(self, s):
+        """每个智能体当前状态的墙壁位掩码，并惰性遗忘过旧的记忆"""
+        return expire_walls(self.wall_bits, self.wall_confirmed, self.wall_checked, (self._agents, s),
+                            self.steps_count, self.wall_max_age, self.memory_refresh_freq, self.wall_forget_prob,
+                            self.rng)
+
+    def calculate_confidence(self, steps, shortest_path):
+        """计算每个智能体当前的置信度"""
+        steps = np.asarray(steps, dtype=np.float64)
+        shortest_path = np.asarray(shortest_path, dtype=np.float64)
+        invalid = np.isinf(shortest_path) | (shortest_path == 0)
+        safe = np.where(invalid, 1.0, shortest_path)
+        return np.where(invalid, 0.0, np.maximum(0.0, 1.0 - (steps - safe) / safe))
+
+    def learn(self, states, actions, rewards, next_states, dones, steps, shortest_paths):
+        """每个智能体学习一条转移（所有参数都是长度为 N 的数组）"""
+        agents = self._agents
+        s = self._to_index(states)
+        ns = self._to_index(next_states)
+        actions = np.asarray(actions, dtype=np.intp)
+        rewards = np.asarray(rewards, dtype=np.float64)
+        dones = np.asarray(dones, dtype=bool)
+        steps = np.asarray(steps)
+
+        self.recent_confidences.push(self.calculate_confidence(steps, shortest_paths))
+        self.recent_rewards.push(rewards)
+        self.recent_steps.push(steps, dones)
+
+        # TD 误差作为优先级
+        target = rewards + self.gamma * self.q_short[agents, ns].max(axis=1) * (1 - dones)
+        td_errors = np.abs(target - self.q_short[agents, s, actions])
+
+        # 记录结果并检测环境变化
+        consistent, has_history = self._record_transitions(s, actions, ns, rewards)
+        changed = has_history & ~consistent
+        stable = has_history & consistent
+        self.environment_stability[changed] = np.maximum(0.5, self.environment_stability[changed] * 0.8)
+        self.environment_stability[stable] = np.minimum(1.0, self.environment_stability[stable] * 1.02)
+        detected = (changed & (self.environment_stability < self.environment_stability_threshold) &
+                    (self.steps_count - self.last_env_change_step > self.env_change_cooldown))
+        if detected.any():
+            self.env_change_detected[detected] = True
+            self.last_env_change_step[detected] = self.steps_count[detected]
+            self._adapt_to_environment_change(np.flatnonzero(detected))
+
+        # 成功到达目标的经验给予更高优先级
+        priorities = np.where(dones & (rewards > 1.0), np.maximum(1.0, td_errors) * 2.0,
+                              np.maximum(0.01, td_errors))
+        self._store_experience(s, actions, rewards, ns, dones, priorities)
+
+        # 短期记忆使用较高的学习率，长期记忆使用较低的学习率
+        self.short_present[agents, s] = True
+        self.long_present[agents, s] = True
+        for q, alpha in ((self.q_short, np.minimum(0.8, self.alpha * 1.5)),
+                         (self.q_long, np.maximum(0.1, self.alpha * 0.7))):
+            next_max = q[agents, ns].max(axis=1)
+            old_values = q[agents, s, actions]
+            q[agents, s, actions] = (1 - alpha) * old_values + alpha * (rewards + self.gamma * next_max)
+
+        # 经验回放
+        ready = self.replay_sizes >= self.BATCH_SIZE
+        if ready.any():
+            self._learn_from_experience(np.flatnonzero(ready))
+
+        self.steps_count += 1
+
+        # 更新墙壁记忆（撞墙的惩罚）
+        hit = rewards <= -1.0
+        if hit.any():
+            hit_agents, hit_states, hit_actions = agents[hit], s[hit], actions[hit]
+            self.wall_bits[hit_agents, hit_states] |= (1 << hit_actions).astype(np.uint8)
+            self.wall_confirmed[hit_agents, hit_states, hit_actions] = self.steps_count[hit]
+            self.wall_checked[hit_agents, hit_states, hit_actions] = self.steps_count[hit] + self.wall_max_age
+
+        self.reflect(s, rewards, dones)
+
+    @property
+    def replay_priorities(self):
+        """各智能体经验的优先级，(N, max_buffer_size)，空位为 0（只读）"""
+        view = self.replay_trees.leaves()
+        view.flags.writeable = False
+        return view
+
+    def _record_transitions(self, s, actions, ns, rewards):
+        """写入每个智能体本步的结果，返回 (是否与之前的结果一致, 是否有历史)"""
+        return record_outcomes(self.history_next, self.history_rewards, self.history_counts, self.history_heads,
+                               (self._agents, s, actions), ns, rewards, self.REWARD_TOLERANCE)
+
+    def _store_experience(self, s, actions, rewards, ns, dones, priorities):
+        """每个智能体存入一条经验；缓冲区满时替换优先级最低的经验"""
+        full = self.replay_sizes >= self.max_buffer_size
+        slots = np.minimum(self.replay_sizes, self.max_buffer_size - 1)
+        if full.any():
+            slots[full] = self.replay_trees.min_leaves(np.flatnonzero(full))
+        self.replay_sizes[~full] += 1
+
+        agents = self._agents
+        self.replay_states[agents, slots] = s
+        self.replay_actions[agents, slots] = actions
+        self.replay_rewards[agents, slots] = rewards
+        self.replay_next_states[agents, slots] = ns
+        self.replay_dones[agents, slots] = dones
+        self.replay_trees.update(agents, slots, priorities)
+
+    def _learn_from_experience(self, agents):
+        """对若干智能体同时做一批优先级经验回放（批量 TD 更新）"""
+        owners, slots = self.replay_trees.sample(agents, self.BATCH_SIZE, self.rng)
+
+        # 把各智能体的 Q 表展平成 (N * 状态数, 动作数)，行号按智能体偏移
+        offsets = owners * self.num_states
+        rows = offsets + self.replay_states[owners, slots]
+        next_rows = offsets + self.replay_next_states[owners, slots]
+        self.short_present.reshape(-1)[rows] = True
+        td_errors = batch_td_update(
+            self.q_short.reshape(-1, self.n_actions), rows, next_rows,
+            self.replay_actions[owners, slots], self.replay_rewards[owners, slots],
+            self.alpha[owners], self.gamma[owners]
+        )
+        self.replay_trees.update(owners, slots, np.maximum(0.01, td_errors))
+
+    def reflect(self, s, rewards, dones):
+        """更新反思窗口；窗口满的智能体评估性能、调整策略并转移知识"""
+        agents = np.flatnonzero(self.has_goal)
+        if agents.size == 0:
+            return
+        row, col = np.divmod(s[agents], self.grid_size)
+        distance = np.abs(row - self.goal_pos[agents, 0]) + np.abs(col - self.goal_pos[agents, 1])
+        first = self.window_count[agents] == 0
+        self.window_first_distance[agents[first]] = distance[first]
+        self.window_last_distance[agents] = distance
+        self.window_done_count[agents] += dones[agents]
+        self.window_reward_sum[agents] += rewards[agents]
+        self.window_count[agents] += 1
+
+        ready = agents[self.window_count[agents] >= self.reflection_frequency[agents]]
+        if ready.size == 0:
+            return
+        enough = self.window_count[ready] >= 2
+        progress = np.where(enough, self.window_first_distance[ready] - self.window_last_distance[ready], 0)
+        current_distance = np.where(enough, self.window_last_distance[ready], 0)
+        frequency = self.reflection_frequency[ready]
+        score = window_score(progress, self.window_done_count[ready], self.window_reward_sum[ready], frequency)
+
+        adapt = score < 0.4
+        if adapt.any():
+            self.adapt_strategy(ready[adapt], progress[adapt], current_distance[adapt])
+        transfer = ready[self.environment_stability[ready] > 0.6]
+        if transfer.size:
+            self._transfer_knowledge(transfer)
+
+        self.window_count[ready] = 0
+        self.window_done_count[ready] = 0
+        self.window_reward_sum[ready] = 0
+
+    def adapt_strategy(self, agents, progress, current_distance):
+        """根据性能调整若干智能体的策略"""
+        epsilon = self.epsilon[agents]
+        epsilon = np.where(progress <= 0, np.minimum(0.8, epsilon + 0.05),
+                           np.maximum(self.epsilon_min[agents], epsilon * 0.995))
+        far = agents[current_distance > 5]
+        self.alpha[far] = np.minimum(0.7, self.alpha[far] + 0.05)
+
+        # 最近的奖励很低时按严重程度增加探索
+        avg_reward = self.recent_rewards.mean(agents)
+        low_reward = avg_reward < -0.5
+        increase = np.clip(np.abs(avg_reward) * 0.1, 0.05, 0.15)
+        epsilon = np.where(low_reward, np.minimum(0.8, epsilon + increase), epsilon)
+        self.epsilon[agents] = epsilon
+
+        # 置信度很低时部分降低少量状态的 Q 值，优先选择多次访问的状态
+        reset = agents[self.recent_confidences.mean(agents) < 0.2]
+        if reset.size:
+            present = self.short_present[reset]
+            num_present = present.sum(axis=1)
+            num_to_reset = np.clip((num_present * 0.05).astype(np.int64), 3, 5)
+            low_confidence = present & (self.visit_counts[reset] > 2)
+            enough = low_confidence.sum(axis=1) >= num_to_reset
+            pool = np.where(enough[:, None], low_confidence, present)
+            chosen = self._random_subset(pool, np.where(enough, num_to_reset, np.minimum(num_to_reset, num_present)))
+            self.q_short[reset] = np.where(chosen[..., None], 0.5 * self.q_short[reset], self.q_short[reset])
+
+    def _adapt_to_environment_change(self, agents):
+        """检测到环境变化的智能体调整策略"""
+        # 1. 临时增加探索率
+        self.epsilon[agents] = np.minimum(0.9, self.epsilon[agents] + 0.2)
+
+        # 2. 随机清除部分状态的墙壁记忆
+        remembered = self.wall_bits[agents] != 0
+        count = remembered.sum(axis=1)
+        cleared = self._random_subset(remembered, np.where(
+            count > 0, np.maximum(1, (count * self.wall_memory_clear_ratio[agents]).astype(np.int64)), 0))
+        self.wall_bits[agents] = np.where(cleared, 0, self.wall_bits[agents])
+
+        # 3. 降低一半经验的优先级
+        stored = np.arange(self.max_buffer_size) < self.replay_sizes[agents, None]
+        size = self.replay_sizes[agents]
+        reduced = self._random_subset(stored, np.where(size > 0, np.maximum(1, size // 2), 0))
+        owners, slots = np.nonzero(reduced)
+        owners = agents[owners]
+        self.replay_trees.update(owners, slots, 0.5 * self.replay_trees.leaves()[owners, slots])
+
+        # 4. 更频繁地反思，更依赖短期记忆
+        self.reflection_frequency[agents] = 3
+        self.memory_balance[agents] = 0.7
+
+        # 温和地重置 20% 的短期记忆（保留 80% 的原始信息，默认 Q 值为 0）
+        present = self.short_present[agents]
+        count = present.sum(axis=1)
+        reset = self._random_subset(present, np.where(count > 0, np.maximum(1, (count * 0.2).astype(np.int64)), 0))
+        self.q_short[agents] = np.where(reset[..., None], 0.8 * self.q_short[agents], self.q_short[agents])
+
+    def _transfer_knowledge(self, agents):
+        """从短期记忆转移有价值的知识到长期记忆"""
+        agents = agents[self.short_present[agents].any(axis=1)]
+        if agents.size == 0:
+            return
+
+        # 根据环境稳定性动态调整参数
+        stability = self.environment_stability[agents]
+        visit_threshold = np.maximum(3, (5 * stability).astype(np.int64))
+        q_threshold = np.maximum(0.3, 0.35 * stability)
+        transfer_ratio = np.minimum(0.4, 0.35 * (1 + stability))
+
+        # 选择访问频率高且 Q 值较大的状态中 Q 值最高的前 transfer_ratio
+        short_q = self.q_short[agents]
+        max_q = short_q.max(axis=2)
+        candidates = (self.short_present[agents] & (self.visit_counts[agents] > visit_threshold[:, None]) &
+                      (max_q > q_threshold[:, None]))
+        count = candidates.sum(axis=1)
+        num_to_transfer = np.where(count > 0, np.maximum(1, (count * transfer_ratio).astype(np.int64)), 0)
+        chosen = self._extreme_subset(max_q, candidates, num_to_transfer, largest=True)
+
+        # 将短期记忆中的知识融合到长期记忆中
+        long_q = self.q_long[agents]
+        blended = np.where(self.long_present[agents, :, None], 0.6 * long_q + 0.4 * short_q, short_q)
+        self.q_long[agents] = np.where(chosen[..., None], blended, long_q)
+        self.long_present[agents] |= chosen
+
+        self._forget_outdated_knowledge(agents)
+
+    def _forget_outdated_knowledge(self, agents):
+        """清除长期记忆中访问少且 Q 值低的状态"""
+        agents = agents[self.long_present[agents].sum(axis=1) > 800]
+        if agents.size == 0:
+            return
+        max_q = self.q_long[agents].max(axis=2)
+        candidates = self.long_present[agents] & (self.visit_counts[agents] < 3) & (max_q < 0.25)
+        count = candidates.sum(axis=1)
+        num_to_forget = np.where(count > 0, np.maximum(1, (count * 0.15).astype(np.int64)), 0)
+        forget = self._extreme_subset(max_q, candidates, num_to_forget, largest=False)
+        self.q_long[agents] = np.where(forget[..., None], 0.0, self.q_long[agents])
+        self.long_present[agents] &= ~forget
+
+    def _random_subset(self, mask, k):
+        """每行在 mask 为 True 的位置中随机选择 k 个，返回与 mask 同形状的布尔数组"""
+        keys = np.where(mask, self.rng.random(mask.shape), np.inf)
+        return self._first_k(np.argsort(keys, axis=1), k)
+
+    @staticmethod
+    def _extreme_subset(values, mask, k, largest=True):
+        """每行在 mask 为 True 的位置中选择值最大（或最小）的 k 个，值相同时优先取位置靠前的"""
+        keyed = np.where(mask, -values if largest else values, np.inf)
+        return ReflectionAgentPopulation._first_k(np.argsort(keyed, axis=1, kind='stable'), k)
+
+    @staticmethod
+    def _first_k(order, k):
+        """按每行的顺序 order 选出前 k 个位置"""
+        selected = np.zeros(order.shape, dtype=bool)
+        np.put_along_axis(selected, order, np.arange(order.shape[1]) < np.asarray(k)[:, None], axis=1)
+        return selected
+
+
+class _RecentValues:
+    """每个智能体最近若干个值的环形数组（对应 deque(maxlen=length)）"""
+
+    def __init__(self, num_agents, length):
+        self.values = np.zeros((num_agents, length))
+        self.counts = np.zeros(num_agents, dtype=np.int64)
+        self.heads = np.zeros(num_agents, dtype=np.int64)
+
+    def push(self, values, mask=None):
+        """为 mask 选中的智能体（默认全部）各追加一个值"""
+        agents = np.arange(len(self.counts)) if mask is None else np.flatnonzero(mask)
+        length = self.values.shape[1]
+        self.values[agents, self.heads[agents]] = np.asarray(values)[agents]
+        self.heads[agents] = (self.heads[agents] + 1) % length
+        self.counts[agents] = np.minimum(self.counts[agents] + 1, length)
+
+    def mean(self, agents):
+        """若干智能体最近值的平均值；没有记录的智能体为 NaN"""
+        counts = self.counts[agents]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self.values[agents].sum(axis=1) / counts
+
@@ -0,0 +1,74 @@
+import numpy as np
+
+
+def window_score(progress, done_count, reward_sum, frequency):
+    """按进展、完成率和平均奖励加权的性能得分（参数可以是数组，ReflectionAgentPopulation 同样使用）"""
+    return np.maximum(
+        0.0,
+        0.5 * (progress / frequency) +
+        0.3 * (done_count / frequency) +
+        0.2 * (reward_sum / frequency)
+    )
+
+
+class ReflectionWindow:
+    """反思窗口：固定大小的环形缓冲区加滚动累加量
+
+    每条转移到达时就更新进展、完成次数和奖励之和，因此窗口结束时性能得分是 O(1) 的，
+    窗口长度不再影响反思的开销。环形缓冲区只保留最近 capacity 条记录供查看。
+    """
+
+    def __init__(self, capacity=64):
+        self.capacity = capacity
+        self.distances = np.zeros(capacity)
+        self.rewards = np.zeros(capacity)
+        self.dones = np.zeros(capacity, dtype=bool)
+        self._head = 0
+        self.clear()
+
+    def clear(self):
+        """开始一个新窗口"""
+        self.count = 0
+        self.first_distance = 0
+        self.last_distance = 0
+        self.done_count = 0
+        self.reward_sum = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, distance, reward, done):
+        """记录一条转移：当前状态到目标的距离、奖励和是否结束"""
+        if self.count == 0:
+            self.first_distance = distance
+        self.last_distance = distance
+        self.done_count += bool(done)
+        self.reward_sum += reward
+        self.count += 1
+
+        self.distances[self._head] = distance
+        self.rewards[self._head] = reward
+        self.dones[self._head] = done
+        self._head = (self._head + 1) % self.capacity
+
+    @property
+    def progress(self):
+        """窗口内向目标靠近的总距离（相邻两步距离差之和）"""
+        if self.count < 2:
+            return 0
+        return self.first_distance - self.last_distance
+
+    @property
+    def current_distance(self):
+        """窗口内最后一个状态到目标的距离（不足两条记录时为 0）"""
+        return self.last_distance if self.count >= 2 else 0
+
+    def performance_score(self, frequency):
+        """按进展、完成率和平均奖励加权的性能得分"""
+        return float(window_score(self.progress, self.done_count, self.reward_sum, frequency))
+
+    def recent(self):
+        """按时间顺序返回缓冲区中最近的 (距离, 奖励, 是否结束)"""
+        size = min(self.count, self.capacity)
+        order = (self._head - size + np.arange(size)) % self.capacity
+        return self.distances[order], self.rewards[order], self.dones[order]
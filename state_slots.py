@@ -0,0 +1,107 @@
+import numpy as np
+from checkpoint import encode_keys, decode_keys
+
+
+class StateSlots:
+    """状态键到数组行号的映射
+
+    提供 key_index（稠密 Q 表）时直接使用其行号，使各种按状态存储的数组与 Q 数组按行对齐；
+    否则用 dict 按出现顺序分配行号，容量按需倍增。seen 记录哪些行已经分配。
+    """
+
+    def __init__(self, key_index=None, capacity=1024):
+        self.key_index = key_index
+        if key_index is not None:
+            capacity = key_index.num_states
+        self._slots = {}  # 状态键 -> 行号（仅 dict 模式）
+        self._keys = []   # 行号 -> 状态键（仅 dict 模式）
+        self.seen = np.zeros(capacity, dtype=bool)
+
+    @property
+    def capacity(self):
+        return len(self.seen)
+
+    @classmethod
+    def row_nbytes(cls):
+        """每行占用的字节数（seen 标记）"""
+        return np.dtype(bool).itemsize
+
+    def lookup(self, key):
+        """已出现的状态返回行号，否则返回 None"""
+        if self.key_index is None:
+            return self._slots.get(key)
+        try:
+            slot = self.key_index.find(key)
+        except (KeyError, TypeError):
+            return None
+        return slot if self.seen[slot] else None
+
+    def lookup_many(self, keys):
+        """批量查找行号，未出现的状态为 -1"""
+        slots = (self.lookup(key) for key in keys)
+        return np.fromiter((-1 if slot is None else slot for slot in slots), dtype=np.intp, count=len(keys))
+
+    def slot(self, key):
+        """返回状态键对应的行号，新状态分配新行（调用方需按 capacity 扩充自己的数组）"""
+        if self.key_index is not None:
+            slot = self.key_index.index_of(key)
+            self.seen[slot] = True
+            return slot
+        slot = self._slots.get(key)
+        if slot is None:
+            slot = len(self._keys)
+            if slot == len(self.seen):
+                self.seen = np.concatenate([self.seen, np.zeros_like(self.seen)])
+            self._slots[key] = slot
+            self._keys.append(key)
+            self.seen[slot] = True
+        return slot
+
+    def release(self, slots):
+        """标记若干行不再使用（仅 key_index 模式，行号由 key_index 重新分配）"""
+        self.seen[slots] = False
+
+    def key_of(self, slot):
+        """行号转换回状态键"""
+        if self.key_index is None:
+            return self._keys[slot]
+        return self.key_index.key_of(slot)
+
+    def slots(self):
+        """所有已分配的行号"""
+        if self.key_index is None:
+            return np.arange(len(self._keys))
+        return np.flatnonzero(self.seen)
+
+    def __len__(self):
+        if self.key_index is None:
+            return len(self._keys)
+        return int(np.count_nonzero(self.seen))
+
+    def keys(self):
+        return [self.key_of(slot) for slot in self.slots()]
+
+    def to_arrays(self):
+        """导出为数组（用于检查点）"""
+        arrays = {'seen': self.seen}
+        if self.key_index is None:
+            arrays['keys'] = encode_keys(self._keys)
+        return arrays
+
+    def load_arrays(self, arrays):
+        """从检查点数组恢复"""
+        self.seen = np.array(arrays['seen'], dtype=bool)
+        if self.key_index is None:
+            self._keys = decode_keys(arrays['keys'])
+            self._slots = {key: slot for slot, key in enumerate(self._keys)}
+        elif len(self.seen) != self.key_index.num_states:
+            raise ValueError("Checkpoint state layout does not match the Q-table")
+
+
+def grow_rows(array, capacity):
+    """将数组的行数扩充到 capacity（新行为 0）"""
+    if len(array) >= capacity:
+        return array
+    grown = np.zeros((capacity,) + array.shape[1:], dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
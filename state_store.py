@@ -0,0 +1,177 @@
+import numpy as np
+from dense_q_table import DenseQTable
+from checkpoint import encode_keys, decode_keys
+
+
+class BoundedStateStore:
+    """有容量上限的状态键到行号映射，供所有按状态存储的表共享
+
+    状态首次出现时分配一个空闲行；没有空闲行时按淘汰策略一次释放一批行（默认为容量的
+    1/32，使淘汰的开销分摊到每次插入上），并通过 on_evict 注册的回调通知各个表清空这些行。
+    最近 min_age 次访问过的状态不会被淘汰，保证同一步（或同一批经验回放）中正在使用的
+    行不会被重新分配。
+
+    淘汰策略：
+        'lru'   - 最久未访问的状态
+        'lfu'   - 访问次数最少的状态（相同时取最久未访问的）
+        'value' - value_fn(行号) 最小的状态（相同时取最久未访问的）
+    """
+
+    POLICIES = ('lru', 'lfu', 'value')
+
+    def __init__(self, max_states, policy='lru', min_age=128, evict_fraction=1 / 32, value_fn=None):
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown eviction policy: {policy!r}")
+        if max_states < 1 or max_states < 2 * min_age:
+            raise ValueError("max_states must be positive and at least twice min_age")
+        self.num_states = int(max_states)
+        self.policy = policy
+        self.min_age = min_age
+        self.evict_fraction = evict_fraction
+        self.value_fn = value_fn
+        self._rows = {}                       # 状态键 -> 行号
+        self._keys = [None] * self.num_states  # 行号 -> 状态键（空闲行为 None）
+        self._free = list(range(self.num_states - 1, -1, -1))
+        self.last_used = np.zeros(self.num_states, dtype=np.int64)
+        self.use_counts = np.zeros(self.num_states, dtype=np.int64)
+        self.clock = 0
+        self._listeners = []
+
+        # 淘汰统计
+        self.evictions = 0
+        self.eviction_rounds = 0
+
+    @classmethod
+    def row_nbytes(cls):
+        """每行的簿记数组（最近访问时间和访问次数）占用的字节数"""
+        return 2 * np.dtype(np.int64).itemsize
+
+    def on_evict(self, callback):
+        """注册淘汰回调：callback(行号数组) 在这些行被重新分配之前调用"""
+        self._listeners.append(callback)
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __contains__(self, key):
+        return key in self._rows
+
+    def lookup(self, key):
+        """已有状态返回行号，否则返回 None（不计为一次访问）"""
+        return self._rows.get(key)
+
+    def index_of(self, key):
+        """返回状态键对应的行号并记录一次访问；新状态分配新行，必要时先淘汰"""
+        self.clock += 1
+        row = self._rows.get(key)
+        if row is None:
+            if not self._free:
+                self._evict()
+            row = self._free.pop()
+            self._rows[key] = row
+            self._keys[row] = key
+            self.use_counts[row] = 0
+        self.last_used[row] = self.clock
+        self.use_counts[row] += 1
+        return row
+
+    def key_of(self, row):
+        """行号转换回状态键"""
+        key = self._keys[int(row)]
+        if key is None:
+            raise KeyError(row)
+        return key
+
+    def _victim_order(self, rows):
+        """按淘汰策略给候选行排序（最先淘汰的在前）"""
+        recency = self.last_used[rows]
+        if self.policy == 'lru':
+            return np.argsort(recency, kind='stable')
+        if self.policy == 'lfu':
+            return np.lexsort((recency, self.use_counts[rows]))
+        return np.lexsort((recency, np.asarray(self.value_fn(rows))))
+
+    def _evict(self):
+        """释放一批行"""
+        candidates = np.flatnonzero(self.last_used <= self.clock - self.min_age)
+        num_to_evict = min(max(1, int(self.num_states * self.evict_fraction)), candidates.size)
+        victims = candidates[self._victim_order(candidates)[:num_to_evict]]
+        for callback in self._listeners:
+            callback(victims)
+        for row in victims.tolist():
+            del self._rows[self._keys[row]]
+            self._keys[row] = None
+        self._free.extend(victims[::-1].tolist())
+        self.evictions += len(victims)
+        self.eviction_rounds += 1
+
+    def stats(self):
+        """当前状态数、容量和淘汰计数"""
+        return {'states': len(self), 'capacity': self.num_states,
+                'evictions': self.evictions, 'eviction_rounds': self.eviction_rounds}
+
+    def to_arrays(self):
+        """导出为数组（用于检查点）"""
+        rows = np.array(sorted(self._rows.values()), dtype=np.int64)
+        return {
+            'rows': rows,
+            'keys': encode_keys([self._keys[row] for row in rows]),
+            'last_used': self.last_used,
+            'use_counts': self.use_counts,
+            'counters': np.array([self.clock, self.evictions, self.eviction_rounds], dtype=np.int64),
+        }
+
+    def load_arrays(self, arrays):
+        """从检查点数组恢复"""
+        if len(arrays['last_used']) != self.num_states:
+            raise ValueError("Checkpoint state store capacity does not match")
+        rows = arrays['rows'].tolist()
+        keys = decode_keys(arrays['keys'])
+        self._rows = dict(zip(keys, rows))
+        self._keys = [None] * self.num_states
+        for key, row in zip(keys, rows):
+            self._keys[row] = key
+        occupied = set(rows)
+        self._free = [row for row in range(self.num_states - 1, -1, -1) if row not in occupied]
+        self.last_used = np.array(arrays['last_used'], dtype=np.int64)
+        self.use_counts = np.array(arrays['use_counts'], dtype=np.int64)
+        self.clock, self.evictions, self.eviction_rounds = (int(v) for v in arrays['counters'])
+
+
+class BoundedQTable(DenseQTable):
+    """行号由 BoundedStateStore 分配的稠密 Q 表
+
+    两张 Q 表和各个按状态存储的组件共享同一个 store 时，它们的行号对齐；
+    store 淘汰某个状态时对应的行恢复为默认 Q 值。
+    """
+
+    def __init__(self, store, default_q_values):
+        super().__init__((store.num_states,), default_q_values, index_keys=True)
+        self.store = store
+
+    def index_of(self, key):
+        return self.store.index_of(key)
+
+    def find(self, key):
+        row = self.store.lookup(key)
+        if row is None:
+            raise KeyError(key)
+        return row
+
+    @staticmethod
+    def _keys_for(states):
+        """状态数组（(N,) 扁平整数或 (N, 2) 坐标）转换为状态键列表"""
+        states = np.asarray(states)
+        return states.tolist() if states.ndim == 1 else [tuple(row) for row in states.tolist()]
+
+    def rows_for(self, states):
+        keys = self._keys_for(states)
+        return np.fromiter((self.store.index_of(key) for key in keys), dtype=np.intp, count=len(keys))
+
+    def key_of(self, index):
+        return self.store.key_of(index)
+
+    def resident(self, states):
+        """状态数组中哪些状态当前在存储中（不分配新行）"""
+        keys = self._keys_for(states)
+        return np.fromiter((key in self.store for key in keys), dtype=bool, count=len(keys))
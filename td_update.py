@@ -0,0 +1,33 @@
+import numpy as np
+
+
+def batch_td_update(q, rows, next_rows, actions, rewards, alpha, gamma, max_q=None):
+    """对一批经验做 Q 学习更新（原地修改 q），返回每条经验的 TD 误差
+    
+    所有目标值都基于本批更新前的 Q 值计算。同一批中重复的 (s, a) 按采样顺序依次更新，
+    结果等于逐条执行 Q <- (1 - alpha) * Q + alpha * target 的闭式解。alpha 和 gamma
+    可以是标量，也可以是每条经验一个值（同一 (s, a) 的经验须使用相同的 alpha）。
+    给出 max_q 时同时更新被修改的状态的最大 Q 值。
+    """
+    alpha = np.broadcast_to(alpha, rows.shape)
+    n_actions = q.shape[1]
+    old_values = q[rows, actions]
+    targets = rewards + gamma * q[next_rows].max(axis=1)
+    
+    # 每个 (s, a) 分组，并求出每条经验在组内的先后位置
+    cells, first, inverse, counts = np.unique(rows * n_actions + actions, return_index=True,
+                                              return_inverse=True, return_counts=True)
+    order = np.argsort(inverse, kind='stable')
+    position = np.empty_like(order)
+    position[order] = np.arange(len(order)) - np.repeat(np.cumsum(counts) - counts, counts)
+    
+    # 第 j 条目标值的权重为 alpha * (1 - alpha) ^ (组内其后的更新次数)
+    weights = alpha * (1 - alpha) ** (counts[inverse] - 1 - position)
+    contributions = np.bincount(inverse, weights=weights * targets, minlength=len(cells))
+    cell_rows, cell_actions = np.divmod(cells, n_actions)
+    cell_alpha = alpha[first]
+    q[cell_rows, cell_actions] = (1 - cell_alpha) ** counts * q[cell_rows, cell_actions] + contributions
+    if max_q is not None:
+        max_q[cell_rows] = q[cell_rows].max(axis=1)
+    
+    return alpha * np.abs(targets - old_values)
@@ -0,0 +1,493 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the DynamicMazeEnv family of environments.
+
+These tests check that the faster environment variants keep exactly the
+same dynamics as the original scalar environment.
+"""
+
+import pytest
+import numpy as np
+import gymnasium as gym
+import sys
+import os
+
+# Add the current directory to Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from dynamic_maze_env import (DynamicMazeEnv, BatchedDynamicMazeEnv, MultiAgentDynamicMazeEnv,
+                              DynamicDistanceField, ScenarioBank, bfs_distance_map, label_components,
+                              make_async_vector_env, min_walls_to_connect)
+
+
+class TestMazeGenerators:
+    """Test suite for the pluggable maze generators."""
+
+    @pytest.mark.parametrize("generator", ["backtracker", "prim", "kruskal", "percolation"])
+    def test_constructive_generators_are_connected(self, generator):
+        """Test that constructive generators hit the target density with one free component."""
+        env = DynamicMazeEnv(size=15, obstacle_ratio=0.3, seed=1, generator=generator)
+        labels = label_components(env.maze)
+        assert len(np.unique(labels[labels >= 0])) == 1
+        assert env.maze.sum() == int(15 * 15 * 0.3)
+
+    @pytest.mark.parametrize("generator", list(DynamicMazeEnv.GENERATORS))
+    def test_reset_places_start_and_goal_in_regions(self, generator):
+        """Test start/goal placement and that every episode is solvable."""
+        env = DynamicMazeEnv(size=12, obstacle_ratio=0.4, seed=2, generator=generator)
+        for seed in range(5):
+            start, _ = env.reset(seed=seed)
+            assert start[0] <= 12 // 3 and start[1] <= 12 // 3
+            assert env.goal_pos[0] >= 2 * 12 // 3 and env.goal_pos[1] >= 2 * 12 // 3
+            assert np.isfinite(env.get_optimal_path_length())
+
+    def test_unknown_generator(self):
+        """Test that an unknown generator name is rejected."""
+        with pytest.raises(ValueError):
+            DynamicMazeEnv(generator="unknown")
+
+
+class TestDistanceMap:
+    """Test suite for the cached goal-rooted distance field."""
+
+    @pytest.fixture
+    def env(self):
+        """Create a small environment with frequent obstacle changes."""
+        return DynamicMazeEnv(size=10, obstacle_ratio=0.3, change_frequency=3, seed=3)
+
+    def test_bfs_distance_map(self):
+        """Test the layered BFS on a hand-made maze."""
+        maze = np.array([
+            [0, 0, 0],
+            [1, 1, 0],
+            [0, 0, 0],
+        ])
+        dist = bfs_distance_map(maze, (0, 0))
+        assert dist[0, 2] == 2
+        assert dist[2, 0] == 6
+        assert np.isinf(dist[1, 0])
+
+    def test_path_length_is_cached_until_maze_changes(self, env):
+        """Test that the map is reused between queries and rebuilt after changes."""
+        first = env.get_distance_map()
+        version = env.distance_map_version
+        assert env.get_distance_map() is first
+        assert env.get_optimal_path_length() == first[tuple(env.current_pos)]
+
+        env.update_environment()
+        assert env.distance_map_version > version
+        expected = bfs_distance_map(env.maze, env.goal_pos)
+        assert np.array_equal(env.get_distance_map(), expected)
+
+
+class TestDynamicDistanceField:
+    """Test suite for incremental distance field maintenance."""
+
+    def test_incremental_updates_match_full_bfs(self):
+        """Test that repairing after random toggles gives the same field as a full BFS."""
+        rng = np.random.default_rng(0)
+        maze = (rng.random((15, 15)) < 0.35).astype(np.int32)
+        source = (7, 7)
+        maze[source] = 0
+        field = DynamicDistanceField(maze, source)
+
+        for _ in range(200):
+            cells = [tuple(rng.integers(0, 15, 2)) for _ in range(3)]
+            cells = [cell for cell in cells if cell != source]
+            for cell in cells:
+                maze[cell] = 1 - maze[cell]
+            field.update_cells(maze, cells)
+            assert np.array_equal(field.dist, bfs_distance_map(maze, source))
+
+    def test_wall_on_source_is_rejected(self):
+        """Test that the source cell cannot be turned into a wall."""
+        maze = np.zeros((3, 3), dtype=np.int32)
+        field = DynamicDistanceField(maze, (1, 1))
+        maze[1, 1] = 1
+        with pytest.raises(ValueError):
+            field.update_cells(maze, [(1, 1)])
+
+
+class TestPathRepair:
+    """Test suite for connectivity-aware path repair."""
+
+    @pytest.fixture
+    def walled_maze(self):
+        """A maze split in two by a double wall."""
+        maze = np.zeros((5, 5), dtype=np.int32)
+        maze[:, 2] = 1
+        maze[:, 3] = 1
+        return maze
+
+    def test_label_components(self, walled_maze):
+        """Test that the two halves get different labels and walls get -1."""
+        labels = label_components(walled_maze)
+        assert labels[0, 0] == labels[4, 1]
+        assert labels[0, 0] != labels[0, 4]
+        assert (labels[:, 2] == -1).all()
+
+    def test_min_walls_to_connect(self, walled_maze):
+        """Test that the repair clears exactly the walls of one crossing."""
+        walls = min_walls_to_connect(walled_maze, (0, 0), (4, 4))
+        assert len(walls) == 2
+        for cell in walls:
+            walled_maze[cell] = 0
+        assert np.isfinite(bfs_distance_map(walled_maze, (0, 0))[4, 4])
+
+    def test_ensure_path_exists(self, walled_maze):
+        """Test that the environment repairs a disconnected maze."""
+        env = DynamicMazeEnv(size=5, seed=0)
+        env.maze = walled_maze
+        env.current_pos = np.array([0, 0])
+        env.goal_pos = np.array([4, 4])
+        env.invalidate_distance_map()
+        assert np.isinf(env.get_optimal_path_length())
+
+        env._ensure_path_exists()
+        assert env.get_optimal_path_length() == 8
+        assert np.array_equal(env.get_distance_map(), bfs_distance_map(env.maze, env.goal_pos))
+
+
+class TestSnapshotAndFork:
+    """Test suite for environment snapshots and forks."""
+
+    @pytest.fixture
+    def env(self):
+        """Create an environment with frequent obstacle changes."""
+        return DynamicMazeEnv(size=10, obstacle_ratio=0.3, change_frequency=3, seed=5)
+
+    def test_fork_follows_same_timeline(self, env):
+        """Test that a fork shares the maze until written and then evolves identically."""
+        forked = env.fork()
+        assert forked.maze is env.maze
+
+        rng = np.random.default_rng(0)
+        for _ in range(100):
+            action = int(rng.integers(0, 4))
+            result = env.step(action)
+            forked_result = forked.step(action)
+            assert np.array_equal(result[0], forked_result[0])
+            assert result[1] == forked_result[1]
+            assert np.array_equal(env.maze, forked.maze)
+
+        # Both wrote to their maze, so the buffers are no longer shared
+        assert forked.maze is not env.maze
+
+    def test_fork_is_independent(self, env):
+        """Test that stepping a fork does not move or mutate the original."""
+        position = env.current_pos.copy()
+        maze = env.maze.copy()
+        forked = env.fork()
+        for _ in range(30):
+            forked.step(1)
+        assert np.array_equal(env.current_pos, position)
+        assert np.array_equal(env.maze, maze)
+        assert env._steps == 0
+
+    def test_snapshot_restore_replays(self, env):
+        """Test that restoring a snapshot reproduces the same trajectory."""
+        snapshot = env.snapshot()
+        actions = np.random.default_rng(1).integers(0, 4, 60)
+        first = [env.step(int(a))[:2] for a in actions]
+
+        env.restore(snapshot)
+        second = [env.step(int(a))[:2] for a in actions]
+        for (state1, reward1), (state2, reward2) in zip(first, second):
+            assert np.array_equal(state1, state2)
+            assert reward1 == reward2
+
+
+class TestScenarioBank:
+    """Test suite for pre-generated scenario banks."""
+
+    @pytest.fixture
+    def bank(self):
+        """Generate a small bank with frequent obstacle changes."""
+        return ScenarioBank.generate(3, size=10, obstacle_ratio=0.3, change_frequency=5, seed=40)
+
+    @pytest.mark.parametrize("filename, mmap", [("bank.npz", False), ("bank", True)])
+    def test_replay_matches_live_run(self, bank, tmp_path, filename, mmap):
+        """Test that a saved and reloaded bank replays a seeded live run bit-for-bit."""
+        path = str(tmp_path / filename)
+        bank.save(path)
+        loaded = ScenarioBank.load(path, mmap=mmap)
+
+        live_env = DynamicMazeEnv(size=10, obstacle_ratio=0.3, change_frequency=5, seed=40)
+        replay_env = DynamicMazeEnv(size=10, obstacle_ratio=0.3, change_frequency=5, seed=1)
+        replay_env.load_scenarios(loaded)
+
+        rng = np.random.default_rng(0)
+        for episode in range(len(loaded)):
+            live_state, _ = live_env.reset(seed=40 + episode)
+            replay_state, _ = replay_env.reset()
+            assert np.array_equal(live_state, replay_state)
+
+            for _ in range(100):
+                action = int(rng.integers(0, 4))
+                live_result = live_env.step(action)
+                replay_result = replay_env.step(action)
+                assert np.array_equal(live_result[0], replay_result[0])
+                assert live_result[1:3] == replay_result[1:3]
+                assert np.array_equal(live_env.maze, replay_env.maze)
+
+    def test_size_mismatch_is_rejected(self, bank):
+        """Test that a bank cannot be loaded into an environment of another size."""
+        env = DynamicMazeEnv(size=8)
+        with pytest.raises(ValueError):
+            env.load_scenarios(bank)
+
+
+class TestBatchedDynamicMazeEnv:
+    """Test suite for BatchedDynamicMazeEnv."""
+
+    @pytest.fixture
+    def num_envs(self):
+        """Number of mazes stepped together."""
+        return 6
+
+    @pytest.fixture
+    def batched_env(self, num_envs):
+        """Create a batched environment with frequent obstacle changes."""
+        return BatchedDynamicMazeEnv(num_envs, size=10, obstacle_ratio=0.25,
+                                     change_frequency=5, seed=100)
+
+    @pytest.fixture
+    def scalar_envs(self, num_envs):
+        """Create the scalar environments matching each batched maze."""
+        return [DynamicMazeEnv(size=10, obstacle_ratio=0.25, change_frequency=5, seed=100 + i)
+                for i in range(num_envs)]
+
+    def test_batched_state_layout(self, batched_env, num_envs):
+        """Test that the batched state is stored as stacked arrays."""
+        assert batched_env.maze.shape == (num_envs, 10, 10)
+        assert batched_env.maze.dtype == np.uint8
+        assert batched_env.current_pos.shape == (num_envs, 2)
+        assert batched_env.goal_pos.shape == (num_envs, 2)
+
+    def test_batched_matches_scalar_dynamics(self, batched_env, scalar_envs, num_envs):
+        """Test that stepping N mazes at once matches N scalar environments."""
+        batched_env.reset(seed=[7 + i for i in range(num_envs)])
+        for i, env in enumerate(scalar_envs):
+            env.reset(seed=7 + i)
+
+        rng = np.random.default_rng(0)
+        for _ in range(200):
+            actions = rng.integers(0, 4, num_envs)
+            obs, rewards, dones, _, _ = batched_env.step(actions)
+
+            for i, env in enumerate(scalar_envs):
+                next_state, reward, done, _, _ = env.step(int(actions[i]))
+                assert np.array_equal(next_state, obs[i])
+                assert reward == pytest.approx(rewards[i])
+                assert done == dones[i]
+                assert np.array_equal(env.maze, batched_env.maze[i])
+
+        # Obstacle toggles must actually have happened during the run
+        assert all(data['environment_updates'] > 0 for data in batched_env.episode_data)
+
+        # The shared event stream tags each maze's events with its index
+        events = batched_env.events.recent()
+        for i, env in enumerate(scalar_envs):
+            mine = [{k: v for k, v in event.items() if k != 'env'} for event in events if event['env'] == i]
+            assert [(e['kind'], e['step']) for e in mine] == [(e['kind'], e['step']) for e in env.events.recent()]
+            assert env.events.counts.get('maze_update', 0) > 0
+
+    def test_reset_selected_mazes(self, batched_env):
+        """Test that reset(indices=...) restarts only the chosen mazes."""
+        batched_env.reset(seed=1)
+        batched_env.step(np.ones(batched_env.num_envs, dtype=int))
+        mazes, positions, steps = batched_env.maze.copy(), batched_env.current_pos.copy(), batched_env._steps.copy()
+
+        batched_env.reset(seed=50, indices=[2, 4])
+        fresh = DynamicMazeEnv(size=10, obstacle_ratio=0.25, change_frequency=5, seed=0)
+        fresh.reset(seed=54)
+        assert np.array_equal(batched_env.maze[4], fresh.maze)
+        assert np.array_equal(batched_env.current_pos[4], fresh.current_pos)
+        assert batched_env._steps[[2, 4]].tolist() == [0, 0]
+        untouched = [0, 1, 3, 5]
+        assert np.array_equal(batched_env.maze[untouched], mazes[untouched])
+        assert np.array_equal(batched_env.current_pos[untouched], positions[untouched])
+        assert np.array_equal(batched_env._steps[untouched], steps[untouched])
+
+    def test_autoreset_matches_scalar_episodes(self, scalar_envs, num_envs):
+        """Test that finished mazes restart at once and report their final observation in info."""
+        batched_env = BatchedDynamicMazeEnv(num_envs, size=10, obstacle_ratio=0.25, change_frequency=5,
+                                            seed=100, autoreset=True)
+        batched_env.max_steps = 7
+        obs, _ = batched_env.reset(seed=[7 + i for i in range(num_envs)])
+        for i, env in enumerate(scalar_envs):
+            env.max_steps = 7
+            env.reset(seed=7 + i)
+
+        rng = np.random.default_rng(0)
+        finished_any = False
+        for _ in range(30):
+            actions = rng.integers(0, 4, num_envs)
+            obs, _, terminated, truncated, info = batched_env.step(actions)
+            finished = terminated | truncated
+            assert ('final_obs' in info) == finished.any()
+            for i, env in enumerate(scalar_envs):
+                state, _, done, timeout, _ = env.step(int(actions[i]))
+                if done or timeout:
+                    assert info['_final_obs'][i]
+                    assert np.array_equal(info['final_obs'][i], state)
+                    state, _ = env.reset()
+                    finished_any = True
+                assert np.array_equal(obs[i], state)
+                assert np.array_equal(batched_env.maze[i], env.maze)
+        assert finished_any
+
+
+class TestMultiAgentDynamicMazeEnv:
+    """Test suite for several agents sharing one maze."""
+
+    @pytest.fixture
+    def env(self):
+        """Create a four-agent environment with frequent obstacle changes."""
+        return MultiAgentDynamicMazeEnv(4, size=10, obstacle_ratio=0.3, change_frequency=3, seed=8)
+
+    def test_reset_places_all_agents_at_start(self, env):
+        """Test that every agent starts from the same cell."""
+        states, _ = env.reset(seed=3)
+        assert states.shape == (4, 2)
+        assert (states == states[0]).all()
+
+    def test_moves_match_single_agent_rules(self, env):
+        """Test vectorized moves, collisions and rewards against the maze."""
+        states, _ = env.reset(seed=3)
+        actions = np.array([0, 1, 2, 3])
+        maze = env.maze.copy()
+        next_states, rewards, dones, _, _ = env.step(actions)
+
+        for k, action in enumerate(actions):
+            target = states[k] + DynamicMazeEnv.ACTIONS[action]
+            blocked = ((target < 0).any() or (target >= 10).any() or maze[tuple(target)] == 1)
+            if blocked:
+                assert np.array_equal(next_states[k], states[k])
+                assert rewards[k] == env.COLLISION_PENALTY
+            else:
+                assert np.array_equal(next_states[k], target)
+                progress = (np.abs(states[k] - env.goal_pos).sum() -
+                            np.abs(target - env.goal_pos).sum())
+                assert rewards[k] == pytest.approx(env.STEP_PENALTY + progress)
+
+    def test_updates_once_per_tick_and_protect_all_agents(self, env):
+        """Test that the maze changes once per change_frequency ticks and stays solvable for all."""
+        env.reset(seed=3)
+        rng = np.random.default_rng(0)
+        updates = env.episode_data['environment_updates']
+        for _ in range(60):
+            states, _, _, _, _ = env.step(rng.integers(0, 4, 4))
+            assert (env.maze[states[:, 0], states[:, 1]] == 0).all()
+            assert np.isfinite(env.get_optimal_path_lengths()).all()
+        assert env.episode_data['environment_updates'] - updates == 60 // 3
+
+
+class TestGymnasiumIntegration:
+    """Test suite for gymnasium registration and vector-env support."""
+
+    def test_registered_env_reports_info(self):
+        """Test gym.make construction and the info returned by reset and step."""
+        env = gym.make('DynamicMaze-v0', size=8, seed=1)
+        state, info = env.reset()
+        assert state.dtype == np.int32
+        assert env.observation_space.contains(state)
+        assert info['optimal_path_length'] == env.unwrapped.get_optimal_path_length()
+
+        _, _, terminated, truncated, info = env.step(1)
+        assert isinstance(truncated, bool)
+        assert set(info) == {'episode_data', 'optimal_path_length'}
+        assert 'environment_updates' in info['episode_data']
+
+    @pytest.mark.parametrize("observation_mode", ["coords", "index"])
+    def test_passes_gymnasium_env_checker(self, observation_mode):
+        """Test the env against gymnasium's API checker, including observation aliasing."""
+        from gymnasium.utils.env_checker import check_env
+        env = DynamicMazeEnv(size=8, seed=1, observation_mode=observation_mode)
+        check_env(env, skip_render_check=True)
+
+        state, _ = env.reset(seed=1)
+        kept = np.copy(state)
+        env.step(0)
+        assert np.array_equal(state, kept)
+
+    def test_timeout_is_truncation_in_every_env(self):
+        """Test that all three envs report time limits through truncated, not terminated."""
+        scalar = DynamicMazeEnv(size=10, obstacle_ratio=0.0, seed=3)
+        multi = MultiAgentDynamicMazeEnv(2, size=10, obstacle_ratio=0.0, seed=3)
+        batched = BatchedDynamicMazeEnv(2, size=10, obstacle_ratio=0.0, seed=3)
+        for env in (scalar, multi, batched):
+            env.max_steps = 4
+            env.reset(seed=3)
+
+        # Step back and forth so the agents keep moving without reaching the goal
+        for t in range(4):
+            action = 1 if t % 2 == 0 else 0
+            _, _, terminated, truncated, info = scalar.step(action)
+            assert not terminated and truncated == (t == 3)
+            assert set(info) == {'episode_data', 'optimal_path_length'}
+            for env, n in ((multi, 2), (batched, 2)):
+                _, _, terminated, truncated, info = env.step(np.full(n, action))
+                assert not terminated.any()
+                assert truncated.tolist() == [t == 3] * n
+                assert set(info) == {'episode_data', 'optimal_path_length'}
+                assert len(info['optimal_path_length']) == n
+
+    def test_async_vector_env_with_shared_memory(self):
+        """Test that several envs run in worker processes through the vector API."""
+        envs = make_async_vector_env(3, seed=10, size=10, change_frequency=5)
+        try:
+            states, info = envs.reset(seed=10)
+            assert states.shape == (3, 2)
+            for _ in range(50):
+                states, rewards, terminated, truncated, info = envs.step(envs.action_space.sample())
+            assert rewards.shape == (3,)
+            assert info['optimal_path_length'].shape == (3,)
+        finally:
+            envs.close()
+
+
+class TestObservationModes:
+    """Test suite for the flat integer observation mode."""
+
+    def test_index_mode_matches_coords(self):
+        """Test that index observations encode the same trajectory as coordinates."""
+        coords_env = DynamicMazeEnv(size=9, change_frequency=3, seed=4)
+        index_env = DynamicMazeEnv(size=9, change_frequency=3, seed=4, observation_mode='index')
+        pos, _ = coords_env.reset(seed=4)
+        index, _ = index_env.reset(seed=4)
+        assert isinstance(index, int)
+        assert index_env.observation_space.contains(index)
+        assert index == index_env.to_index(pos)
+        for action in np.random.default_rng(0).integers(0, 4, 60):
+            pos, reward, done, _, _ = coords_env.step(int(action))
+            index, index_reward, index_done, _, _ = index_env.step(int(action))
+            assert np.array_equal(index_env.to_coords(index), pos)
+            assert (reward, done) == (index_reward, index_done)
+            if done:
+                break
+
+    def test_index_helpers_are_vectorized(self):
+        """Test to_index/to_coords round trips on arrays of positions."""
+        env = DynamicMazeEnv(size=7, seed=0)
+        positions = np.array([[0, 0], [3, 5], [6, 6]])
+        indices = env.to_index(positions)
+        assert indices.tolist() == [0, 26, 48]
+        assert np.array_equal(env.to_coords(indices), positions)
+
+    def test_vector_envs_return_indices(self):
+        """Test index mode in the batched and multi-agent environments."""
+        batched = BatchedDynamicMazeEnv(3, size=8, seed=2, observation_mode='index')
+        states, _ = batched.reset()
+        assert np.array_equal(states, batched.current_pos[:, 0] * 8 + batched.current_pos[:, 1])
+        assert batched.observation_space.contains(states)
+
+        multi = MultiAgentDynamicMazeEnv(2, size=8, seed=2, observation_mode='index')
+        states, _ = multi.reset()
+        states, _, _, _, _ = multi.step([1, 3])
+        assert np.array_equal(multi.to_coords(states), multi.positions)
+
+    def test_unknown_mode_is_rejected(self):
+        """Test that an unknown observation mode raises ValueError."""
+        with pytest.raises(ValueError):
+            DynamicMazeEnv(size=6, observation_mode='pixels')
@@ -8,7 +8,7 @@ and to help maintain code quality as the project grows.
 
 import pytest
 import numpy as np
-from unittest.mock import Mock, patch
+from unittest.mock import Mock
 import sys
 import os
 
@@ -16,19 +16,31 @@ import os
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from reflection_agent import ReflectionAgent
+from baseline_confidence_agent import BaselineConfidenceAgent
+from prioritized_replay import PriorityTrees, PrioritizedReplayBuffer, UniformReplayBuffer
+from reflection_population import ReflectionAgentPopulation
+from state_store import BoundedStateStore
+from dynamic_maze_env import BatchedDynamicMazeEnv
+
+
+@pytest.fixture
+def action_space():
+    """Create a mock action space for testing."""
+    mock_space = Mock()
+    mock_space.n = 4  # 4 actions: up, down, left, right
+    mock_space.sample.return_value = 2  # Return action 2 (left) as default
+    return mock_space
+
+
+@pytest.fixture
+def sample_goal():
+    """Create a sample goal position."""
+    return np.array([8, 8])
 
 
 class TestReflectionAgent:
     """Test suite for ReflectionAgent class."""
     
-    @pytest.fixture
-    def action_space(self):
-        """Create a mock action space for testing."""
-        mock_space = Mock()
-        mock_space.n = 4  # 4 actions: up, down, left, right
-        mock_space.sample.return_value = 2  # Return action 2 (left) as default
-        return mock_space
-    
     @pytest.fixture
     def agent(self, action_space):
         """Create a ReflectionAgent instance for testing."""
@@ -38,11 +50,6 @@ class TestReflectionAgent:
     def sample_state(self):
         """Create a sample state for testing."""
         return np.array([5, 5])
-    
-    @pytest.fixture
-    def sample_goal(self):
-        """Create a sample goal position."""
-        return np.array([8, 8])
 
     def test_agent_initialization(self, action_space):
         """Test that the agent initializes correctly with all required attributes."""
@@ -66,9 +73,10 @@ class TestReflectionAgent:
         assert agent.reflection_frequency == 5
         
         # Check experience buffer
-        assert isinstance(agent.experience_buffer, list)
-        assert isinstance(agent.experience_priorities, list)
+        assert isinstance(agent.experience_buffer, PrioritizedReplayBuffer)
+        assert len(agent.experience_priorities) == 0
         assert agent.max_buffer_size == 1000
+        assert agent.experience_buffer.capacity == 1000
 
     def test_set_goal_position(self, agent, sample_goal):
         """Test setting the goal position."""
@@ -179,6 +187,28 @@ class TestReflectionAgent:
         # After reflection_frequency calls, reflection_memory should be cleared
         assert len(agent.reflection_memory) == 0
 
+    def test_reflection_window_streaming_score(self):
+        """Test that the streaming window reproduces the per-window statistics."""
+        from reflection_window import ReflectionWindow
+        window = ReflectionWindow(capacity=4)
+        distances = [6, 5, 5, 7, 4, 3]
+        rewards = [-0.1, -0.1, -1.0, -0.1, 0.2, 10.0]
+        dones = [False] * 5 + [True]
+        for distance, reward, done in zip(distances, rewards, dones):
+            window.append(distance, reward, done)
+
+        progress = sum(distances[i - 1] - distances[i] for i in range(1, len(distances)))
+        assert window.progress == progress == 3
+        assert window.current_distance == 3
+        expected = 0.5 * progress / 6 + 0.3 * 1 / 6 + 0.2 * sum(rewards) / 6
+        assert window.performance_score(6) == pytest.approx(expected)
+        # The ring buffer keeps only the most recent entries
+        assert window.recent()[0].tolist() == [5, 7, 4, 3]
+
+        window.clear()
+        window.append(2, 0.0, False)
+        assert window.progress == 0 and window.current_distance == 0
+
     def test_environment_change_detection_in_learn(self, agent, sample_state):
         """Test environment change detection mechanism through the learn method."""
         action = 1
@@ -198,6 +228,17 @@ class TestReflectionAgent:
         agent.learn(sample_state, action, reward, different_next_state, False, 3, 10)
         assert agent.environment_stability < initial_stability
 
+    def test_transition_history_ring(self, agent):
+        """Test the fixed-depth ring of recent outcomes per state-action pair."""
+        history = agent.state_action_results
+        assert history.record((1, 1), 0, (1, 2), -0.1) is None
+        assert history.record((1, 1), 0, (1, 2), 0.3) is True
+        assert history.record((1, 1), 0, (1, 2), 1.0) is False  # Reward jumped by more than 0.5
+        assert history.record((1, 1), 0, (2, 1), 1.0) is False  # Different next state
+        # Only the last three outcomes are kept
+        assert history.results((1, 1), 0) == [((1, 2), 0.3), ((1, 2), 1.0), ((2, 1), 1.0)]
+        assert ((1, 1), 0) in history and ((1, 1), 1) not in history
+
     def test_adapt_strategy(self, agent):
         """Test strategy adaptation based on performance."""
         initial_epsilon = agent.epsilon
@@ -215,18 +256,52 @@ class TestReflectionAgent:
         # Should decrease exploration rate
         assert agent.epsilon <= initial_epsilon
 
+    def test_partial_q_resets_pick_rows_reproducibly(self, action_space):
+        """Test that the partial Q resets scale the chosen rows and follow the agent's seeded RNG."""
+        from gymnasium import spaces
+        observation_space = spaces.Box(low=0, high=9, shape=(2,), dtype=np.int32)
+        results = []
+        for kwargs in ({}, {'observation_space': observation_space}):
+            agent = ReflectionAgent(action_space, **kwargs)
+            agent.np_random = np.random.default_rng(5)
+            for i in range(100):
+                agent.q_table_short_term[divmod(i, 10)] = np.full(4, 1.0)
+            for i in range(10):  # Only the first row of states counts as low-confidence
+                for _ in range(3):
+                    agent.visit_counts.visit((0, i))
+            agent.recent_confidences.append(0.0)
+            agent.adapt_strategy(progress=0, current_distance=10)
+            halved = sorted(key for key, row in agent.q_table_short_term.items() if row[0] == 0.5)
+            assert len(halved) == 5 and all(key[0] == 0 for key in halved)
+            agent._adapt_to_environment_change()
+            scaled = sorted(key for key, row in agent.q_table_short_term.items() if row[0] in (0.8, 0.4))
+            assert len(scaled) == 20
+            results.append((halved, scaled))
+        # Both backends draw from the same seeded generator over the same row order
+        assert results[0] == results[1]
+
     def test_wall_memory_refresh(self, agent, sample_state):
-        """Test wall memory refresh mechanism."""
+        """Test lazy age-based expiry of wall memory."""
         # Add some wall memory
         state_key = tuple(sample_state)
-        agent.wall_memory[state_key] = {1, 2}
-        agent.wall_memory_age[state_key] = {1: 60, 2: 60}  # Old memories
+        agent.wall_memory.add(state_key, 1, step=0)
+        agent.wall_memory.add(state_key, 2, step=0)
+        assert agent.wall_memory[state_key] == {1, 2}
         
-        # Trigger refresh
-        agent._refresh_wall_memory()
+        # Young memories are never forgotten
+        assert agent.wall_memory.blocked_mask(state_key, step=500) == 0b0110
         
-        # Some memories should be removed due to age
-        assert len(agent.wall_memory.get(state_key, set())) <= 2
+        # Old memories are forgotten lazily at lookup time
+        agent.wall_memory.rng = np.random.default_rng(0)
+        assert agent.wall_memory.blocked_mask(state_key, step=10_000) == 0
+        assert state_key not in agent.wall_memory
+
+    def test_wall_memory_bulk_forget(self, agent):
+        """Test vectorized partial clearing of wall memory."""
+        for row in range(10):
+            agent.wall_memory.add((row, 0), 3, step=0)
+        agent.wall_memory.forget_fraction(0.4)
+        assert len(agent.wall_memory) == 6
 
     def test_experience_replay(self, agent, sample_state):
         """Test experience replay functionality."""
@@ -257,6 +332,15 @@ class TestReflectionAgent:
         # Check that knowledge was transferred
         assert state_key in agent.q_table_long_term
 
+    def test_select_extremes_matches_stable_sort(self):
+        """Test partition-based top/bottom-k selection, including ties."""
+        values = np.array([0.5, 0.9, 0.5, 0.1, 0.9, 0.5, 0.3])
+        for k in range(1, len(values) + 1):
+            top = ReflectionAgent._select_extremes(values, k)
+            bottom = ReflectionAgent._select_extremes(values, k, largest=False)
+            assert set(top.tolist()) == set(np.argsort(-values, kind='stable')[:k].tolist())
+            assert set(bottom.tolist()) == set(np.argsort(values, kind='stable')[:k].tolist())
+
     def test_adapt_to_environment_change(self, agent):
         """Test adaptation when environment change is detected."""
         initial_epsilon = agent.epsilon
@@ -271,6 +355,53 @@ class TestReflectionAgent:
         # Should increase reflection frequency (lower number = more frequent)
         assert agent.reflection_frequency <= initial_reflection_freq
 
+    def test_priority_reduction_is_reproducible(self, action_space):
+        """Test that the environment-change priority reduction draws from the agent's seeded RNG."""
+        priorities = []
+        for _ in range(2):
+            agent = ReflectionAgent(action_space)
+            agent.np_random = np.random.default_rng(7)
+            for i in range(10):
+                agent.experience_buffer.add((i, 0), 0, 0.0, (i, 1), False, 1.0)
+            agent._adapt_to_environment_change()
+            priorities.append(agent.experience_priorities.copy())
+        assert np.array_equal(priorities[0], priorities[1])
+        assert np.count_nonzero(priorities[0] == 0.5) == 5
+
+    def test_adaptation_events(self, agent, sample_goal, tmp_path):
+        """Test that adaptation steps are recorded as structured events instead of printed."""
+        import json
+        from events import EventLog, JsonlSink
+        agent.events = EventLog(capacity=4, sink=JsonlSink(tmp_path / 'events.jsonl', batch_size=2),
+                                min_interval=10)
+        agent.set_goal_position(sample_goal)
+        agent.set_goal_position(sample_goal)  # unchanged goal: no event
+        agent.wall_memory.add((1, 1), 0, 0)
+        agent._adapt_to_environment_change()
+        agent._adapt_to_environment_change()  # within min_interval: counted but not kept
+        agent.events.flush()
+
+        assert agent.events.counts == {'goal_change': 1, 'wall_memory_clear': 1, 'env_change': 2}
+        assert agent.events.suppressed == 1
+        assert [event['kind'] for event in agent.events.recent()] == ['goal_change', 'wall_memory_clear', 'env_change']
+        lines = [json.loads(line) for line in (tmp_path / 'events.jsonl').read_text().splitlines()]
+        assert lines == [json.loads(json.dumps(e, default=lambda v: v.tolist())) for e in agent.events.recent()]
+        assert lines[0]['goal'] == [8, 8]
+
+        for step in range(0, 100, 10):
+            agent.events.emit('env_change', step)
+        assert len(agent.events.recent()) == 4  # bounded ring buffer
+
+    def test_closing_event_log_writes_pending_events(self, tmp_path):
+        """Test that closing the event log (or leaving its with block) flushes the sink."""
+        from events import EventLog, JsonlSink
+        path = tmp_path / 'events.jsonl'
+        with EventLog(sink=JsonlSink(path, batch_size=100)) as events:
+            events.emit('env_change', 1)
+            events.tagged(env=0).emit('maze_update', 2, cells=3)
+            assert not path.exists()
+        assert len(path.read_text().splitlines()) == 2
+
     def test_learn_from_experience(self, agent):
         """Test learning from experience replay buffer."""
         # Add some experiences to the buffer
@@ -281,8 +412,7 @@ class TestReflectionAgent:
             next_state = tuple(np.array([6 + i % 3, 5]))
             done = False
             
-            agent.experience_buffer.append((state, action, reward, next_state, done))
-            agent.experience_priorities.append(1.0)
+            agent.experience_buffer.add(state, action, reward, next_state, done, 1.0)
         
         # Trigger experience replay learning
         agent._learn_from_experience()
@@ -304,14 +434,12 @@ class TestReflectionAgent:
         assert action in [0, 1, 2, 3]  # Should return valid action
         
         # Test with empty experience buffer
-        agent.experience_buffer = []
-        agent.experience_priorities = []
+        agent.experience_buffer.clear()
         agent._learn_from_experience()  # Should not crash
         
         # Test with empty wall memory
-        agent.wall_memory = {}
-        agent.wall_memory_age = {}
-        agent._refresh_wall_memory()  # Should not crash
+        agent.wall_memory.clear()
+        assert agent.wall_memory.blocked_mask((5, 5), agent.steps_count) == 0  # Should not crash
 
     def test_memory_balance_adjustment(self, agent, sample_state, sample_goal):
         """Test memory balance adjustment based on environment stability."""
@@ -362,8 +490,7 @@ class TestReflectionAgent:
             next_state = tuple(np.array([6 + i % 3, 5]))
             done = False
             
-            agent.experience_buffer.append((state, action, reward, next_state, done))
-            agent.experience_priorities.append(1.0 + i)  # Different priorities
+            agent.experience_buffer.add(state, action, reward, next_state, done, 1.0 + i)  # Different priorities
         
         # Trigger experience replay
         agent._learn_from_experience()
@@ -371,6 +498,482 @@ class TestReflectionAgent:
         # Should have processed experiences
         assert len(agent.experience_buffer) > 0
 
+    def test_integer_states(self, action_space):
+        """Test that the agent accepts flat integer states with a grid size."""
+        agent = ReflectionAgent(action_space, grid_size=10)
+        agent.set_goal_position(99)
+        assert agent.goal_pos.tolist() == [9, 9]
+
+        action = agent.select_action(12)
+        assert 0 <= action < 4
+        agent.learn(12, action, 1.0, 13, False, 1, 17)
+        assert 12 in agent.q_table_short_term
+        assert all(isinstance(key, int) for key in agent.q_table_short_term)
+
+    def test_grid_size_inferred_from_discrete_space(self, action_space):
+        """Test that index observations work without an explicit grid_size."""
+        from gymnasium import spaces
+        agent = ReflectionAgent(action_space, observation_space=spaces.Discrete(100))
+        assert agent.grid_size == 10
+        assert agent.q_table_short_term.shape == (10, 10)
+        agent.set_goal_position(88)
+        for step in range(12):
+            agent.learn(55, 1, -0.1, 65, False, step + 1, 10)
+        assert agent._state_to_coords(65) == (6, 5)
+
+        with pytest.raises(ValueError):
+            ReflectionAgent(action_space, observation_space=spaces.Discrete(50))
+        assert ReflectionAgent(action_space, grid_size=5, observation_space=spaces.Discrete(50)).grid_size == 5
+
+    def test_dense_q_table_matches_dict(self, action_space):
+        """Test that the dense Q-table backend behaves like the dict backend."""
+        from gymnasium import spaces
+        from dense_q_table import DenseQTable
+        observation_space = spaces.Box(low=0, high=9, shape=(2,), dtype=np.int32)
+        dict_agent = ReflectionAgent(action_space)
+        dense_agent = ReflectionAgent(action_space, observation_space=observation_space)
+        assert isinstance(dense_agent.q_table_short_term, DenseQTable)
+        assert dense_agent.q_table_short_term.grid.shape == (10, 10, 4)
+
+        rng = np.random.default_rng(0)
+        for agent in (dict_agent, dense_agent):
+            agent.q_table_long_term[(0, 0)] = np.full(4, 0.1)
+        for row in range(10):
+            for col in range(10):
+                q_values = rng.random(4)
+                for agent in (dict_agent, dense_agent):
+                    agent.q_table_short_term[(row, col)] = q_values
+                    agent.visit_counts[(row, col)] = (row + col) % 8
+
+        for agent in (dict_agent, dense_agent):
+            agent._transfer_knowledge()
+        assert set(dense_agent.q_table_long_term) == set(dict_agent.q_table_long_term)
+        for key in dict_agent.q_table_long_term:
+            assert np.allclose(dense_agent.q_table_long_term[key], dict_agent.q_table_long_term[key])
+
+        # Writes through the mapping API land in the dense array
+        dense_agent.q_table_short_term[(3, 4)][2] = 5.0
+        assert dense_agent.q_table_short_term.grid[3, 4, 2] == 5.0
+        del dense_agent.q_table_long_term[(0, 0)]
+        assert (0, 0) not in dense_agent.q_table_long_term
+        assert (10, 0) not in dense_agent.q_table_long_term
+
+    def test_max_q_index_tracks_every_write(self, action_space, sample_goal):
+        """Test that the per-state max-Q index stays equal to a full rescan of the Q arrays."""
+        from gymnasium import spaces
+        observation_space = spaces.Box(low=0, high=9, shape=(2,), dtype=np.int32)
+        for kwargs in ({'observation_space': observation_space}, {'max_states': 300, 'eviction_policy': 'value'}):
+            agent = ReflectionAgent(action_space, **kwargs)
+            agent.set_goal_position(sample_goal)
+            rng = np.random.default_rng(2)
+            moves = np.array([(-1, 0), (1, 0), (0, -1), (0, 1)])
+            for i in range(400):
+                state = rng.integers(0, 10, 2)
+                action = agent.select_action(state)
+                # Deterministic dynamics keep the environment stable enough for transfers
+                next_state = np.clip(state + moves[action], 0, 9)
+                reward = 1.0 if state[0] % 2 == 0 else -1.0
+                agent.learn(state, action, reward, next_state, False, i % 20 + 1, 10)
+                if i % 100 == 50:
+                    agent._adapt_to_environment_change()
+            assert agent.events.counts.get('knowledge_transfer', 0) > 0
+            agent._adapt_to_environment_change()  # scales a fifth of the short-term rows
+            for table in (agent.q_table_short_term, agent.q_table_long_term):
+                assert np.array_equal(table.max_q, table.q.max(axis=1))
+
+    def test_batch_replay_matches_sequential_updates(self, action_space):
+        """Test the batched replay kernel against per-sample Q-learning updates."""
+        from gymnasium import spaces
+        observation_space = spaces.Box(low=0, high=9, shape=(2,), dtype=np.int32)
+        dict_agent = ReflectionAgent(action_space)
+        dense_agent = ReflectionAgent(action_space, observation_space=observation_space)
+        # Two samples share (s, a) = ((1, 1), 0); no next state is updated in the batch
+        experiences = [((1, 1), 0, 1.0, (5, 5), False), ((1, 1), 0, 0.5, (6, 6), False),
+                       ((2, 2), 3, -1.0, (7, 7), False), ((3, 3), 1, 0.2, (5, 5), False)]
+        for agent in (dict_agent, dense_agent):
+            agent.q_table_short_term[(5, 5)] = np.array([0.1, 0.4, 0.0, 0.2])
+            agent.q_table_short_term[(1, 1)] = np.array([0.3, 0.0, 0.0, 0.0])
+            agent.experience_buffer.rng = np.random.default_rng(3)
+            for experience in experiences:
+                agent.experience_buffer.add(*experience, 1.0)
+            agent._learn_from_experience()
+
+        # Reference: sequential updates in the sampled order
+        reference = {(5, 5): np.array([0.1, 0.4, 0.0, 0.2]), (1, 1): np.array([0.3, 0.0, 0.0, 0.0])}
+        order = PrioritizedReplayBuffer(4, rng=np.random.default_rng(3))
+        for experience in experiences:
+            order.add(*experience, 1.0)
+        alpha, gamma = dict_agent.alpha, dict_agent.gamma
+        for state, action, reward, next_state, _ in order.get(order.sample(32)):
+            q = reference.setdefault(state, np.zeros(4))
+            next_max = np.max(reference.get(next_state, np.zeros(4)))
+            q[action] = (1 - alpha) * q[action] + alpha * (reward + gamma * next_max)
+
+        for state, q in reference.items():
+            assert np.allclose(dict_agent.q_table_short_term[state], q)
+            assert np.allclose(dense_agent.q_table_short_term[state], q)
+        assert np.allclose(dict_agent.experience_priorities, dense_agent.experience_priorities)
+        assert np.all(dense_agent.experience_priorities >= 0.01)
+
+    def test_unseen_states_share_default_row(self, agent, action_space):
+        """Test that reading unseen states allocates nothing and only written states get rows."""
+        assert not agent.default_q_values.flags.writeable
+        agent.set_goal_position(np.array([8, 8]))
+        agent.learn(np.array([1, 1]), 1, -0.1, np.array([2, 1]), False, 5, 10)
+        assert (1, 1) in agent.q_table_short_term and (1, 1) in agent.q_table_long_term
+        assert (2, 1) not in agent.q_table_short_term and (2, 1) not in agent.q_table_long_term
+        assert agent._q_values(agent.q_table_short_term, (2, 1)) is agent.default_q_values
+
+        baseline = BaselineConfidenceAgent(action_space)
+        for step in range(32):
+            baseline.learn(np.array([1, 1]), 1, 1.0, np.array([2, 1]), False, step, 10)
+        assert list(baseline.q_table) == [(1, 1)]
+        assert baseline.q_table[(1, 1)][1] == pytest.approx(1 - 0.9 ** 32)
+
+    def test_visit_counter_tracks_totals_and_actions(self, agent, sample_goal):
+        """Test running visit totals, per-action counts and bulk reset."""
+        agent.set_goal_position(sample_goal)
+        agent.epsilon = agent.epsilon_min = 0.0
+        for _ in range(3):
+            agent.select_action(np.array([5, 5]))
+        agent.select_action(np.array([2, 2]))
+        agent.visit_counts[(7, 7)] = 5
+
+        counts = agent.visit_counts
+        assert counts.total == sum(counts.values()) == 9
+        assert counts[(5, 5)] == 3 and counts[(9, 9)] == 0
+        assert counts.action_counts_for((5, 5)).sum() == 3
+        assert counts.counts_for([(5, 5), (7, 7), (0, 0)]).tolist() == [3, 5, 0]
+
+        # Untried actions get the larger exploration bonus
+        bonus = counts.ucb_bonus((5, 5))
+        tried = counts.action_counts_for((5, 5)) > 0
+        assert bonus[~tried].min() > bonus[tried].max()
+
+        counts.reset([(5, 5), (0, 0)])
+        assert counts.total == 6
+        assert counts.action_counts_for((5, 5)).sum() == 0
+
+    def test_perf_stats(self, action_space, sample_goal):
+        """Test opt-in per-phase timers, counters, gauges and reset."""
+        agent = ReflectionAgent(action_space)
+        agent.set_goal_position(sample_goal)
+        agent.learn(np.array([1, 1]), 0, 0.1, np.array([1, 2]), False, 1, 10)
+        assert agent.perf_stats() is None
+
+        agent.enable_perf_stats()
+        rng = np.random.default_rng(0)
+        for i in range(40):
+            agent.learn(rng.integers(0, 10, 2), i % 4, -1.0 if i % 5 == 0 else 0.1,
+                        rng.integers(0, 10, 2), False, i + 1, 10)
+        stats = agent.perf_stats()
+        phases = stats['phases']
+        assert list(phases)[:4] == ['td_error', 'change_detection', 'replay_insert', 'dual_update']
+        assert phases['td_error']['calls'] == phases['reflect']['calls'] == 40
+        assert 0 < phases['replay_learn']['calls'] < 40  # replay starts once 32 experiences are buffered
+        assert stats['total_ns'] == sum(phase['total_ns'] for phase in phases.values()) > 0
+        assert sum(phase['share'] for phase in phases.values()) == pytest.approx(1.0)
+        assert stats['counters']['reflections'] == 8
+        assert stats['gauges']['short_term_states'] == len(agent.q_table_short_term)
+        assert stats['gauges']['replay_size'] == 41
+
+        agent.reset_perf_stats()
+        assert agent.perf_stats()['phases'] == {}
+        agent.enable_perf_stats(False)
+        assert agent.perf_stats() is None
+
+    def test_checkpoint_round_trip(self, action_space, sample_goal, tmp_path):
+        """Test saving and memory-mapped loading of a trained agent."""
+        from gymnasium import spaces
+        observation_space = spaces.Box(low=0, high=9, shape=(2,), dtype=np.int32)
+        for kwargs, path in (({}, tmp_path / 'dict.npz'),
+                             ({'observation_space': observation_space}, tmp_path / 'dense')):
+            agent = ReflectionAgent(action_space, **kwargs)
+            agent.set_goal_position(sample_goal)
+            rng = np.random.default_rng(1)
+            for i in range(60):
+                state = rng.integers(0, 10, 2)
+                agent.select_action(state)
+                agent.learn(state, i % 4, -1.0 if i % 5 == 0 else 0.1, rng.integers(0, 10, 2), False, i, 10)
+            agent.save(path)
+
+            restored = ReflectionAgent(action_space, **kwargs).load(path, mmap=True)
+            assert restored.epsilon == agent.epsilon
+            assert restored.steps_count == agent.steps_count
+            for key in agent.q_table_short_term:
+                assert np.array_equal(restored.q_table_short_term[key], agent.q_table_short_term[key])
+            assert restored.visit_counts.total == agent.visit_counts.total
+            assert restored.visit_counts[(5, 5)] == agent.visit_counts[(5, 5)]
+            assert len(restored.wall_memory) == len(agent.wall_memory)
+            assert len(restored.state_action_results) == len(agent.state_action_results)
+            assert np.array_equal(restored.experience_priorities, agent.experience_priorities)
+
+            # A warm-started agent keeps learning
+            restored.learn(np.array([1, 1]), 0, 0.1, np.array([1, 2]), False, 1, 10)
+
+        with pytest.raises(ValueError):
+            ReflectionAgent(action_space).load(tmp_path / 'dense')
+
+
+class TestPrioritizedReplayBuffer:
+    """Test suite for the sum-tree prioritized replay buffer."""
+
+    def test_sampling_follows_priorities(self):
+        """Test that sampling is proportional to priority and without replacement."""
+        buffer = PrioritizedReplayBuffer(8, rng=np.random.default_rng(0))
+        for i in range(8):
+            buffer.add((i, 0), 0, 0.0, (i, 1), False, 1.0 if i < 7 else 9.0)
+        assert buffer.total_priority == pytest.approx(16.0)
+
+        counts = np.zeros(8)
+        for _ in range(2000):
+            indices = buffer.sample(1)
+            counts[indices] += 1
+        assert counts[7] / 2000 == pytest.approx(9 / 16, abs=0.05)
+
+        indices = buffer.sample(8)
+        assert sorted(indices.tolist()) == list(range(8))
+        assert buffer.total_priority == pytest.approx(16.0)
+
+    def test_full_buffer_evicts_lowest_priority(self):
+        """Test that a full buffer replaces the lowest-priority experience."""
+        buffer = PrioritizedReplayBuffer(5)
+        for i, priority in enumerate([3.0, 0.5, 2.0, 0.5, 4.0]):
+            buffer.add(i, 0, 0.0, i + 1, False, priority)
+        assert buffer.min_index() == 1
+
+        index = buffer.add(10, 2, 1.0, 11, True, 6.0)
+        assert index == 1
+        assert buffer.get([index]) == [(10, 2, 1.0, 11, True)]
+        assert buffer.min_index() == 3
+
+        buffer.update_priorities([3], [7.0])
+        assert buffer.min_index() == 2
+        assert buffer.priorities.tolist() == [3.0, 6.0, 2.0, 7.0, 4.0]
+
+    def test_stacked_trees_match_single_buffers(self):
+        """Test that each row of PriorityTrees behaves like its own single-tree buffer."""
+        rows = [[3.0, 0.5, 2.0, 0.5, 4.0], [1.0, 1.0, 0.25, 8.0, 2.0]]
+        trees = PriorityTrees(3, 5)
+        buffers = [PrioritizedReplayBuffer(5) for _ in rows]
+        for tree, (priorities, buffer) in enumerate(zip(rows, buffers)):
+            trees.update(tree, np.arange(5), priorities)
+            for i, priority in enumerate(priorities):
+                buffer.add(i, 0, 0.0, i, False, priority)
+
+        assert trees.min_leaves([0, 1]).tolist() == [buffer.min_index() for buffer in buffers]
+        np.testing.assert_allclose(trees.sum_tree[:2, 1], [buffer.total_priority for buffer in buffers])
+        # Tree 2 is empty and must never be drawn
+        owners, leaves = trees.sample([0, 1, 2], 5, np.random.default_rng(0))
+        for tree in range(2):
+            assert sorted(leaves[owners == tree].tolist()) == list(range(5))
+        assert not np.any(owners == 2)
+        np.testing.assert_array_equal(trees.leaves()[:2], rows)
+
+
+class TestBaselineConfidenceAgent:
+    """Test suite for the baseline agent's array replay."""
+
+    def test_ring_buffer_overwrites_oldest(self):
+        """Test that the uniform ring keeps the newest experiences in order."""
+        buffer = UniformReplayBuffer(4, rng=np.random.default_rng(0))
+        for i in range(6):
+            buffer.add((i, 0), i, 0.0, (i, 1), False)
+        assert len(buffer) == 4
+        assert buffer.to_arrays()['records']['action'].tolist() == [2, 3, 4, 5]
+        assert sorted(buffer.sample(4).tolist()) == [0, 1, 2, 3]
+
+        restored = UniformReplayBuffer(4)
+        restored.load_arrays(buffer.to_arrays())
+        restored.add((9, 0), 9, 0.0, (9, 1), False)
+        assert restored.to_arrays()['records']['action'].tolist() == [3, 4, 5, 9]
+
+    def test_dense_and_dict_tables_learn_identically(self, action_space, tmp_path):
+        """Test that the vectorized replay gives the same Q values with either table backend."""
+        from gymnasium import spaces
+        observation_space = spaces.Box(low=0, high=9, shape=(2,), dtype=np.int32)
+        agents = []
+        for kwargs in ({}, {'observation_space': observation_space}):
+            agent = BaselineConfidenceAgent(action_space, max_buffer_size=50, **kwargs)
+            agent.experience_buffer.rng = np.random.default_rng(3)
+            rng = np.random.default_rng(1)
+            for i in range(120):
+                state = rng.integers(0, 10, 2)
+                agent.learn(state, i % 4, -1.0 if i % 5 == 0 else 0.1, rng.integers(0, 10, 2), i % 40 == 39, i, 10)
+            agents.append(agent)
+        dict_agent, dense_agent = agents
+        assert len(dense_agent.experience_buffer) == 50
+        assert set(dict_agent.q_table) == set(dense_agent.q_table)
+        for key in dict_agent.q_table:
+            assert np.allclose(dict_agent.q_table[key], dense_agent.q_table[key])
+
+        dense_agent.save(tmp_path / 'baseline')
+        restored = BaselineConfidenceAgent(action_space, observation_space=observation_space,
+                                           max_buffer_size=50).load(tmp_path / 'baseline')
+        assert np.array_equal(restored.q_table.q, dense_agent.q_table.q)
+        assert np.array_equal(restored.experience_buffer.to_arrays()['records'],
+                              dense_agent.experience_buffer.to_arrays()['records'])
+
+
+class TestReflectionAgentPopulation:
+    """Test suite for the struct-of-arrays agent population."""
+
+    def test_learning_matches_scalar_agents(self):
+        """Test that deterministic learning matches one ReflectionAgent per population member."""
+        from gymnasium import spaces
+        alphas = [0.3, 0.5]
+        population = ReflectionAgentPopulation(2, 10, alpha=alphas, seed=0)
+        population.set_goal_positions([[9, 9], [9, 9]])
+        agents = []
+        for alpha in alphas:
+            agent = ReflectionAgent(spaces.Discrete(4), grid_size=10, observation_space=spaces.Discrete(100))
+            agent.alpha = alpha
+            agent.set_goal_position((9, 9))
+            agents.append(agent)
+
+        path = [(0, 3, 1, -0.1), (1, 1, 11, -0.1), (11, 3, 12, -0.1), (12, 1, 22, 0.5)] * 5
+        for state, action, next_state, reward in path:
+            for agent in agents:
+                agent.learn(state, action, reward, next_state, False, 3, 5)
+            population.learn([state] * 2, [action] * 2, [reward] * 2, [next_state] * 2,
+                             [False] * 2, [3] * 2, [5] * 2)
+
+        for i, agent in enumerate(agents):
+            np.testing.assert_allclose(population.q_short[i], agent.q_table_short_term.q)
+            np.testing.assert_allclose(population.q_long[i], agent.q_table_long_term.q)
+            assert population.epsilon[i] == pytest.approx(agent.epsilon)
+            assert population.alpha[i] == pytest.approx(agent.alpha)
+            assert population.environment_stability[i] == pytest.approx(agent.environment_stability)
+
+    def test_per_agent_parameters(self):
+        """Test that parameters broadcast per agent and unknown names are rejected."""
+        population = ReflectionAgentPopulation(3, 5, epsilon_min=[0.1, 0.2, 0.3])
+        assert population.epsilon_min.tolist() == [0.1, 0.2, 0.3]
+        assert population.gamma.tolist() == [0.9, 0.9, 0.9]
+        with pytest.raises(TypeError):
+            ReflectionAgentPopulation(3, 5, confidence=0.5)
+
+    def test_wall_expiry_matches_wall_memory(self):
+        """Test that the population forgets old walls with the same draws as WallMemory."""
+        from wall_memory import WallMemory
+        population = ReflectionAgentPopulation(1, 5, seed=0)
+        population.wall_forget_prob = 0.5
+        population.rng = np.random.default_rng(7)
+        memory = WallMemory(4, max_age=population.wall_max_age, check_interval=population.memory_refresh_freq,
+                            forget_prob=0.5, rng=np.random.default_rng(7))
+        for action in (0, 2, 3):
+            population.wall_bits[0, 3] |= 1 << action
+            population.wall_confirmed[0, 3, action] = 0
+            population.wall_checked[0, 3, action] = population.wall_max_age
+            memory.add(3, action, 0)
+
+        for step in range(0, 4000, 37):
+            population.steps_count[:] = step
+            assert population._blocked_mask(np.array([3]))[0] == memory.blocked_mask(3, step)
+        assert memory.blocked_mask(3, 4000) == 0
+
+    def test_change_detection_is_per_agent(self):
+        """Test that inconsistent outcomes only lower the affected agent's stability."""
+        population = ReflectionAgentPopulation(2, 5, seed=0)
+        population.learn([0, 0], [3, 3], [-0.1, -0.1], [1, 1], [False] * 2, [1] * 2, [4] * 2)
+        population.learn([0, 0], [3, 3], [-0.1, -1.0], [1, 0], [False] * 2, [1] * 2, [4] * 2)
+        assert population.environment_stability[0] == pytest.approx(1.0)
+        assert population.environment_stability[1] == pytest.approx(0.8)
+        assert population.wall_bits[1, 0] == 1 << 3
+        assert population.wall_bits[0, 0] == 0
+
+    def test_runs_with_batched_env(self):
+        """Test a short vectorized run against the batched maze environment."""
+        env = BatchedDynamicMazeEnv(4, size=6, seed=0, observation_mode='index')
+        population = ReflectionAgentPopulation(4, 6, max_buffer_size=50, seed=0,
+                                               environment_stability_threshold=[0.5, 0.6, 0.7, 0.8])
+        states, _ = env.reset(seed=0)
+        population.set_goal_positions(env.goal_pos)
+        steps = np.zeros(4, dtype=np.int64)
+        for _ in range(100):
+            shortest_paths = env.get_optimal_path_lengths()
+            actions = population.select_action(states)
+            assert actions.shape == (4,) and np.all((actions >= 0) & (actions < 4))
+            next_states, rewards, dones, _, _ = env.step(actions)
+            steps += 1
+            population.learn(states, actions, rewards, next_states, dones, steps, shortest_paths)
+            states = next_states
+
+        assert population.replay_sizes.tolist() == [50] * 4
+        trees = population.replay_trees
+        np.testing.assert_allclose(trees.sum_tree[:, 1], population.replay_priorities.sum(axis=1))
+        assert np.all(population.replay_priorities >= 0.005)
+        assert population.visit_totals.tolist() == [100] * 4
+
+
+class TestBoundedStateStore:
+    """Test suite for the bounded state store and bounded agent tables."""
+
+    def test_lru_eviction_skips_recent_states(self):
+        """Test that LRU evicts the least recently used states and notifies listeners."""
+        store = BoundedStateStore(4, policy='lru', min_age=1, evict_fraction=0.5)
+        evicted = []
+        store.on_evict(lambda rows: evicted.extend(store.key_of(row) for row in rows))
+        for key in ['a', 'b', 'c', 'd']:
+            store.index_of(key)
+        store.index_of('a')
+        store.index_of('e')
+        assert evicted == ['b', 'c']
+        assert 'a' in store and 'e' in store and 'b' not in store
+        assert store.stats() == {'states': 3, 'capacity': 4, 'evictions': 2, 'eviction_rounds': 1}
+
+    def test_lfu_eviction_prefers_rarely_used_states(self):
+        """Test that LFU evicts the least frequently used state."""
+        store = BoundedStateStore(3, policy='lfu', min_age=1, evict_fraction=0.1)
+        for key in ['a', 'a', 'b', 'c', 'c', 'a']:
+            store.index_of(key)
+        store.index_of('d')
+        assert 'b' not in store
+        assert len(store) == 3
+
+    def test_bounded_agent_tables_stay_within_budget(self, action_space, sample_goal):
+        """Test that every per-state table stays bounded and consistent under eviction."""
+        agent = ReflectionAgent(action_space, max_states=256, eviction_policy='value')
+        agent.set_goal_position(sample_goal)
+        for i in range(400):
+            state = np.array([i // 50, i % 50])
+            action = agent.select_action(state)
+            agent.learn(state, action, -0.1, np.array([i // 50, i % 50 + 1]), False, 5, 10)
+
+        store = agent.state_store
+        assert store.evictions > 0
+        assert len(store) <= 256
+        assert all(key in store for key in agent.q_table_short_term)
+        assert all(key in store for key in agent.q_table_long_term)
+        assert agent.visit_counts.total == agent.visit_counts.state_counts.sum()
+        assert len(agent.visit_counts) <= 256
+
+    def test_byte_budget_and_checkpoint(self, action_space, sample_goal, tmp_path):
+        """Test that a byte budget sets the capacity and the store survives a checkpoint."""
+        row_bytes = ReflectionAgent._state_row_bytes(action_space.n)
+        agent = ReflectionAgent(action_space, max_state_bytes=300 * row_bytes)
+        assert agent.state_store.num_states == 300
+        agent.set_goal_position(sample_goal)
+        for i in range(20):
+            agent.learn(np.array([i, 0]), 1, -0.1, np.array([i + 1, 0]), False, 5, 10)
+        agent.save(tmp_path / 'bounded.npz')
+
+        restored = ReflectionAgent(action_space, max_states=300).load(tmp_path / 'bounded.npz')
+        assert restored.state_store.stats() == agent.state_store.stats()
+        np.testing.assert_array_equal(restored.q_table_short_term[(3, 0)], agent.q_table_short_term[(3, 0)])
+        with pytest.raises(ValueError):
+            ReflectionAgent(action_space).load(tmp_path / 'bounded.npz')
+
+    def test_row_bytes_match_allocated_arrays(self, action_space):
+        """Test that the per-state byte sizes computed from dtypes match the arrays a bounded agent allocates."""
+        agent = ReflectionAgent(action_space, max_states=300)
+        arrays = [agent.state_store.last_used, agent.state_store.use_counts]
+        for table in (agent.q_table_short_term, agent.q_table_long_term):
+            arrays += [table.q, table.max_q, table.mask]
+        for component in (agent.visit_counts, agent.wall_memory, agent.state_action_results):
+            arrays += list(component.to_arrays().values())
+        assert sum(array.nbytes for array in arrays) == 300 * ReflectionAgent._state_row_bytes(action_space.n)
+
 
 if __name__ == "__main__":
     # Run tests with coverage
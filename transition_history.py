@@ -0,0 +1,116 @@
+import numpy as np
+from state_slots import StateSlots, grow_rows
+from checkpoint import prefixed, section
+
+
+def record_outcomes(next_states, rewards, counts, heads, index, next_state, reward, tolerance):
+    """在 index 处的结果环形数组中写入一次结果，返回 (是否与之前的结果一致, 是否有历史)
+
+    index 可以是 (行号, 动作)，也可以是同时选中多个位置的下标元组（例如 (智能体, 状态, 动作)），
+    next_state 和 reward 与之对应。下一状态不同或奖励差异超过 tolerance 时认为不一致。
+    TransitionHistory 和 ReflectionAgentPopulation 共用这一实现。
+    """
+    depth = next_states.shape[-1]
+    count = counts[index]
+    valid = np.arange(depth) < np.asarray(count)[..., None]
+    same_state = next_states[index] == np.asarray(next_state)[..., None]
+    same_reward = np.abs(rewards[index] - np.asarray(reward)[..., None]) <= tolerance
+    consistent = np.all((same_state & same_reward) | ~valid, axis=-1)
+
+    head = heads[index]
+    next_states[index + (head,)] = next_state
+    rewards[index + (head,)] = reward
+    heads[index] = (head + 1) % depth
+    counts[index] = np.minimum(count + 1, depth)
+    return consistent, count > 0
+
+
+class TransitionHistory:
+    """状态-动作对最近若干次结果的环形存储，用于检测环境变化
+
+    每个 (状态, 动作) 在 (状态数, 动作数, depth) 的数组中保存最近 depth 次的下一状态行号和
+    奖励；写入是 O(1) 的，一致性检查在这 depth 个结果上向量化完成。
+    """
+
+    def __init__(self, n_actions, key_index=None, depth=3, reward_tolerance=0.5, capacity=1024):
+        self.n_actions = n_actions
+        self.depth = depth
+        self.reward_tolerance = reward_tolerance
+        self.slots = StateSlots(key_index, capacity)
+        capacity = self.slots.capacity
+        self.next_states = np.zeros((capacity, n_actions, depth), dtype=np.intp)
+        self.rewards = np.zeros((capacity, n_actions, depth))
+        self.counts = np.zeros((capacity, n_actions), dtype=np.int8)
+        self.heads = np.zeros((capacity, n_actions), dtype=np.int8)
+
+    @classmethod
+    def row_nbytes(cls, n_actions, depth=3):
+        """每个状态占用的字节数（结果环形数组、计数、写入位置和行号簿记），由数据类型和形状算出"""
+        ring = (np.dtype(np.intp).itemsize + np.dtype(np.float64).itemsize) * depth
+        return (ring + 2 * np.dtype(np.int8).itemsize) * n_actions + StateSlots.row_nbytes()
+
+    def _slot(self, key):
+        slot = self.slots.slot(key)
+        if slot >= len(self.counts):
+            capacity = self.slots.capacity
+            self.next_states = grow_rows(self.next_states, capacity)
+            self.rewards = grow_rows(self.rewards, capacity)
+            self.counts = grow_rows(self.counts, capacity)
+            self.heads = grow_rows(self.heads, capacity)
+        return slot
+
+    def record(self, state_key, action, next_state_key, reward):
+        """记录一次结果，返回它是否与之前的结果一致（没有历史时返回 None）
+
+        下一状态不同或奖励差异超过 reward_tolerance 时认为不一致。
+        """
+        slot = self._slot(state_key)
+        next_slot = self._slot(next_state_key)
+        consistent, has_history = record_outcomes(self.next_states, self.rewards, self.counts, self.heads,
+                                                  (slot, action), next_slot, reward, self.reward_tolerance)
+        return bool(consistent) if has_history else None
+
+    def discard(self, slots):
+        """清除若干行的结果历史并释放这些行（共享的状态存储淘汰状态时调用）
+
+        以被淘汰状态为下一状态的历史也一并清除，因为这些行号之后会分配给别的状态。
+        """
+        self.counts[slots] = 0
+        self.heads[slots] = 0
+        recorded = np.arange(self.depth) < self.counts[..., None]
+        stale = (np.isin(self.next_states, slots) & recorded).any(axis=2)
+        self.counts[stale] = 0
+        self.heads[stale] = 0
+        self.slots.release(slots)
+
+    def results(self, state_key, action):
+        """按时间顺序返回某状态-动作对最近的 (下一状态, 奖励)"""
+        slot = self.slots.lookup(state_key)
+        if slot is None:
+            return []
+        count = int(self.counts[slot, action])
+        order = (self.heads[slot, action] - count + np.arange(count)) % self.depth
+        return [(self.slots.key_of(self.next_states[slot, action, i]), float(self.rewards[slot, action, i]))
+                for i in order]
+
+    def __contains__(self, state_action):
+        state_key, action = state_action
+        slot = self.slots.lookup(state_key)
+        return slot is not None and bool(self.counts[slot, action])
+
+    def __len__(self):
+        return int(np.count_nonzero(self.counts))
+
+    def to_arrays(self):
+        """导出为数组（用于检查点）"""
+        arrays = prefixed('slots', self.slots.to_arrays())
+        arrays.update(next_states=self.next_states, rewards=self.rewards, counts=self.counts, heads=self.heads)
+        return arrays
+
+    def load_arrays(self, arrays):
+        """从检查点数组恢复（数组可以是内存映射）"""
+        self.slots.load_arrays(section(arrays, 'slots'))
+        self.next_states = arrays['next_states']
+        self.rewards = arrays['rewards']
+        self.counts = arrays['counts']
+        self.heads = arrays['heads']
@@ -0,0 +1,131 @@
+import numpy as np
+from state_slots import StateSlots, grow_rows
+from checkpoint import prefixed, section
+
+
+class VisitCounter:
+    """带索引的访问计数器
+
+    每个状态键分配一个行号，状态访问次数和 (状态, 动作) 访问次数保存在数组中，同时维护
+    所有状态访问次数之和，因此 UCB 探索项的计算是 O(1) 的。读写单个状态的接口与
+    defaultdict(int) 相同（未访问的状态计为 0）。
+
+    提供 key_index（稠密 Q 表）时直接使用其行号，计数数组与 Q 数组按行对齐。
+    """
+
+    def __init__(self, n_actions, capacity=1024, key_index=None):
+        self.n_actions = n_actions
+        self.slots = StateSlots(key_index, capacity)
+        self.state_counts = np.zeros(self.slots.capacity, dtype=np.int64)
+        self.action_counts = np.zeros((self.slots.capacity, n_actions), dtype=np.int64)
+        self.total = 0
+
+    @property
+    def key_index(self):
+        return self.slots.key_index
+
+    @classmethod
+    def row_nbytes(cls, n_actions):
+        """每个状态占用的字节数（状态计数、各动作计数和行号簿记），由数据类型和形状算出"""
+        return np.dtype(np.int64).itemsize * (1 + n_actions) + StateSlots.row_nbytes()
+
+    def slot(self, key):
+        """返回状态键对应的行号，新状态分配新行"""
+        slot = self.slots.slot(key)
+        if slot >= len(self.state_counts):
+            self.state_counts = grow_rows(self.state_counts, self.slots.capacity)
+            self.action_counts = grow_rows(self.action_counts, self.slots.capacity)
+        return slot
+
+    def __contains__(self, key):
+        return self.slots.lookup(key) is not None
+
+    def __getitem__(self, key):
+        return self.get(key)
+
+    def __setitem__(self, key, value):
+        slot = self.slot(key)
+        self.total += value - int(self.state_counts[slot])
+        self.state_counts[slot] = value
+
+    def get(self, key, default=0):
+        slot = self.slots.lookup(key)
+        return default if slot is None else int(self.state_counts[slot])
+
+    def __len__(self):
+        return len(self.slots)
+
+    def __iter__(self):
+        return iter(self.slots.keys())
+
+    def keys(self):
+        return self.slots.keys()
+
+    def values(self):
+        return self.state_counts[self.slots.slots()].tolist()
+
+    def visit(self, key):
+        """记录一次状态访问"""
+        slot = self.slot(key)  # 先分配行号（可能扩充数组），再取数组
+        self.state_counts[slot] += 1
+        self.total += 1
+
+    def record_action(self, key, action):
+        """记录在某状态下选择了某个动作"""
+        slot = self.slot(key)
+        self.action_counts[slot, action] += 1
+
+    def action_counts_for(self, key):
+        """某状态下各动作的选择次数"""
+        slot = self.slots.lookup(key)
+        if slot is None:
+            return np.zeros(self.n_actions, dtype=np.int64)
+        return self.action_counts[slot].copy()
+
+    def counts_for(self, keys):
+        """批量读取状态访问次数，未访问的状态为 0"""
+        slots = self.slots.lookup_many(keys)
+        counts = self.state_counts[slots]
+        counts[slots < 0] = 0
+        return counts
+
+    def counts_at(self, slots):
+        """按行号批量读取状态访问次数（与 key_index 的行号对齐）"""
+        return self.state_counts[slots]
+
+    def reset(self, keys=None):
+        """批量清零访问计数；keys 为 None 时清零全部"""
+        if keys is None:
+            self.state_counts[:] = 0
+            self.action_counts[:] = 0
+            self.total = 0
+            return
+        slots = np.unique(self.slots.lookup_many(keys))
+        slots = slots[slots >= 0]
+        self.total -= int(self.state_counts[slots].sum())
+        self.state_counts[slots] = 0
+        self.action_counts[slots] = 0
+
+    def discard(self, slots):
+        """清除若干行的计数并释放这些行（共享的状态存储淘汰状态时调用）"""
+        self.total -= int(self.state_counts[slots].sum())
+        self.state_counts[slots] = 0
+        self.action_counts[slots] = 0
+        self.slots.release(slots)
+
+    def to_arrays(self):
+        """导出为数组（用于检查点）"""
+        arrays = prefixed('slots', self.slots.to_arrays())
+        arrays.update(state_counts=self.state_counts, action_counts=self.action_counts)
+        return arrays
+
+    def load_arrays(self, arrays):
+        """从检查点数组恢复（数组可以是内存映射）"""
+        self.slots.load_arrays(section(arrays, 'slots'))
+        self.state_counts = arrays['state_counts']
+        self.action_counts = arrays['action_counts']
+        self.total = int(self.state_counts.sum())
+
+    def ucb_bonus(self, key):
+        """每个动作的 UCB 探索项 sqrt(2 ln N / (n(s, a) + 1e-6))"""
+        return np.sqrt(2 * np.log(self.total) / (self.action_counts_for(key) + 1e-6))
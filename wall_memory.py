@@ -0,0 +1,131 @@
+import numpy as np
+from state_slots import StateSlots, grow_rows
+from checkpoint import prefixed, section
+
+
+def expire_walls(bits, confirmed, checked, index, step, max_age, check_interval, forget_prob, rng):
+    """惰性遗忘 index 处超过 max_age 步的墙壁记忆，写回数组并返回这些位置遗忘后的位掩码
+
+    index 可以是一个行号，也可以是同时选中多个位置的下标元组（例如 (智能体, 状态)），step 是
+    对应的当前步数。每经过 check_interval 步有 forget_prob 的概率遗忘一个方向。WallMemory 和
+    ReflectionAgentPopulation 共用这一实现。
+    """
+    current = bits[index]
+    if not np.any(current):
+        return current
+    actions = np.arange(confirmed.shape[-1])
+    step = np.asarray(step)[..., None]
+    last_checked = checked[index]
+    present = (current[..., None] >> actions) & 1 == 1
+    # 自上次评估以来经过了多少个检查周期
+    checks = (step - last_checked) // check_interval
+    due = present & (step - confirmed[index] > max_age) & (checks > 0)
+    if due.any():
+        survive = rng.random(due.shape) < (1 - forget_prob) ** np.maximum(checks, 0)
+        forget = due & ~survive
+        checked[index] = last_checked + np.where(due, checks * check_interval, 0)
+        current = current & ~(forget << actions).sum(axis=-1).astype(np.uint8)
+        bits[index] = current
+    return current
+
+
+class WallMemory:
+    """墙壁记忆：每个状态一个动作位掩码，加上每个方向最后一次确认撞墙的步数
+
+    年龄由当前步数减去时间戳隐式得到，不再定期遍历所有记忆。超过 max_age 步的记忆
+    在查询时惰性地按概率遗忘：每经过 check_interval 步有 forget_prob 的概率被遗忘。
+    """
+
+    def __init__(self, n_actions, key_index=None, max_age=1000, check_interval=20,
+                 forget_prob=0.2, rng=None, capacity=1024):
+        self.n_actions = n_actions
+        self.max_age = max_age
+        self.check_interval = check_interval
+        self.forget_prob = forget_prob
+        self.rng = rng if rng is not None else np.random.default_rng()
+        self.slots = StateSlots(key_index, capacity)
+        self.bits = np.zeros(self.slots.capacity, dtype=np.uint8)
+        self.confirmed = np.zeros((self.slots.capacity, n_actions), dtype=np.int64)
+        self.checked = np.zeros((self.slots.capacity, n_actions), dtype=np.int64)
+
+    @classmethod
+    def row_nbytes(cls, n_actions):
+        """每个状态占用的字节数（位掩码、两组时间戳和行号簿记），由数据类型和形状算出"""
+        return np.dtype(np.uint8).itemsize + 2 * np.dtype(np.int64).itemsize * n_actions + StateSlots.row_nbytes()
+
+    def _slot(self, key):
+        slot = self.slots.slot(key)
+        if slot >= len(self.bits):
+            self.bits = grow_rows(self.bits, self.slots.capacity)
+            self.confirmed = grow_rows(self.confirmed, self.slots.capacity)
+            self.checked = grow_rows(self.checked, self.slots.capacity)
+        return slot
+
+    def add(self, key, action, step):
+        """记录在 step 步确认某状态的 action 方向是墙"""
+        slot = self._slot(key)
+        self.bits[slot] |= 1 << action
+        self.confirmed[slot, action] = step
+        self.checked[slot, action] = step + self.max_age
+
+    def blocked_mask(self, key, step):
+        """返回某状态下已知墙壁方向的位掩码，并在查询时惰性遗忘过旧的记忆"""
+        slot = self.slots.lookup(key)
+        if slot is None:
+            return 0
+        return int(expire_walls(self.bits, self.confirmed, self.checked, slot, step,
+                                self.max_age, self.check_interval, self.forget_prob, self.rng))
+
+    def forget_fraction(self, fraction, rng=None):
+        """随机清除一部分状态的全部墙壁记忆（向量化），返回清除的状态数"""
+        remembered = np.flatnonzero(self.bits)
+        if remembered.size == 0:
+            return 0
+        rng = rng if rng is not None else self.rng
+        num_to_clear = max(1, int(remembered.size * fraction))
+        self.bits[rng.choice(remembered, num_to_clear, replace=False)] = 0
+        return num_to_clear
+
+    def clear(self):
+        """清除全部墙壁记忆"""
+        self.bits[:] = 0
+
+    def discard(self, slots):
+        """清除若干行的墙壁记忆并释放这些行（共享的状态存储淘汰状态时调用）"""
+        self.bits[slots] = 0
+        self.confirmed[slots] = 0
+        self.checked[slots] = 0
+        self.slots.release(slots)
+
+    def __contains__(self, key):
+        slot = self.slots.lookup(key)
+        return slot is not None and bool(self.bits[slot])
+
+    def __getitem__(self, key):
+        """某状态下记住的墙壁方向集合（不触发遗忘）"""
+        slot = self.slots.lookup(key)
+        if slot is None or not self.bits[slot]:
+            raise KeyError(key)
+        return {action for action in range(self.n_actions) if self.bits[slot] >> action & 1}
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __len__(self):
+        return int(np.count_nonzero(self.bits))
+
+    def to_arrays(self):
+        """导出为数组（用于检查点）"""
+        arrays = prefixed('slots', self.slots.to_arrays())
+        arrays.update(bits=self.bits, confirmed=self.confirmed, checked=self.checked)
+        return arrays
+
+    def load_arrays(self, arrays):
+        """从检查点数组恢复（数组可以是内存映射）"""
+        self.slots.load_arrays(section(arrays, 'slots'))
+        self.bits = arrays['bits']
+        self.confirmed = arrays['confirmed']
+        self.checked = arrays['checked']